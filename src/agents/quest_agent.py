@@ -3,7 +3,7 @@ import logging
 from datetime import datetime, timezone
 from enum import Enum
 from random import randint, random
-from typing import Dict, List
+from typing import Dict, List, Optional, Tuple
 
 from steamship import SteamshipError, Tag
 from steamship.agents.logging import AgentLogging
@@ -16,7 +16,7 @@ from generators.generator_context_utils import (
 )
 from schema.game_state import GameState
 from schema.quest import Quest, QuestChallenge, QuestDescription
-from schema.server_settings import Difficulty
+from schema.server_settings import ActionJudgmentMode, Difficulty
 from tools.end_quest_tool import EndQuestTool
 from utils.context_utils import (
     FinishActionException,
@@ -28,13 +28,21 @@ from utils.context_utils import (
 )
 from utils.generation_utils import (
     await_streamed_block,
+    discard_generation,
+    finish_generation,
+    generate_action_judgment,
     generate_is_solution_attempt,
     generate_likelihood_estimation,
     generate_quest_arc,
+    prefetch_action_choices,
     send_story_generation,
+    split_paragraphs,
+    start_is_solution_attempt,
+    start_likelihood_estimation,
 )
 from utils.interruptible_python_agent import InterruptiblePythonAgent
 from utils.moderation_utils import mark_block_as_excluded
+from utils.structured_output import parse_json_object
 from utils.tags import InstructionsTag, QuestIdTag, QuestTag, TagKindExtensions
 
 
@@ -71,6 +79,35 @@ LIKELIHOOD_MAP: Dict[Difficulty, Dict[Likelihood, float]] = {
 }
 
 
+_NUMBER_WORDS = ["zero", "one", "two", "three", "four", "five"]
+
+
+def describe_paragraphs(count: int, adjective: str = "") -> str:
+    """Describe `count` paragraphs for a story prompt, e.g. "two short paragraphs, separated by a blank line"."""
+    paragraphs = f"{adjective} paragraph" if adjective else "paragraph"
+    if count == 1:
+        return f"one {paragraphs}"
+    return f"{_NUMBER_WORDS[count]} {paragraphs}s, separated by a blank line"
+
+
+def parse_action_judgment(text: Optional[str]) -> Optional[Tuple[bool, Optional[str]]]:
+    """Parse the answer to `QuestAgent.judge_action`'s prompt into (is solution attempt, likelihood text).
+
+    Returns None if `text` holds no JSON object with a YES or NO "solution_attempt". The likelihood text is None if the
+    answer has none.
+    """
+    judgment = parse_json_object(text, required_keys=["solution_attempt"])
+    if not judgment:
+        return None
+    solution_attempt = judgment["solution_attempt"].strip().upper()
+    if solution_attempt not in ("YES", "NO"):
+        return None
+    likelihood = judgment.get("likelihood")
+    if not isinstance(likelihood, str) or not likelihood.strip():
+        likelihood = None
+    return solution_attempt == "YES", likelihood
+
+
 class QuestAgent(InterruptiblePythonAgent):
     """
     The quest agent goes on a quest!
@@ -109,8 +146,8 @@ class QuestAgent(InterruptiblePythonAgent):
         if not game_state.quest_arc:
             game_state.quest_arc = generate_quest_arc(game_state.player, context)
 
-        if len(game_state.quest_arc) >= len(game_state.quests):
-            quest_description = game_state.quest_arc[len(game_state.quests) - 1]
+        if len(game_state.quest_arc) >= game_state.quest_count():
+            quest_description = game_state.quest_arc[game_state.quest_count() - 1]
         else:
             logging.warning("QUEST DESCRIPTION IS NONE.")
             quest_description = None
@@ -234,9 +271,27 @@ class QuestAgent(InterruptiblePythonAgent):
                 return FinishAction(output=blocks)
 
             try:
-                # Was this an attempt to solve the problem, or some other action?
-                if self.is_solution_attempt(game_state, context, quest):
-                    if self.evaluate_solution(game_state, context, quest):
+                # Was this an attempt to solve the problem, or some other action? And if so, how likely is it to
+                # succeed?
+                judgment = None
+                if server_settings.action_judgment == ActionJudgmentMode.MERGED:
+                    judgment = self.judge_action(game_state, context, quest)
+                if judgment:
+                    is_solution_attempt, likelihood_text = judgment
+                elif server_settings.action_judgment == ActionJudgmentMode.SEQUENTIAL:
+                    is_solution_attempt = self.is_solution_attempt(
+                        game_state, context, quest
+                    )
+                    likelihood_text = None
+                else:
+                    (
+                        is_solution_attempt,
+                        likelihood_text,
+                    ) = self.judge_action_concurrently(game_state, context, quest)
+                if is_solution_attempt:
+                    if self.evaluate_solution(
+                        game_state, context, quest, likelihood_text
+                    ):
                         # TODO: tag last user message as solution
                         self.generate_solution(
                             game_state, context, quest, quest_description.goal
@@ -354,6 +409,7 @@ class QuestAgent(InterruptiblePythonAgent):
         quest: Quest,
         quest_description: QuestDescription,
     ):
+        num_paragraphs = randint(1, 2)  # noqa: S311
         if len(quest.challenges) > 0:
             # this is a specified-challenges type of quest
             solved_challenges = sum([1 if x.solution else 0 for x in quest.challenges])
@@ -372,7 +428,7 @@ class QuestAgent(InterruptiblePythonAgent):
                     f"DO NOT solve the challenge for {game_state.player.name}.\n"
                     f"The story MUST continue the current story arc of the quest. The story SHOULD allow "
                     f"{game_state.player.name} to decide how to attempt to solve the challenge.\n"
-                    f"Write exactly one paragraph in the tone of {server_settings.narrative_tone} "
+                    f"Write exactly {describe_paragraphs(num_paragraphs)} in the tone of {server_settings.narrative_tone} "
                     f"with {server_settings.narrative_voice}."
                 )
             else:
@@ -391,7 +447,7 @@ class QuestAgent(InterruptiblePythonAgent):
                 f"DO NOT solve the challenge for {game_state.player.name}.\n"
                 f"The story should allow {game_state.player.name} to decide how to attempt to complete their "
                 f"quest. The story MUST continue the current story arc of the quest.\n"
-                f"Write exactly one paragraph in the tone of {server_settings.narrative_tone} "
+                f"Write exactly {describe_paragraphs(num_paragraphs)} in the tone of {server_settings.narrative_tone} "
                 f"with {server_settings.narrative_voice}."
             )
         else:
@@ -408,77 +464,130 @@ class QuestAgent(InterruptiblePythonAgent):
                 f"DO NOT solve the challenge for {game_state.player.name}.\n"
                 f"The story MUST continue the current story arc of the quest. The story SHOULD allow "
                 f"{game_state.player.name} to decide how to attempt to solve the challenge.\n"
-                f"Write exactly one paragraph in the tone of {server_settings.narrative_tone} "
+                f"Write exactly {describe_paragraphs(num_paragraphs)} in the tone of {server_settings.narrative_tone} "
                 f"with {server_settings.narrative_voice}."
             )
 
-        num_paragraphs = randint(1, 2)  # noqa: S311
         problem_block = send_story_generation(
             prompt=prompt,
             quest_name=quest.name,
             context=context,
+            paragraphs=num_paragraphs,
         )
         updated_problem_block = await_streamed_block(problem_block, context)
-        quest.current_problem = updated_problem_block.text
-
-        if num_paragraphs > 1:
-            # replace "Tell the" with "Continue telling the" and re-prompt
-            if prompt.startswith("Tell the story"):
-                new_prompt = prompt.removeprefix("Tell the story")
-                prompt = f"Continue telling the story{new_prompt}"
-            problem_block = send_story_generation(
-                prompt=prompt,
-                quest_name=quest.name,
-                context=context,
-            )
-            updated_problem_block = await_streamed_block(problem_block, context)
-            quest.current_problem = (
-                f"{quest.current_problem}\n{updated_problem_block.text}"
-            )
+        problem_paragraphs = split_paragraphs(updated_problem_block.text) or [
+            updated_problem_block.text
+        ]
+        quest.current_problem = "\n".join(problem_paragraphs)
 
+        # The scene is set by the paragraph the problem ends on.
         if image_gen := get_quest_background_image_generator(context):
             image_gen.request_scene_image_generation(
-                description=updated_problem_block.text, context=context
+                description=problem_paragraphs[-1], context=context
             )
         if music_gen := get_music_generator(context):
             if server_settings.generate_music:
                 music_gen.request_scene_music_generation(
-                    description=updated_problem_block.text, context=context
+                    description=problem_paragraphs[-1], context=context
                 )
+        # Have help ready by the time the player asks for it.
+        prefetch_action_choices(quest, context)
 
-    def is_solution_attempt(
+    def judge_action(
         self, game_state: GameState, context: AgentContext, quest: Quest
-    ):
+    ) -> Optional[Tuple[bool, str]]:
+        """Return whether the player's last action is an attempt to solve the problem, and how likely it is to succeed.
+
+        Returns None if the generation doesn't answer both in the expected format.
+        """
         prompt = (
             f"{game_state.player.name}'s current problem is: \n{quest.current_problem}\n"
             f"{game_state.player.name} decides to {quest.user_problem_solutions[-1]}. "
             f'Is "{quest.user_problem_solutions[-1]}" an attempt to solve the current problem, or just an intermediate investigative action? '
-            f"Respond with YES if this is an attempt to solve the problem, or NO if it is not."
+            f"If it is an attempt, how likely is it to succeed? "
+            f"Please consider their abilities and whether any referenced objects are nearby or in their inventory. "
+            f'ONLY RESPOND WITH A JSON OBJECT ON ONE LINE, like {{"solution_attempt": "YES", "likelihood": "LIKELY"}}, '
+            f'where "solution_attempt" is YES or NO and "likelihood" is one of [VERY UNLIKELY, UNLIKELY, LIKELY, VERY LIKELY].'
         )
-        is_solution_attempt_response = generate_is_solution_attempt(
+        judgment_block = generate_action_judgment(
             prompt=prompt,
             quest_name=quest.name,
             context=context,
         )
-        logging.debug(f"Is solution attempt: {is_solution_attempt_response.text}")
-        return is_solution_attempt_response.text.upper() == "YES"
+        logging.debug(f"Action judgment: {judgment_block.text}")
+        return parse_action_judgment(judgment_block.text)
 
-    def evaluate_solution(
+    def judge_action_concurrently(
         self, game_state: GameState, context: AgentContext, quest: Quest
-    ):
-        server_settings = get_server_settings(context)
-        prompt = (
+    ) -> Tuple[bool, Optional[str]]:
+        """Return whether the player's last action is an attempt to solve the problem, and how likely it is to succeed.
+
+        Both are asked for at once, in separate generations. The likelihood is only waited for (and returned) if the
+        action is an attempt.
+        """
+        is_solution_attempt_task = start_is_solution_attempt(
+            prompt=self.is_solution_attempt_prompt(game_state, quest),
+            quest_name=quest.name,
+            context=context,
+        )
+        likelihood_task = start_likelihood_estimation(
+            prompt=self.likelihood_prompt(game_state, quest),
+            quest_name=quest.name,
+            context=context,
+        )
+        is_solution_attempt_response = finish_generation(
+            is_solution_attempt_task, context
+        )
+        logging.debug(f"Is solution attempt: {is_solution_attempt_response.text}")
+        if is_solution_attempt_response.text.upper() != "YES":
+            discard_generation(likelihood_task)
+            return False, None
+        return True, finish_generation(likelihood_task, context).text
+
+    def is_solution_attempt_prompt(self, game_state: GameState, quest: Quest) -> str:
+        return (
+            f"{game_state.player.name}'s current problem is: \n{quest.current_problem}\n"
+            f"{game_state.player.name} decides to {quest.user_problem_solutions[-1]}. "
+            f'Is "{quest.user_problem_solutions[-1]}" an attempt to solve the current problem, or just an intermediate investigative action? '
+            f"Respond with YES if this is an attempt to solve the problem, or NO if it is not."
+        )
+
+    def likelihood_prompt(self, game_state: GameState, quest: Quest) -> str:
+        return (
             f"{game_state.player.name} tries to solve the problem by: {quest.user_problem_solutions[-1]}. "
             f"How likely is this to succeed? "
             f"Please consider their abilities and whether any referenced objects are nearby or in their inventory. "
             f"ONLY RESPOND WITH ONE OF [VERY UNLIKELY, UNLIKELY, LIKELY, VERY LIKELY]"
         )
-        likelihood_block = generate_likelihood_estimation(
-            prompt=prompt,
+
+    def is_solution_attempt(
+        self, game_state: GameState, context: AgentContext, quest: Quest
+    ):
+        is_solution_attempt_response = generate_is_solution_attempt(
+            prompt=self.is_solution_attempt_prompt(game_state, quest),
             quest_name=quest.name,
             context=context,
         )
-        likelihood_text = likelihood_block.text.upper()
+        logging.debug(f"Is solution attempt: {is_solution_attempt_response.text}")
+        return is_solution_attempt_response.text.upper() == "YES"
+
+    def evaluate_solution(
+        self,
+        game_state: GameState,
+        context: AgentContext,
+        quest: Quest,
+        likelihood_text: Optional[str] = None,
+    ):
+        """Roll for the success of the player's solution, given (or else asking for) the likelihood that it succeeds."""
+        server_settings = get_server_settings(context)
+        if likelihood_text is None:
+            likelihood_block = generate_likelihood_estimation(
+                prompt=self.likelihood_prompt(game_state, quest),
+                quest_name=quest.name,
+                context=context,
+            )
+            likelihood_text = likelihood_block.text
+        likelihood_text = likelihood_text.upper()
         likelihood_map = LIKELIHOOD_MAP.get(server_settings.difficulty)
         if "VERY UNLIKELY" in likelihood_text:
             required_roll = likelihood_map[Likelihood.VERY_UNLIKELY]
@@ -523,7 +632,7 @@ class QuestAgent(InterruptiblePythonAgent):
         server_settings = get_server_settings(context=context)
         prompt = (
             f"{game_state.player.name} tries to solve the problem by: {quest.user_problem_solutions[-1]}, and it totally works.\n"
-            f"Describe what happens in one paragraph. As part of the description, DO NOT have "
+            f"Describe what happens in {describe_paragraphs(num_paragraphs)}. As part of the description, DO NOT have "
             f"{game_state.player.name} completing the quest goal of {quest_goal}. "
             f"Tell the story using a tone of {server_settings.narrative_tone} and with a narrative voice of "
             f"{server_settings.narrative_voice}."
@@ -532,22 +641,9 @@ class QuestAgent(InterruptiblePythonAgent):
             prompt=prompt,
             quest_name=quest.name,
             context=context,
+            paragraphs=num_paragraphs,
         )
         await_streamed_block(solution_block, context)
-        if num_paragraphs > 1:
-            prompt = (
-                f"Continue the story of {game_state.player.name} solving the problem by: {quest.user_problem_solutions[-1]}.\n"
-                f"Describe what happens in one paragraph. As part of the description, DO NOT have "
-                f"{game_state.player.name} completing the quest goal of {quest_goal}. "
-                f"Tell the story using a tone of {server_settings.narrative_tone} and with a narrative voice of "
-                f"{server_settings.narrative_voice}."
-            )
-            solution_block = send_story_generation(
-                prompt=prompt,
-                quest_name=quest.name,
-                context=context,
-            )
-            await_streamed_block(solution_block, context)
 
     def describe_failure(
         self, game_state: GameState, context: AgentContext, quest: Quest
@@ -556,7 +652,7 @@ class QuestAgent(InterruptiblePythonAgent):
         server_settings = get_server_settings(context=context)
         prompt = (
             f"{game_state.player.name} tries to solve the problem by: {quest.user_problem_solutions[-1]}, and it fails.\n"
-            f"Describe what happens in one short paragraph. "
+            f"Describe what happens in {describe_paragraphs(num_paragraphs, 'short')}. "
             f"Tell the story using a tone of {server_settings.narrative_tone} and with a narrative voice of "
             f"{server_settings.narrative_voice}."
         )
@@ -564,21 +660,9 @@ class QuestAgent(InterruptiblePythonAgent):
             prompt=prompt,
             quest_name=quest.name,
             context=context,
+            paragraphs=num_paragraphs,
         )
         await_streamed_block(solution_block, context)
-        if num_paragraphs > 1:
-            prompt = (
-                f"Continue telling the story of {game_state.player.name} failing to solve the problem by: {quest.user_problem_solutions[-1]}.\n"
-                f"Describe what happens in one short paragraph. "
-                f"Tell the story using a tone of {server_settings.narrative_tone} and with a narrative voice of "
-                f"{server_settings.narrative_voice}."
-            )
-            solution_block = send_story_generation(
-                prompt=prompt,
-                quest_name=quest.name,
-                context=context,
-            )
-            await_streamed_block(solution_block, context)
 
     def describe_non_solution(
         self, game_state: GameState, context: AgentContext, quest: Quest
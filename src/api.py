@@ -2,7 +2,6 @@ import json
 import logging
 import pathlib
 import textwrap
-import time
 from typing import Any, Dict, List, Optional, Type, Union, cast
 
 from pydantic import Field
@@ -13,7 +12,7 @@ from steamship.agents.logging import AgentLogging
 from steamship.agents.mixins.transports.slack import SlackTransport
 from steamship.agents.mixins.transports.steamship_widget import SteamshipWidgetTransport
 from steamship.agents.mixins.transports.telegram import TelegramTransport
-from steamship.agents.schema import Agent, AgentContext, Tool
+from steamship.agents.schema import Agent, AgentContext, ChatHistory, Tool
 from steamship.data import TagKind
 from steamship.data.block import Block, StreamState
 from steamship.data.tags.tag_constants import RoleTag
@@ -37,7 +36,16 @@ from schema.characters import HumanCharacter
 from schema.game_state import ActiveMode
 from schema.server_settings import ServerSettings
 from utils.agent_service import AgentService
-from utils.context_utils import get_game_state, save_game_state, save_server_settings
+from utils.context_utils import (
+    chat_histories_since,
+    chat_history_blocks_after,
+    get_block,
+    get_game_state,
+    save_game_state,
+    save_server_settings,
+)
+from utils.moderation_utils import is_block_excluded
+from utils.stream_waiter import StreamTimeoutError, StreamWaiter
 from utils.tags import TagKindExtensions
 
 
@@ -255,7 +263,8 @@ class AdventureGameService(AgentService):
 
 
 class GameREPL(AgentREPL):
-    last_seen_block = 0
+    last_seen_blocks: Dict[str, int]  # By chat history file ID
+    last_seen_history: Optional[ChatHistory] = None
 
     def __init__(
         self,
@@ -275,6 +284,7 @@ class GameREPL(AgentREPL):
             **kwargs,
         )
         self.agent_instance = self.agent_class(client=client, config=self.config)
+        self.last_seen_blocks = {}
 
     def run_with_client(self, client: Steamship, **kwargs):
         # Override so we can not clobber self.agent_instance
@@ -308,27 +318,30 @@ class GameREPL(AgentREPL):
     def print_object_or_objects(
         self, output: Union[List, Any], metadata: Optional[Dict[str, Any]] = None
     ):
-        context = AgentContext.get_or_create(
-            client=self.agent_instance.client,
-            context_keys={"id": "default"},
-            searchable=False,
-        )
-        for block in context.chat_history.file.blocks:
-            if block.index_in_file > self.last_seen_block:
+        # Share the agent's own context: a single refresh per turn brings in the blocks plugins appended server-side,
+        # and only the blocks after the last one printed are walked.
+        context = self.agent_instance.build_default_context()
+        if self.last_seen_history is None:
+            # Skip the system message the game starts with.
+            self.last_seen_blocks[context.chat_history.file.id] = 0
+        for history in chat_histories_since(self.last_seen_history, context):
+            history.file.refresh()
+            for block in chat_history_blocks_after(
+                self.last_seen_blocks.get(history.file.id, -1), context, history
+            ):
+                self.last_seen_blocks[history.file.id] = block.index_in_file
+                if is_block_excluded(block):
+                    continue
                 if block.stream_state == StreamState.STARTED:
-                    start_time = time.perf_counter()
-                    while (
-                        block.stream_state
-                        not in [
-                            StreamState.COMPLETE,
-                            StreamState.ABORTED,
-                        ]
-                        and (time.perf_counter() - start_time) < 30
-                    ):
-                        time.sleep(0.4)
-                        block = Block.get(block.client, _id=block.id)
-            self.print_new_block(block)
-        self.last_seen_block = context.chat_history.file.blocks[-1].index_in_file
+                    try:
+                        block = StreamWaiter(
+                            deadline=30, fetch=lambda b: get_block(b.id, context)
+                        ).wait(block)
+                    except StreamTimeoutError as e:
+                        logging.warning(e.message)
+                        block = e.block  # Show what there is of it
+                self.print_new_block(block)
+        self.last_seen_history = context.chat_history
         super().print_object_or_objects(output, metadata)
 
     def print_new_block(self, block: Block):
@@ -1,4 +1,3 @@
-import json
 from typing import List
 
 from steamship import Steamship, SteamshipError
@@ -6,7 +5,7 @@ from steamship.agents.service.agent_service import AgentService
 from steamship.invocable import post
 from steamship.invocable.package_mixin import PackageMixin
 
-from utils.generation_utils import generate_action_choices
+from utils.generation_utils import get_action_choices
 
 
 class HelpMixin(PackageMixin):
@@ -21,12 +20,14 @@ class HelpMixin(PackageMixin):
 
     @post("/generate_action_choices")
     def generate_action_choices(self, **kwargs) -> List[str]:
-        """Generate (synchronously) a JSON List of multiple choice options for user actions in a quest."""
+        """Return a JSON List of multiple choice options for user actions in a quest.
+
+        The choices are generated in the background once the quest presents a problem; if they aren't, they are
+        generated synchronously.
+        """
         try:
             context = self.agent_service.build_default_context()
-            choices_json_block = generate_action_choices(context=context)
-            choices = json.loads(choices_json_block.text)
-            return choices
+            return get_action_choices(context=context)
 
         except BaseException as e:
             raise SteamshipError(
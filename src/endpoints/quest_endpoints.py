@@ -9,14 +9,18 @@ from steamship.invocable.package_mixin import PackageMixin
 
 from tools.end_quest_tool import EndQuestTool
 from tools.start_quest_tool import StartQuestTool
+from utils.ChatHistoryFilter import ChatHistoryIndex
 from utils.context_utils import (
     get_audio_narration_generator,
+    get_block,
     get_game_state,
+    get_quest,
+    get_quest_chat_history,
     save_game_state,
 )
 from utils.error_utils import record_and_throw_unrecoverable_error
 from utils.generation_utils import generate_quest_arc
-from utils.tags import QuestIdTag, SceneTag, TagKindExtensions
+from utils.tags import SceneTag, TagKindExtensions
 
 
 class QuestMixin(PackageMixin):
@@ -71,36 +75,36 @@ class QuestMixin(PackageMixin):
         try:
             blocks = []
 
-            def matches_quest(_block: Block, _quest_id: str) -> bool:
-                for tag in _block.tags or []:
-                    if QuestIdTag.matches(tag, _quest_id):
-                        return True
-                return False
-
-            if (
-                context.chat_history
-                and context.chat_history.file
-                and context.chat_history.file.blocks
-            ):
-                for block in context.chat_history.file.blocks:
-                    if matches_quest(block, quest_id):
-                        blocks.append(block)
+            # Quests keep their story in a chat history of their own (see `start_quest_chat_history`).
+            chat_history = get_quest_chat_history(quest_id, context)
+            if chat_history and chat_history.file and chat_history.file.blocks:
+                index = ChatHistoryIndex.for_file(chat_history.file)
+                for position in sorted(set(index.with_quest_id(quest_id))):
+                    blocks.append(chat_history.file.blocks[position])
 
             return [block.dict(by_alias=True) for block in blocks]
         except BaseException as e:
             record_and_throw_unrecoverable_error(e, context)
 
+    @post("/get_quest_details")
+    def get_quest_details(self, quest_id: str, **kwargs) -> dict:
+        """Gets the full record of a quest, including archived ones."""
+        context = self.agent_service.build_default_context()
+        quest = get_quest(quest_id, context)
+        if quest is None:
+            raise SteamshipError(message=f"Unable to find quest {quest_id}.")
+        return quest.dict()
+
     @post("/narrate_block")
     def narrate_block(self, block_id: str, **kwargs) -> dict:
         """Returns a streaming narration for a block."""
-        block = Block.get(self.client, _id=block_id)
         context = self.agent_service.build_default_context()
+        block = get_block(block_id, context)
         new_block = QuestMixin._narrate_block(block, context)
         return {"url": new_block.to_public_url()}
 
     @staticmethod
     def _narrate_block(block: Block, context: AgentContext) -> Block:
-
         # Only narrate if it's actually
         if not block.is_text():
             raise SteamshipError(
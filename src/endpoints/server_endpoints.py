@@ -223,6 +223,7 @@ class ServerSettingsMixin(PackageMixin):
 
             try:
                 updated_server_settings = ServerSettings.parse_obj(server_settings_dict)
+                updated_server_settings.continue_from(server_settings)
                 save_server_settings(updated_server_settings, context)
             except BaseException as e:
                 logging.error(e)
@@ -1,7 +1,13 @@
-from typing import Callable, Mapping, List, Dict, Optional
+import logging
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+from enum import Enum
+from typing import Any, Callable, Dict, List, Mapping, Optional, Tuple
 
 from pydantic import PrivateAttr
-from steamship import PluginInstance
+from steamship import PluginInstance, Task, TaskState
 
 InstanceProvider = Callable[[], PluginInstance]
 
@@ -12,75 +18,346 @@ class ExhaustedPluginsException(Exception):
         message = []
         for plugin_name, e in exceptions.items():
             message.append(f"- {plugin_name}: {str(e)}\n")
-        message_str = f"Plugin calls exhausted with following exceptions:\n{''.join(message)}"
+        message_str = (
+            f"Plugin calls exhausted with following exceptions:\n{''.join(message)}"
+        )
         super().__init__(message_str)
 
 
+class CircuitState(str, Enum):
+    CLOSED = "closed"  # Healthy: calls go to the provider
+    OPEN = "open"  # Failing: calls skip the provider, unless every other one fails too
+    HALF_OPEN = "half_open"  # Open for long enough: one call probes whether the provider has recovered
+
+
+class ProviderHealth:
+    """The recent record of one provider, which decides whether calls should go to it.
+
+    A provider's circuit opens after `failure_threshold` consecutive failures, and half-opens `open_seconds` later. If
+    the call probing it then fails, it opens again for twice as long (up to `max_open_seconds`); if it succeeds, it
+    closes. Only one call probes at a time, unless the probe hasn't ended within the time the circuit was open for.
+    """
+
+    def __init__(
+        self,
+        failure_threshold: int = 3,
+        open_seconds: float = 30,
+        max_open_seconds: float = 300,
+        latency_smoothing: float = 0.3,
+    ):
+        self.failure_threshold = failure_threshold
+        self.open_seconds = open_seconds
+        self.max_open_seconds = max_open_seconds
+        self.latency_smoothing = latency_smoothing
+        self.consecutive_failures = 0
+        self.failures = 0
+        self.successes = 0
+        self.latency_ewma: Optional[float] = None
+        self._opened_at: Optional[float] = None
+        self.current_open_seconds = open_seconds  # Doubles with each failed probe
+        self._probe_started_at: Optional[float] = None
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> CircuitState:
+        if self._opened_at is None:
+            return CircuitState.CLOSED
+        if time.monotonic() - self._opened_at >= self.current_open_seconds:
+            return CircuitState.HALF_OPEN
+        return CircuitState.OPEN
+
+    def should_call(self) -> bool:
+        """Return whether a call should go to the provider now. If it should as the probe, that call is the probe."""
+        with self._lock:
+            state = self.state
+            if state == CircuitState.CLOSED:
+                return True
+            if state == CircuitState.OPEN:
+                return False
+            now = time.monotonic()
+            if (
+                self._probe_started_at is not None
+                and now - self._probe_started_at < self.current_open_seconds
+            ):
+                return False
+            self._probe_started_at = now
+            return True
+
+    def record_success(self, seconds: Optional[float]):
+        """Record a successful call that took `seconds`, or None if how long it took says nothing about the provider."""
+        with self._lock:
+            self._probe_started_at = None
+            self.successes += 1
+            self.consecutive_failures = 0
+            if seconds is not None and self.latency_ewma is None:
+                self.latency_ewma = seconds
+            elif seconds is not None:
+                self.latency_ewma += self.latency_smoothing * (
+                    seconds - self.latency_ewma
+                )
+            self._opened_at = None
+            self.current_open_seconds = self.open_seconds
+
+    def record_failure(self) -> bool:
+        """Record a failed call. Return whether that opened the circuit."""
+        with self._lock:
+            self._probe_started_at = None
+            self.failures += 1
+            self.consecutive_failures += 1
+            state = self.state
+            if state == CircuitState.HALF_OPEN:
+                # The probe failed: back off further.
+                self.current_open_seconds = min(
+                    self.current_open_seconds * 2, self.max_open_seconds
+                )
+            elif (
+                state == CircuitState.OPEN
+                or self.consecutive_failures < self.failure_threshold
+            ):
+                return False
+            self._opened_at = time.monotonic()
+            return True
+
+
+class _PendingTask:
+    """A task a provider is running, and what to call with its outcome (and how long it took) once it finishes."""
+
+    def __init__(
+        self,
+        on_finished: Callable[[Task, Optional[float]], None],
+        submitted_at: float,
+    ):
+        self.on_finished = on_finished
+        self.submitted_at = submitted_at
+        self.measures_latency = True
+
+
+# The tasks started through a CascadingPlugin in this process and not yet seen to finish, by task ID, oldest first. They
+# are looked up by ID, so that a task reports whichever Task object is seen to finish: the one returned by the call, or
+# one re-created from its ID later on (see `report_finished`).
+_pending_tasks: "OrderedDict[str, _PendingTask]" = OrderedDict()
+_pending_tasks_lock = threading.Lock()
+_MAX_PENDING_TASKS = 1024
+
+_FINISHED_TASK_STATES = (TaskState.succeeded, TaskState.failed)
+
+
+def report_finished(task: Task):
+    """Record the outcome of `task` with the provider that ran it, if it was started through a CascadingPlugin and has
+    finished. Only the first report of a task counts.
+
+    MonitoredTasks report themselves when refreshed. Call this for Tasks re-created from the ID of one, e.g. by
+    `Task.get` in a later invocation, once they are seen to finish.
+    """
+    if task.state not in _FINISHED_TASK_STATES or not task.task_id:
+        return
+    with _pending_tasks_lock:
+        pending = _pending_tasks.pop(task.task_id, None)
+    if pending is None:
+        return
+    seconds = None
+    if pending.measures_latency:
+        seconds = _server_seconds(task)
+        if seconds is None:
+            # Without the server's timestamps, all there is to go by is when it was seen to finish.
+            seconds = time.perf_counter() - pending.submitted_at
+    pending.on_finished(task, seconds)
+
+
+def _server_seconds(task: Task) -> Optional[float]:
+    """How long `task` took from its creation to its last update, according to the server's timestamps."""
+    try:
+        created = datetime.fromisoformat(task.task_created_on.replace("Z", "+00:00"))
+        finished = datetime.fromisoformat(
+            task.task_last_modified_on.replace("Z", "+00:00")
+        )
+    except (AttributeError, ValueError):
+        return None
+    return max((finished - created).total_seconds(), 0.0)
+
+
+def _watch(task: Task, pending: _PendingTask):
+    if not task.task_id:
+        return
+    with _pending_tasks_lock:
+        _pending_tasks[task.task_id] = pending
+        _pending_tasks.move_to_end(task.task_id)
+        while len(_pending_tasks) > _MAX_PENDING_TASKS:
+            _pending_tasks.popitem(last=False)
+
+
+class MonitoredTask(Task):
+    """A Task started through a CascadingPlugin, which reports its outcome once it is seen to have finished, when it is
+    refreshed (e.g. by `wait`)."""
+
+    @classmethod
+    def of(cls, task: Task) -> "MonitoredTask":
+        monitored = cls.construct(**task.__dict__)
+        # Tasks that ran synchronously have finished already.
+        report_finished(monitored)
+        return monitored
+
+    def refresh(self):
+        super().refresh()
+        report_finished(self)
+
+    def ignore_latency(self):
+        """Don't count how long this Task takes towards its provider's latency, e.g. because it's waited on late."""
+        with _pending_tasks_lock:
+            if pending := _pending_tasks.get(self.task_id):
+                pending.measures_latency = False
+
+
+# The health of named providers, shared by every CascadingPlugin this process creates: a new CascadingPlugin is made for
+# each request, but a failing model stays failing across them.
+_provider_health: Dict[str, ProviderHealth] = {}
+_provider_health_lock = threading.Lock()
+
+
 class CascadingPlugin(PluginInstance):
     """
     A PluginInstance wrapper which takes multiple providers of PluginInstances and cascades calls to them upon failure.
+
+    Providers are tried in order of preference, skipping those whose circuit is open (see `ProviderHealth`) and moving
+    those slower than `slow_call_seconds` behind the others. If all of those fail, the skipped ones are tried as a last
+    resort. Give the providers `provider_names` to keep their health across CascadingPlugins.
+
+    A call that returns a Task counts as a success or failure once the Task is seen to finish (see `report_finished`),
+    for as long as the server's timestamps say it took; until then, only failing to submit it counts.
     """
+
     instance_providers: List[InstanceProvider]
-    _exception_map: Dict[str, Exception] = PrivateAttr(dict())
-    _instance_provider_ix: int = PrivateAttr(0)
-    _cached_instance: Optional[PluginInstance] = PrivateAttr(None)
-
-    def _advance_instance(self) -> None:
-        self._instance_provider_ix += 1
-        self._cached_instance = None
-        if self._instance_provider_ix >= len(self.instance_providers):
-            # Don't make it so that this will never succeed again, let it recover on a basic heuristic.
-            # TODO this / current_instance could be smarter to try the preferred ones on a backoff
-            self._instance_provider_ix = 0
-            raise ExhaustedPluginsException(self._exception_map)
-
-    def _current_instance(self) -> PluginInstance:
-        if not self._cached_instance:
-            self._cached_instance = self.instance_providers[self._instance_provider_ix]()
-        return self._cached_instance
+    provider_names: Optional[List[str]] = None
+    failure_threshold: int = 3
+    open_seconds: float = 30
+    max_open_seconds: float = 300
+    slow_call_seconds: Optional[float] = None
+    _instances: Dict[int, PluginInstance] = PrivateAttr(default_factory=dict)
+    _health: Dict[int, ProviderHealth] = PrivateAttr(default_factory=dict)
+
+    def health(self, ix: int) -> ProviderHealth:
+        """Return the health of the provider at index `ix`."""
+        if ix not in self._health:
+            if self.provider_names:
+                with _provider_health_lock:
+                    self._health[ix] = _provider_health.setdefault(
+                        self.provider_names[ix], self._new_health()
+                    )
+            else:
+                self._health[ix] = self._new_health()
+        return self._health[ix]
+
+    def _provider_name(self, ix: int) -> str:
+        return self.provider_names[ix] if self.provider_names else f"provider {ix}"
+
+    def _new_health(self) -> ProviderHealth:
+        return ProviderHealth(
+            failure_threshold=self.failure_threshold,
+            open_seconds=self.open_seconds,
+            max_open_seconds=self.max_open_seconds,
+        )
+
+    def _is_slow(self, ix: int) -> bool:
+        latency = self.health(ix).latency_ewma
+        return (
+            self.slow_call_seconds is not None
+            and latency is not None
+            and latency > self.slow_call_seconds
+        )
+
+    def _call_order(self) -> List[int]:
+        provider_ixs = range(len(self.instance_providers))
+        available = [
+            ix for ix in provider_ixs if self.health(ix).state != CircuitState.OPEN
+        ]
+        # Sorting is stable: within fast and slow providers, the order of preference is kept.
+        available.sort(key=self._is_slow)
+        return available + [ix for ix in provider_ixs if ix not in available]
+
+    def next_provider(self) -> int:
+        """Return the index of the provider the next call will go to, unless it fails."""
+        return self._call_order()[0]
+
+    def _instance(self, ix: int) -> PluginInstance:
+        if ix not in self._instances:
+            self._instances[ix] = self.instance_providers[ix]()
+        return self._instances[ix]
+
+    def _call(self, method: str, *args, **kwargs):
+        exceptions: Dict[str, Exception] = {}
+        last_resort = []
+        for ix in self._call_order():
+            if not self.health(ix).should_call():
+                last_resort.append(ix)
+                continue
+            called, result = self._call_provider(ix, exceptions, method, args, kwargs)
+            if called:
+                return result
+        for ix in last_resort:
+            called, result = self._call_provider(ix, exceptions, method, args, kwargs)
+            if called:
+                return result
+        raise ExhaustedPluginsException(exceptions)
+
+    def _call_provider(
+        self,
+        ix: int,
+        exceptions: Dict[str, Exception],
+        method: str,
+        args: tuple,
+        kwargs: dict,
+    ) -> Tuple[bool, Any]:
+        """Call `method` of the provider at index `ix`. Return whether that worked, and its result."""
+        instance = None
+        start_time = time.perf_counter()
+        try:
+            instance = self._instance(ix)
+            result = getattr(instance, method)(*args, **kwargs)
+        except Exception as e:
+            name = instance.plugin_id if instance else self._provider_name(ix)
+            exceptions[name] = e
+            self._record_failure(ix, name, e)
+            return False, None
+
+        if not isinstance(result, Task):
+            self.health(ix).record_success(time.perf_counter() - start_time)
+            return True, result
+
+        def on_finished(task: Task, seconds: Optional[float]):
+            if task.state == TaskState.failed:
+                self._record_failure(ix, instance.plugin_id, task.as_error())
+            else:
+                self.health(ix).record_success(seconds)
+
+        _watch(result, _PendingTask(on_finished, start_time))
+        return True, MonitoredTask.of(result)
+
+    def _record_failure(self, ix: int, name: str, e: Exception):
+        health = self.health(ix)
+        if health.record_failure():
+            logging.warning(
+                f"Skipping plugin provider {name} for {health.current_open_seconds}s: {e}"
+            )
 
     # The following methods are wrapping around the API for PluginInstance.
     # TODO this could be hacked up in a more general sense to check for Callables and pass these through in getattr?
 
     def tag(self, *args, **kwargs):
-        while True:
-            try:
-                return self._current_instance().tag(*args, **kwargs)
-            except Exception as e:
-                self._exception_map[self._current_instance().plugin_id] = e
-                self._advance_instance()
+        return self._call("tag", *args, **kwargs)
 
     def generate(self, *args, **kwargs):
-        while True:
-            try:
-                return self._current_instance().generate(*args, **kwargs)
-            except Exception as e:
-                self._exception_map[self._current_instance().plugin_id] = e
-                self._advance_instance()
+        return self._call("generate", *args, **kwargs)
 
     def delete(self, *args, **kwargs):
-        while True:
-            try:
-                return self._current_instance().delete(*args, **kwargs)
-            except Exception as e:
-                self._exception_map[self._current_instance().plugin_id] = e
-                self._advance_instance()
+        return self._call("delete", *args, **kwargs)
 
     def train(self, *args, **kwargs):
-        raise NotImplementedError("The `train` endpoint is not implemented for CascadingPlugin")
+        raise NotImplementedError(
+            "The `train` endpoint is not implemented for CascadingPlugin"
+        )
 
     def refresh_init_status(self, *args, **kwargs):
-        while True:
-            try:
-                return self._current_instance().refresh_init_status(*args, **kwargs)
-            except Exception as e:
-                self._exception_map[self._current_instance().plugin_id] = e
-                self._advance_instance()
+        return self._call("refresh_init_status", *args, **kwargs)
 
     def wait_for_init(self, *args, **kwargs):
-        while True:
-            try:
-                return self._current_instance().wait_for_init(*args, **kwargs)
-            except Exception as e:
-                self._exception_map[self._current_instance().plugin_id] = e
-                self._advance_instance()
+        return self._call("wait_for_init", *args, **kwargs)
@@ -21,7 +21,8 @@ class ServerSettingsGenerator(BaseModel, ABC):
         context: AgentContext,
         wait_on_task: Task = None,
         generation_config: Optional[dict] = None,
-    ) -> Task:
+    ) -> Union[Task, List[Task]]:
+        """Schedule the generation, returning the task (or tasks) that it is complete after."""
         pass
 
     def generate(
@@ -35,7 +36,7 @@ class ServerSettingsGenerator(BaseModel, ABC):
         """Generate an entire Adventure Template."""
         self.save_unsaved_server_settings(agent_service, unsaved_server_settings)
 
-        last_task = self.inner_generate(
+        last_tasks = self.inner_generate(
             agent_service=agent_service,
             context=context,
             wait_on_task=wait_on_task,
@@ -43,7 +44,10 @@ class ServerSettingsGenerator(BaseModel, ABC):
         )
 
         # Schedule the clearing of the generation_task_id value
-        wait_on_tasks = [last_task] if last_task else []
+        if isinstance(last_tasks, list):
+            wait_on_tasks = last_tasks
+        else:
+            wait_on_tasks = [last_tasks] if last_tasks else []
         logging.info(f"Will await on final generation task: {wait_on_tasks}")
         generation_complete_task = self.schedule_record_generation_complete(
             wait_on_tasks, agent_service
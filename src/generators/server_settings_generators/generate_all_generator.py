@@ -1,4 +1,4 @@
-from typing import Optional
+from typing import Dict, List, Optional, Tuple
 
 from steamship import Task
 from steamship.agents.schema import AgentContext
@@ -6,29 +6,31 @@ from steamship.agents.schema import AgentContext
 from generators.server_settings_generator import ServerSettingsGenerator
 from utils.agent_service import AgentService
 
-# Note: should_block is True for all of these because we don't want to awaken the parallel state management ghosts.
-GENERATE_KEY_PATHS_AND_SHOULD_BLOCK = [
-    [["narrative_voice"], True],  # Genre
-    [["narrative_tone"], True],  # Writing Style
-    [["name"], True],
-    [["short_description"], True],
-    [["description"], True],
-    [["adventure_goal"], True],
-    [["adventure_background"], True],
-    # [["image"], True],
-    [["tags", 0], True],
-    [["tags", 1], True],
-    [["tags", 2], True],
-    [["characters", 0, "name"], True],
-    [["characters", 0, "tagline"], True],
-    [["characters", 0, "background"], True],
-    [["characters", 0, "description"], True],
-    # [["characters", 0, "image"], True],
-    [["characters", 1, "name"], True],
-    [["characters", 1, "tagline"], True],
-    [["characters", 1, "background"], True],
-    [["characters", 1, "description"], True],
-    # [["characters", 1, "image"], True],
+# Each field is generated once the fields it's generated from -- those its prompt uses, directly or through the fields
+# listed -- are. Everything else runs in parallel; concurrent saves of the server settings are merged (see
+# `TrackedModel.rebase`).
+GENERATE_KEY_PATHS_AND_DEPENDENCIES = [
+    [["narrative_voice"], []],  # Genre
+    [["narrative_tone"], [["narrative_voice"]]],  # Writing Style
+    [["name"], [["narrative_tone"]]],
+    [["short_description"], [["name"]]],
+    [["description"], [["short_description"]]],
+    [["adventure_goal"], [["narrative_tone"]]],
+    [["adventure_background"], [["description"], ["adventure_goal"]]],
+    # [["image"], []],
+    [["tags", 0], [["short_description"]]],
+    [["tags", 1], [["tags", 0]]],
+    [["tags", 2], [["tags", 1]]],
+    [["characters", 0, "name"], [["adventure_background"]]],
+    [["characters", 0, "tagline"], [["characters", 0, "name"]]],
+    [["characters", 0, "background"], [["characters", 0, "tagline"]]],
+    [["characters", 0, "description"], [["characters", 0, "background"]]],
+    # [["characters", 0, "image"], []],
+    [["characters", 1, "name"], [["characters", 0, "name"]]],
+    [["characters", 1, "tagline"], [["characters", 1, "name"]]],
+    [["characters", 1, "background"], [["characters", 1, "tagline"]]],
+    [["characters", 1, "description"], [["characters", 1, "background"]]],
+    # [["characters", 1, "image"], []],
 ]
 
 
@@ -41,14 +43,13 @@ class GenerateAllGenerator(ServerSettingsGenerator):
         context: AgentContext,
         wait_on_task: Task = None,
         generation_config: Optional[dict] = None,
-    ) -> Task:
-        # Assemble a linked list of things to generate
-        last_task = wait_on_task
-        for field_key_path_and_should_block in GENERATE_KEY_PATHS_AND_SHOULD_BLOCK:
-            field_key_path = field_key_path_and_should_block[0]
-            should_block = field_key_path_and_should_block[1]
-
-            wait_on_tasks = [last_task] if last_task else []
+    ) -> List[Task]:
+        # Schedule every field at once, each waiting on the tasks of the fields it depends on
+        tasks: Dict[Tuple, Task] = {}
+        for field_key_path, dependencies in GENERATE_KEY_PATHS_AND_DEPENDENCIES:
+            wait_on_tasks = [tasks[tuple(dependency)] for dependency in dependencies]
+            if not wait_on_tasks and wait_on_task:
+                wait_on_tasks = [wait_on_task]
 
             # Either something like `name` or `characters.name`
             if len(field_key_path) == 3:
@@ -56,14 +57,13 @@ class GenerateAllGenerator(ServerSettingsGenerator):
             else:
                 field_name = field_key_path[0]
 
-            this_task = self.schedule_generation(
+            tasks[tuple(field_key_path)] = self.schedule_generation(
                 field_name,
                 field_key_path,
                 wait_on_tasks,
                 agent_service,
                 generation_config=generation_config,
             )
-            if should_block:
-                last_task = this_task
 
-        return last_task
+        # The generation is complete once every field is
+        return list(tasks.values())
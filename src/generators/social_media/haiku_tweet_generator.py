@@ -25,9 +25,7 @@ class HaikuTweetGenerator(SocialMediaGenerator):
             haiku_text = output_blocks[0].text
 
         quests_total = len(game_state.quest_arc)
-        quests_completed = sum(
-            map(lambda q: q.completed_timestamp is not None, game_state.quests)
-        )
+        quests_completed = game_state.completed_quest_count()
         quests_left = quests_total - quests_completed
         green_progress = "🟩" * quests_completed
         grey_progress = "⬜" * quests_left
@@ -1,12 +1,17 @@
 from enum import Enum
-from typing import List, Optional
+from typing import Dict, List, Optional
 
 from pydantic import BaseModel, Field
 
 from schema.camp import Camp
 from schema.characters import HumanCharacter, NpcCharacter
 from schema.preferences import Preferences
-from schema.quest import Quest, QuestDescription
+from schema.quest import Quest, QuestDescription, QuestSummary
+from schema.tracked_model import ROOT_SUBTREE, TrackedModel
+
+# Fields persisted as their own sub-tree so that a change to one doesn't re-upload the others.
+_FIELD_SUBTREES = ["player", "preferences", "camp", "quest_arc", "archived_quests"]
+_QUEST_SUBTREE_PREFIX = "quests/"
 
 
 class ActiveMode(str, Enum):
@@ -19,7 +24,7 @@ class ActiveMode(str, Enum):
     ERROR = "error"  # Indicates that the game has hit an unrecoverable error.
 
 
-class GameState(BaseModel):
+class GameState(TrackedModel):
     """Settings for a user of the game.
 
     Max Notes:
@@ -46,7 +51,14 @@ class GameState(BaseModel):
 
     # NOTE: The fields below are not intended to be settable BY the user themselves.
     quests: List[Quest] = Field(
-        [], description="The missions that the character has been on."
+        [],
+        description="The missions that the character has been on and that have not yet been archived. In practice, "
+        "the current (or most recent) quest.",
+    )
+
+    archived_quests: List[QuestSummary] = Field(
+        [],
+        description="Summaries of the earlier missions, in order. The full quests are kept in the quest archive.",
     )
 
     camp: Optional[Camp] = Field(
@@ -135,12 +147,75 @@ class GameState(BaseModel):
         else:
             return False
 
+    def quest_count(self) -> int:
+        """Return the number of quests the character has been on, archived or not."""
+        return len(self.archived_quests or []) + len(self.quests or [])
+
+    def completed_quest_count(self) -> int:
+        return sum(
+            quest.completed_timestamp is not None
+            for quest in [*(self.archived_quests or []), *(self.quests or [])]
+        )
+
+    def archive_quests(self) -> List[Quest]:
+        """Move every quest but the current one out of `quests`, leaving a summary in `archived_quests`.
+
+        Returns the moved quests, which the caller is responsible for storing in the quest archive.
+        """
+        archived = [quest for quest in self.quests if quest.name != self.current_quest]
+        if archived:
+            self.quests = [
+                quest for quest in self.quests if quest.name == self.current_quest
+            ]
+            self.archived_quests = [
+                *(self.archived_quests or []),
+                *[quest.summary() for quest in archived],
+            ]
+        return archived
+
     def camp_image_requested(self) -> bool:
         return True if self.camp.image_block_url else False
 
     def camp_audio_requested(self) -> bool:
         return True if self.camp.audio_block_url else False
 
+    def persisted_subtrees(self) -> Dict[str, dict]:
+        """Split the game state into the root fields, one sub-tree per large nested field, and one per quest.
+
+        Per-quest sub-trees keep the size of a save flat as the player piles up quests: finishing a turn of the
+        current quest only re-uploads that quest.
+        """
+        root = BaseModel.dict(self, exclude={"quests", *_FIELD_SUBTREES})
+        root["quest_count"] = len(self.quests or [])
+        subtrees = {ROOT_SUBTREE: root}
+        for field_name in _FIELD_SUBTREES:
+            subtrees[field_name] = BaseModel.dict(self, include={field_name})
+        for i, quest in enumerate(self.quests or []):
+            subtrees[f"{_QUEST_SUBTREE_PREFIX}{i}"] = quest.dict()
+        return subtrees
+
+    @classmethod
+    def from_persisted_subtrees(
+        cls, subtrees: Dict[str, dict], trusted: bool = False
+    ) -> "GameState":
+        """Reassemble a game state from its sub-trees.
+
+        A root document without a `quest_count` is a legacy, single-document game state and is parsed as-is.
+        """
+        root = subtrees.get(ROOT_SUBTREE) or {}
+        if "quest_count" not in root:
+            return cls.parse_obj(root)
+
+        value = dict(root)
+        for field_name in _FIELD_SUBTREES:
+            value.update(subtrees.get(field_name) or {})
+        value["quests"] = [
+            subtrees[f"{_QUEST_SUBTREE_PREFIX}{i}"]
+            for i in range(root["quest_count"])
+            if f"{_QUEST_SUBTREE_PREFIX}{i}" in subtrees
+        ]
+        return cls.build(value, trusted=trusted)
+
     def dict(self, **kwargs) -> dict:
         """Return the dict representation, making sure the computed properties are there."""
         ret = super().dict(**kwargs)
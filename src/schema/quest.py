@@ -82,6 +82,24 @@ class QuestDescription(BaseModel):
     )
 
 
+class QuestSummary(BaseModel):
+    """The compact record of an archived quest that is kept in the game state.
+
+    The full Quest is stored in the quest archive (see `context_utils.get_quest`)."""
+
+    name: Optional[str] = Field(None, description="The name of the quest.")
+    completed_success: Optional[bool] = Field(
+        None,
+        description="Whether the quest was completeed successfully (True) or unsuccessfully (False)",
+    )
+    completed_timestamp: Optional[str] = Field(
+        None, description="The timestamp at which the quest was completed"
+    )
+    text_summary: Optional[str] = Field(
+        None, description="A summary of the quest generated afterwards."
+    )
+
+
 class Quest(BaseModel):
     """Information about a quest."""
 
@@ -127,6 +145,21 @@ class Quest(BaseModel):
         False, description="Whether the outro of the quest was sent to the user."
     )
 
+    rolling_summary_task_id: Optional[str] = Field(
+        None,
+        description="The task generating a rolling summary of the quest's older turns in the background, if any.",
+    )
+
+    rolling_summary_through: Optional[int] = Field(
+        None,
+        description="The index of the last chat history block the rolling summary being generated covers.",
+    )
+
+    action_choices_task_id: Optional[str] = Field(
+        None,
+        description="The task generating action choices for the current problem in the background, if any.",
+    )
+
     # Output Fields
     image_url: Optional[str] = Field(
         None, description="An image of this quest generated afterwards by AI."
@@ -164,6 +197,14 @@ class Quest(BaseModel):
         description="A list of challenges that MUST be encountered on this quest.",
     )
 
+    def summary(self) -> QuestSummary:
+        return QuestSummary(
+            name=self.name,
+            completed_success=self.completed_success,
+            completed_timestamp=self.completed_timestamp,
+            text_summary=self.text_summary,
+        )
+
     def all_problems_solved(self) -> bool:
         if len(self.challenges) > 0:
             solved_challenges = sum([1 if x.solution else 0 for x in self.challenges])
@@ -173,6 +214,8 @@ class Quest(BaseModel):
 
     def add_user_solution(self, user_solution: str):
         self.user_problem_solutions.append(user_solution)
+        # Choices generated for the problem as it was no longer apply.
+        self.action_choices_task_id = None
         if len(self.challenges) > 0:
             solved_challenges = sum([1 if x.solution else 0 for x in self.challenges])
             if isinstance(solved_challenges, int) and solved_challenges < len(
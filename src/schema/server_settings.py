@@ -2,12 +2,13 @@ import re
 from enum import Enum
 from typing import Any, Dict, List, Optional, Union, cast
 
-from pydantic import BaseModel, Field
+from pydantic import Field
 from steamship import SteamshipError
 
 from schema.characters import Character
 from schema.image_theme import DalleTheme, StableDiffusionTheme
 from schema.quest import QuestDescription
+from schema.tracked_model import TrackedModel
 
 
 def validate_prompt_args(
@@ -46,6 +47,12 @@ class Difficulty(str, Enum):
     HARD = "hard"
 
 
+class ActionJudgmentMode(str, Enum):
+    MERGED = "merged"  # One generation judges both; falls back to CONCURRENT if its answer can't be parsed
+    CONCURRENT = "concurrent"  # Both generations at once, discarding the likelihood of actions that aren't attempts
+    SEQUENTIAL = "sequential"  # The likelihood is only asked for once the action is known to be an attempt
+
+
 _SUPPORTED_ELEVEN_VOICES = {
     "dorothy": {
         "id": "ThT5KcBeYPX3keUQqHPh",
@@ -224,7 +231,7 @@ def SettingField(  # noqa: N802
     )
 
 
-class ServerSettings(BaseModel):
+class ServerSettings(TrackedModel):
     """Server Settings for the AI Adventure Game set by the Game Host.
 
     These are intended to be set by the game operator (not the user).
@@ -353,6 +360,22 @@ class ServerSettings(BaseModel):
         max=2048,
     )
 
+    story_prompt_target_tokens: int = SettingField(
+        default=0,
+        label="Story Prompt Target Size",
+        description="The most tokens of story context to send with a generation, even if the model could take more. "
+        "Smaller prompts start streaming sooner; larger ones remember more. 0 uses the model's whole context window.",
+        type="int",
+        min=0,
+        max=128000,
+    )
+
+    rolling_summary_threshold: int = Field(
+        600,
+        description="When the turns of a quest that no longer fit in the story context add up to this many tokens, "
+        "they are folded into a rolling summary of the quest in the background. 0 disables summarizing.",
+    )
+
     # Narration Generation Settings
     default_narration_model: str = Field("elevenlabs", description="")
 
@@ -557,6 +580,24 @@ Can include descriptions of genre, characters, specific items and locations that
         ],
     )
 
+    quest_arc_attempts: int = Field(
+        3,
+        description="How many generations to spend on a quest arc. Each one after the first only asks for the quests "
+        "still missing; if there are still too few after the last, the arc is shorter.",
+    )
+
+    generation_cache_ttl_seconds: int = Field(
+        600,
+        description="How long to reuse the answers of classification generations (such as whether an action is an "
+        "attempt to solve the problem) asked again of the same context. 0 disables the cache.",
+    )
+
+    action_judgment: ActionJudgmentMode = Field(
+        ActionJudgmentMode.MERGED,
+        description="How to judge whether a player's action is an attempt to solve the problem, and how likely it is "
+        "to succeed.",
+    )
+
     # Energy Management
     # NOTE: quest_cost is now set to zero becuase we're managing energy consumption from the web side of things.
     # TODO: Remove quest_cost entirely to reduce dead code?
@@ -0,0 +1,246 @@
+import hashlib
+import logging
+from typing import Any, Dict, List, Optional, Set, Tuple, Type, TypeVar
+
+from pydantic import BaseModel, PrivateAttr, ValidationError
+from pydantic.fields import SHAPE_DICT, SHAPE_LIST, SHAPE_SINGLETON, ModelField
+
+ROOT_SUBTREE = ""
+"""The name of the sub-tree holding every field that isn't split out into its own sub-tree."""
+
+_MISSING = object()
+
+
+def three_way_merge(base: Any, mine: Any, theirs: Any) -> Any:
+    """Merge two concurrent edits (`mine`, `theirs`) of the serialized value `base`.
+
+    Dicts are merged key by key and equal-length lists element by element, so edits to different parts of a value
+    both survive. When both sides changed the same leaf, `mine` wins. `_MISSING` marks an absent key.
+    """
+    if mine == base:
+        return theirs
+    if theirs == base or theirs == mine:
+        return mine
+    if isinstance(base, dict) and isinstance(mine, dict) and isinstance(theirs, dict):
+        merged = {}
+        for key in {**base, **mine, **theirs}:
+            value = three_way_merge(
+                base.get(key, _MISSING),
+                mine.get(key, _MISSING),
+                theirs.get(key, _MISSING),
+            )
+            if value is not _MISSING:
+                merged[key] = value
+        return merged
+    if (
+        isinstance(base, list)
+        and isinstance(mine, list)
+        and isinstance(theirs, list)
+        and len(base) == len(mine) == len(theirs)
+    ):
+        return [three_way_merge(b, m, t) for b, m, t in zip(base, mine, theirs)]
+    return mine
+
+
+def _assign_changed(target: BaseModel, source: BaseModel):
+    """Copy the fields of `source` that differ onto `target`, recursing so that unchanged nested objects keep their
+    identity (callers routinely hold references to e.g. the current quest)."""
+    for field_name in target.__fields__:
+        old = getattr(target, field_name)
+        new = getattr(source, field_name)
+        if old == new:
+            continue
+        if isinstance(old, BaseModel) and type(old) is type(new):
+            _assign_changed(old, new)
+        elif (
+            isinstance(old, list)
+            and isinstance(new, list)
+            and all(
+                isinstance(o, BaseModel) and type(o) is type(n)
+                for o, n in zip(old, new)
+            )
+        ):
+            for o, n in zip(old, new):
+                _assign_changed(o, n)
+            del old[len(new) :]
+            old.extend(new[len(old) :])
+        else:
+            setattr(target, field_name, new)
+
+
+_PLAIN_TYPES = (str, int, float, bool, Any)
+
+M = TypeVar("M", bound=BaseModel)
+
+
+def _model_type(field: ModelField) -> Optional[Type[BaseModel]]:
+    if isinstance(field.type_, type) and issubclass(field.type_, BaseModel):
+        return field.type_
+    return None
+
+
+def construct_trusted(model: Type[M], value: dict) -> M:
+    """Build `model` from a dict it serialized itself earlier, skipping validation wherever that is safe.
+
+    Nested models (alone, or in lists and dicts) are constructed recursively and plain values are taken as-is. Any
+    other field -- enums, unions of models, and so on -- is still validated, so that it comes back with the right type.
+    Raises `ValueError` if one of those fields fails validation.
+    """
+    values = {}
+    for name, field in model.__fields__.items():
+        if name in value:
+            raw = value[name]
+        elif field.alias in value:
+            raw = value[field.alias]
+        else:
+            continue  # construct() fills in the default
+
+        nested_model = _model_type(field)
+        if raw is None:
+            values[name] = raw
+        elif nested_model and field.shape == SHAPE_SINGLETON:
+            values[name] = construct_trusted(nested_model, raw)
+        elif nested_model and field.shape == SHAPE_LIST:
+            values[name] = [construct_trusted(nested_model, item) for item in raw]
+        elif nested_model and field.shape == SHAPE_DICT:
+            values[name] = {
+                key: construct_trusted(nested_model, item) for key, item in raw.items()
+            }
+        elif field.type_ in _PLAIN_TYPES and not field.sub_fields:
+            values[name] = raw
+        else:
+            values[name], errors = field.validate(raw, values, loc=name, cls=model)
+            if errors:
+                raise ValueError(f"Invalid stored value for {model.__name__}.{name}")
+    return model.construct(**values)
+
+
+def _describe_schema(model: Type[BaseModel], seen: Set[type]) -> List[Any]:
+    seen.add(model)
+    description = [model.__name__]
+    for name, field in model.__fields__.items():
+        description.append((name, str(field.outer_type_), field.required))
+        for sub_field in [field, *(field.sub_fields or [])]:
+            nested_model = _model_type(sub_field)
+            if nested_model and nested_model not in seen:
+                description.append(_describe_schema(nested_model, seen))
+    return description
+
+
+class TrackedModel(BaseModel):
+    """A model that is persisted as a set of independently stored sub-trees.
+
+    After a load or a save the serialized form of every sub-tree is remembered. On the next save, only the sub-trees
+    whose serialized form differs from that snapshot need to be written. Comparing serialized forms (rather than
+    hooking `__setattr__`) means in-place mutations of nested models and lists -- e.g.
+    `quest.user_problem_solutions.append(..)` -- are picked up as well.
+
+    The model also remembers the version it was loaded at, so that a save can detect that another invocation wrote
+    in the meantime and `rebase` onto that write instead of silently clobbering it.
+    """
+
+    _clean_subtrees: Dict[str, dict] = PrivateAttr(default_factory=dict)
+    _version: int = PrivateAttr(0)
+    _needs_rewrite: bool = PrivateAttr(False)
+
+    @property
+    def persisted_version(self) -> int:
+        """The stored version this model was last loaded at or saved as."""
+        return self._version
+
+    def persisted_subtrees(self) -> Dict[str, dict]:
+        """Return the serialized form of this model, keyed by sub-tree name."""
+        return {ROOT_SUBTREE: BaseModel.dict(self)}
+
+    @classmethod
+    def schema_fingerprint(cls) -> str:
+        """Return a digest of the fields of this model and every model nested in it.
+
+        It is stored with each save, so that a load can tell whether the stored value was written by code with the
+        same schema -- and can therefore be trusted without validation.
+        """
+        if "_schema_fingerprint" not in cls.__dict__:
+            description = repr(_describe_schema(cls, set()))
+            cls._schema_fingerprint = hashlib.sha1(description.encode()).hexdigest()
+        return cls._schema_fingerprint
+
+    @classmethod
+    def build(cls, value: dict, trusted: bool = False) -> "TrackedModel":
+        """Parse `value`, skipping validation if it is `trusted` to have been written by this model's own schema."""
+        if trusted:
+            try:
+                return construct_trusted(cls, value)
+            except (ValueError, TypeError, AttributeError, ValidationError) as e:
+                logging.warning(
+                    f"Unable to load trusted {cls.__name__}, validating it instead: {e}"
+                )
+        return cls.parse_obj(value)
+
+    @classmethod
+    def from_persisted_subtrees(
+        cls, subtrees: Dict[str, dict], trusted: bool = False
+    ) -> "TrackedModel":
+        """Reassemble a model from the sub-trees produced by `persisted_subtrees`."""
+        return cls.build(subtrees.get(ROOT_SUBTREE) or {}, trusted=trusted)
+
+    def mark_clean(
+        self, subtrees: Optional[Dict[str, dict]] = None, version: Optional[int] = None
+    ):
+        """Record `subtrees` (or the current state) as what is in persistent storage, at `version`, with this schema."""
+        self._clean_subtrees = (
+            subtrees if subtrees is not None else self.persisted_subtrees()
+        )
+        if version is not None:
+            self._version = version
+        self._needs_rewrite = False
+
+    def mark_needs_rewrite(self):
+        """Have the next save write every sub-tree, e.g. because they were stored by another schema.
+
+        Unlike `mark_dirty`, this keeps the persisted snapshot, which `rebase` needs as the base of its merge.
+        """
+        self._needs_rewrite = True
+
+    def continue_from(self, other: "TrackedModel"):
+        """Treat this model as an edited copy of `other`, inheriting its persisted snapshot and version."""
+        self._clean_subtrees = other._clean_subtrees
+        self._version = other._version
+        self._needs_rewrite = other._needs_rewrite
+
+    def mark_dirty(self):
+        """Forget the persisted snapshot so that the next save writes every sub-tree."""
+        self._clean_subtrees = {}
+
+    def changed_subtrees(self) -> Tuple[Dict[str, dict], Dict[str, dict], List[str]]:
+        """Return (all current sub-trees, the changed sub-trees, the names of sub-trees that no longer exist)."""
+        current = self.persisted_subtrees()
+        changed = {
+            name: value
+            for name, value in current.items()
+            if self._needs_rewrite or self._clean_subtrees.get(name) != value
+        }
+        removed = [name for name in self._clean_subtrees if name not in current]
+        return current, changed, removed
+
+    def rebase(self, theirs: Dict[str, dict], their_version: int):
+        """Retry-merge hook: replay this model's unsaved changes on top of a concurrently saved version.
+
+        The default merges three ways against the last persisted snapshot (see `three_way_merge`). Subclasses can
+        override this for domain-specific conflict resolution.
+        """
+        base = self._clean_subtrees
+        mine = self.persisted_subtrees()
+        merged = {}
+        for name in {**base, **mine, **theirs}:
+            value = three_way_merge(
+                base.get(name, _MISSING),
+                mine.get(name, _MISSING),
+                theirs.get(name, _MISSING),
+            )
+            if value is not _MISSING:
+                merged[name] = value
+
+        _assign_changed(self, type(self).from_persisted_subtrees(merged))
+        needs_rewrite = self._needs_rewrite
+        self.mark_clean(theirs, their_version)
+        self._needs_rewrite = needs_rewrite
@@ -13,9 +13,12 @@ from generators.generator_context_utils import (
 from schema.game_state import GameState
 from schema.objects import Item
 from utils.context_utils import (
+    end_quest_chat_history,
+    flush_saves,
     get_current_quest,
     get_game_state,
     get_story_text_generator,
+    merge_into_chat_history,
     save_game_state,
 )
 from utils.generation_utils import (
@@ -79,12 +82,13 @@ class EndQuestTool(Tool):
         get_story_text_generator(context)
 
         player = game_state.player
+        inventory_block = None
 
         if not failed:
             # Let's do some things to tidy up.
 
             # matching description (hopefully)
-            quest_description = game_state.quest_arc[len(game_state.quests) - 1]
+            quest_description = game_state.quest_arc[game_state.quest_count() - 1]
 
             new_items = []
 
@@ -105,7 +109,7 @@ class EndQuestTool(Tool):
                             item=item, context=context
                         )
                         item_image_block = task.wait().blocks[0]
-                        context.chat_history.file.refresh()
+                        merge_into_chat_history([item_image_block], context)
                         item.picture_url = item_image_block.raw_data_url
             else:
                 (
@@ -127,7 +131,7 @@ class EndQuestTool(Tool):
                         item=item, context=context
                     )
                     item_image_block = task.wait().blocks[0]
-                    context.chat_history.file.refresh()
+                    merge_into_chat_history([item_image_block], context)
                     item.picture_url = item_image_block.raw_data_url
 
             if not player.inventory:
@@ -135,7 +139,7 @@ class EndQuestTool(Tool):
 
             quest.new_items = new_items
             player.inventory.extend(new_items)
-            context.chat_history.append_system_message(
+            inventory_block = context.chat_history.append_system_message(
                 text=player.inventory_description(),
                 tags=[
                     Tag(kind=TagKindExtensions.CHARACTER, name=CharacterTag.INVENTORY)
@@ -172,6 +176,9 @@ class EndQuestTool(Tool):
         # included in this.
         save_game_state(game_state, context)
 
+        # The web app re-fetches the game state as soon as it sees the status message, so it must be persisted first.
+        flush_saves(context)
+
         tag = (
             AgentStatusMessageTag.QUEST_FAILED
             if failed
@@ -179,6 +186,9 @@ class EndQuestTool(Tool):
         )
         send_agent_status_message(tag, context=context)
 
+        # Back to camp: later quests need to see this one's summary and the updated inventory.
+        end_quest_chat_history([inventory_block, summary_block], context)
+
         return ""
 
     def run(
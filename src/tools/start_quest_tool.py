@@ -11,9 +11,12 @@ from schema.quest import Quest
 from schema.server_settings import ServerSettings
 from utils.context_utils import (
     RunNextAgentException,
+    archive_quests,
     get_game_state,
     get_server_settings,
     save_game_state,
+    start_quest_chat_history,
+    switch_history_to_current_quest,
 )
 
 
@@ -63,18 +66,11 @@ class StartQuestTool(Tool):
                 message=f"Going on a quest costs {server_settings.quest_cost} energy, but you only have {player.energy}."
             )
 
-        # quest = Quest(chat_file_id=f"quest-{uuid.uuid4()}")
-        chat_history = context.chat_history
-
         quest = Quest(
-            chat_file_id=chat_history.file.id,
             # For now a quest is a fixed cost, controlled by the server settings.
             energy_delta=server_settings.quest_cost,
         )
 
-        # Now save the chat history file
-        quest.chat_file_id = chat_history.file.id
-
         if not game_state.quests:
             game_state.quests = []
 
@@ -92,10 +88,11 @@ class StartQuestTool(Tool):
         game_state.quests.append(quest)
 
         quest_difficulty_base = 1
-        if game_state.quest_arc is not None and len(game_state.quest_arc) >= len(
-            game_state.quests
+        if (
+            game_state.quest_arc is not None
+            and len(game_state.quest_arc) >= game_state.quest_count()
         ):
-            quest_difficulty_base = len(game_state.quests)
+            quest_difficulty_base = game_state.quest_count()
         quest.num_problems_to_encounter = self.num_problems_to_encounter(
             quest_difficulty_base, server_settings
         )
@@ -103,13 +100,22 @@ class StartQuestTool(Tool):
         quest.name = f"{uuid.uuid4()}"
 
         print(
-            f"Current quest name: {quest.name}. Current quest idx: {len(game_state.quests) - 1}."
+            f"Current quest name: {quest.name}. Current quest idx: {game_state.quest_count() - 1}."
         )
         game_state.current_quest = quest.name
 
+        # Give the quest a chat history of its own, seeded with the context shared by all quests.
+        start_quest_chat_history(quest, context)
+
+        # Now that the prior quest can no longer be restarted, move it out of the game state.
+        archive_quests(game_state, context)
+
         # This saves it in a way that is both persistent (KV Store) and updates the context
         save_game_state(game_state, context)
 
+        # From here on, the story is told in the quest's chat history.
+        switch_history_to_current_quest(context)
+
         return quest
 
     def num_problems_to_encounter(
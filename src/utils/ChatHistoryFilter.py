@@ -1,21 +1,232 @@
+import hashlib
 import logging
+import threading
 from abc import ABC, abstractmethod
-from typing import List, Optional, Tuple
+from collections import OrderedDict, defaultdict
+from enum import Enum
+from typing import Dict, List, Optional, Tuple
 
 from steamship import Block, File, Tag
-from steamship.agents.schema.message_selectors import tokens
+from steamship.data.block import StreamState
 from steamship.data.tags.tag_constants import RoleTag, TagValueKey
-from steamship.data.tags.tag_utils import get_tag, get_tag_value_key
+from steamship.data.tags.tag_utils import get_tag_value_key
 
 from schema.game_state import GameState
+from utils.local_backend import LocalBackend
 from utils.moderation_utils import is_block_excluded
-from utils.tags import (
-    CharacterTag,
-    InstructionsTag,
-    QuestIdTag,
-    QuestTag,
-    TagKindExtensions,
-)
+from utils.tags import CharacterTag, InstructionsTag, QuestTag, TagKindExtensions
+from utils.tokenizers import DEFAULT_TOKENIZER, Tokenizer
+
+
+def _tag_key(kind: Optional[str], name: Optional[str]) -> Tuple[str, str]:
+    """Normalize a tag kind and name, which may be str Enums, to plain strings.
+
+    (A str Enum compares equal to its value but doesn't hash like it, so it can't be used as a dict key directly.)
+    """
+    return (
+        kind.value if isinstance(kind, Enum) else kind,
+        name.value if isinstance(name, Enum) else name,
+    )
+
+
+def _token_count_tag_name(tokenizer: Tokenizer) -> Optional[str]:
+    # Counts of the default tokenizer were stored before there was a choice of tokenizer, without a name.
+    return None if tokenizer is DEFAULT_TOKENIZER else tokenizer.name
+
+
+class TokenCountCache:
+    """Process-wide cache of block token counts, keyed by block id, a hash of the block's text and the tokenizer.
+
+    Counts are computed once -- as soon as a block shows up in a chat history (see `ChatHistoryIndex.update`), or on
+    first use -- and remembered as a local `token_count` tag on the block. Keying by the text hash means a count taken
+    while a block was still streaming is never reused for its final text.
+
+    Persisting the counts as Tags (so that later invocations don't have to tokenize again) is deferred: `flush` writes
+    every pending count in one go, and is called while a generation task is running rather than in the middle of
+    selecting the blocks for it.
+    """
+
+    _MAX_ENTRIES = 4096
+    _counts: "OrderedDict[Tuple[Optional[str], str, str], int]" = OrderedDict()
+    _pending: "OrderedDict[Tuple[str, str], Tuple[Block, Optional[str], int]]" = (
+        OrderedDict()
+    )
+    _lock = threading.Lock()
+
+    @classmethod
+    def _key(cls, block: Block, tokenizer: Tokenizer) -> Tuple[Optional[str], str, str]:
+        return (
+            block.id,
+            hashlib.sha1(block.text.encode("utf-8")).hexdigest(),
+            tokenizer.name,
+        )
+
+    @classmethod
+    def _known_count(cls, block: Block, tokenizer: Tokenizer) -> Optional[int]:
+        tag_name = _token_count_tag_name(tokenizer)
+        for tag in block.tags or []:
+            if tag.kind == TagKindExtensions.TOKEN_COUNT and tag.name == tag_name:
+                if value := (tag.value or {}).get(TagValueKey.NUMBER_VALUE):
+                    return value
+
+        key = cls._key(block, tokenizer)
+        with cls._lock:
+            block_tokens = cls._counts.get(key)
+            if block_tokens is not None:
+                cls._counts.move_to_end(key)
+        return block_tokens
+
+    @classmethod
+    def count(cls, block: Block, tokenizer: Tokenizer = DEFAULT_TOKENIZER) -> int:
+        """Return the number of tokens in `block`, tokenizing it only if it hasn't been counted before."""
+        if not block.text:
+            return 0
+        if (block_tokens := cls._known_count(block, tokenizer)) is not None:
+            return block_tokens
+
+        block_tokens = tokenizer.count(block.text)
+        tag_name = _token_count_tag_name(tokenizer)
+        with cls._lock:
+            cls._counts[cls._key(block, tokenizer)] = block_tokens
+            while len(cls._counts) > cls._MAX_ENTRIES:
+                cls._counts.popitem(last=False)
+            if block.stream_state == StreamState.STARTED or not tokenizer.is_exact:
+                # The text is still growing, or the count is only an estimate: don't tag the block with it.
+                return block_tokens
+            if block.id:
+                cls._pending[(block.id, tokenizer.name)] = (
+                    block,
+                    tag_name,
+                    block_tokens,
+                )
+
+        block.tags.append(
+            Tag(
+                kind=TagKindExtensions.TOKEN_COUNT,
+                name=tag_name,
+                value={TagValueKey.NUMBER_VALUE: block_tokens},
+            )
+        )
+        return block_tokens
+
+    @classmethod
+    def count_for_selection(
+        cls, block: Block, tokenizer: Tokenizer, remaining_tokens: int
+    ) -> int:
+        """Return the number of tokens to account for `block` when deciding whether it fits in `remaining_tokens`.
+
+        Blocks that have been counted before return their count. Otherwise, if the tokenizer's estimate shows that the
+        block clearly fits (or clearly doesn't), the estimate's upper (or lower) bound is returned without tokenizing.
+        Only blocks near the edge of the budget are counted exactly.
+        """
+        if not block.text:
+            return 0
+        if (block_tokens := cls._known_count(block, tokenizer)) is not None:
+            return block_tokens
+
+        low, high = tokenizer.estimate_range(block.text)
+        if high <= remaining_tokens:
+            return high
+        if low > remaining_tokens:
+            return low
+        return cls.count(block, tokenizer)
+
+    @classmethod
+    def flush(cls, backend: Optional[LocalBackend] = None):
+        """Persist the token counts computed since the last flush as Tags on their blocks, in `backend` if the blocks
+        are kept in one."""
+        with cls._lock:
+            pending = list(cls._pending.values())
+            cls._pending.clear()
+
+        for block, tag_name, block_tokens in pending:
+            value = {TagValueKey.NUMBER_VALUE: block_tokens}
+            try:
+                if backend:
+                    backend.create_tag(
+                        block, TagKindExtensions.TOKEN_COUNT, tag_name, value
+                    )
+                else:
+                    Tag.create(
+                        block.client,
+                        file_id=block.file_id,
+                        block_id=block.id,
+                        kind=TagKindExtensions.TOKEN_COUNT,
+                        name=tag_name,
+                        value=value,
+                    )
+            except Exception as e:
+                # Only an optimization: the block will simply be counted again by a later invocation.
+                logging.warning(f"Unable to store token count of block {block.id}: {e}")
+
+
+class ChatHistoryIndex:
+    """Inverted index from the tags of a chat history's blocks to their positions in `file.blocks`.
+
+    Chat histories are append-only, so the index is brought up to date by indexing just the blocks appended since the
+    last lookup. If the history was rewritten instead (blocks deleted or replaced), it is rebuilt from scratch. Tags
+    added to a block after it has been indexed (e.g. token counts) are not picked up.
+    """
+
+    _MAX_FILES = 16
+    _indexes: "OrderedDict[str, ChatHistoryIndex]" = OrderedDict()
+    _lock = threading.Lock()
+
+    def __init__(self, tokenizer: Tokenizer = DEFAULT_TOKENIZER):
+        self.by_tag: Dict[Tuple[str, str], List[int]] = defaultdict(list)
+        self.by_quest_id: Dict[str, List[int]] = defaultdict(list)
+        self.tokenizer = tokenizer
+        """The tokenizer that newly appended blocks are counted with: that of the story model using this history."""
+        self._indexed_count = 0
+        self._last_block_id = None
+
+    @classmethod
+    def for_file(cls, chat_history_file: File) -> "ChatHistoryIndex":
+        """Return the up-to-date index of `chat_history_file`, sharing it with every other lookup on the same file."""
+        with cls._lock:
+            index = cls._indexes.pop(chat_history_file.id, None) or ChatHistoryIndex()
+            cls._indexes[chat_history_file.id] = index
+            while len(cls._indexes) > cls._MAX_FILES:
+                cls._indexes.popitem(last=False)
+            index.update(chat_history_file.blocks or [])
+        return index
+
+    def update(self, blocks: List[Block]):
+        if len(blocks) < self._indexed_count or (
+            self._indexed_count
+            and blocks[self._indexed_count - 1].id != self._last_block_id
+        ):
+            self.__init__(self.tokenizer)
+
+        # Count the tokens of newly appended blocks right away, so that trimming the context doesn't have to. (When
+        # building the index from scratch, leave the older blocks to be counted on demand.)
+        count_tokens = self._indexed_count > 0
+        for position in range(self._indexed_count, len(blocks)):
+            if count_tokens:
+                TokenCountCache.count(blocks[position], self.tokenizer)
+            for tag in blocks[position].tags or []:
+                self.by_tag[_tag_key(tag.kind, tag.name)].append(position)
+                if (
+                    tag.kind == TagKindExtensions.QUEST
+                    and tag.name == QuestTag.QUEST_ID
+                    and tag.value is not None
+                ):
+                    self.by_quest_id[tag.value.get("id").lower()].append(position)
+
+        self._indexed_count = len(blocks)
+        self._last_block_id = blocks[-1].id if blocks else None
+
+    def with_tag(self, kind: str, name: str) -> List[int]:
+        """Return the positions of blocks with a tag of this kind and name, once per matching tag."""
+        return self.by_tag.get(_tag_key(kind, name), [])
+
+    def with_quest_id(self, quest_id: str) -> List[int]:
+        """Return the positions of blocks tagged with this quest id (see `QuestIdTag`), once per matching tag."""
+        return self.by_quest_id.get(quest_id.lower(), []) if quest_id else []
+
+
+def _debug_enabled() -> bool:
+    return logging.getLogger().isEnabledFor(logging.DEBUG)
 
 
 class ChatHistoryFilter(ABC):
@@ -37,12 +248,13 @@ class ChatHistoryFilter(ABC):
             if (not is_block_excluded(block_tuple[0]) and block_tuple[0].text)
         ]
 
-        debug_messages = [f"{filter_for} input: "]
-        for _, (block, inclusion_reason) in enumerate(filtered_blocks):
-            debug_messages.append(
-                f"{block.index_in_file} [{inclusion_reason}] ({block.chat_role}) {block.text}"
-            )
-        logging.debug("\n".join(debug_messages))
+        if _debug_enabled():
+            debug_messages = [f"{filter_for} input: "]
+            for _, (block, inclusion_reason) in enumerate(filtered_blocks):
+                debug_messages.append(
+                    f"{block.index_in_file} [{inclusion_reason}] ({block.chat_role}) {block.text}"
+                )
+            logging.debug("\n".join(debug_messages))
         return list(
             {filtered_block[0].index_in_file for filtered_block in filtered_blocks}
         )
@@ -57,12 +269,13 @@ class TagFilter(ChatHistoryFilter):
     def filter_blocks(
         self, chat_history_file: File
     ) -> List[Tuple[Block, Optional[str]]]:
+        index = ChatHistoryIndex.for_file(chat_history_file)
         result: List[Tuple[Block, Optional[str]]] = []
-        for block in chat_history_file.blocks:
-            for tag in block.tags:
-                for kind, name in self.tag_types:
-                    if tag.kind == kind and tag.name == name:
-                        result.append((block, f"{tag.kind} {tag.name}"))
+        for kind, name in self.tag_types:
+            for position in index.with_tag(kind, name):
+                block = chat_history_file.blocks[position]
+                result.append((block, f"{kind} {name}"))
+        result.sort(key=lambda x: x[0].index_in_file)
         return result
 
 
@@ -75,27 +288,22 @@ class QuestNameFilter(ChatHistoryFilter):
     def filter_blocks(
         self, chat_history_file: File
     ) -> List[Tuple[Block, Optional[str]]]:
-        result: List[Tuple[Block, Optional[str]]] = []
-        for block in chat_history_file.blocks:
-            for tag in block.tags:
-                if QuestIdTag.matches(tag, self.quest_name):
-                    result.append((block, "Quest ID match"))
-        return result
+        index = ChatHistoryIndex.for_file(chat_history_file)
+        return [
+            (chat_history_file.blocks[position], "Quest ID match")
+            for position in index.with_quest_id(self.quest_name)
+        ]
 
 
 class LastInventoryFilter(ChatHistoryFilter):
     def filter_blocks(
         self, chat_history_file: File
     ) -> List[Tuple[Block, Optional[str]]]:
-        result: List[Tuple[Block, Optional[str]]] = []
-        for _, block in enumerate(chat_history_file.blocks):
-            for tag in block.tags:
-                if (
-                    tag.kind == TagKindExtensions.CHARACTER
-                    and tag.name == CharacterTag.INVENTORY
-                ):
-                    result = [(block, "Last inventory")]
-        return result
+        index = ChatHistoryIndex.for_file(chat_history_file)
+        positions = index.with_tag(TagKindExtensions.CHARACTER, CharacterTag.INVENTORY)
+        if not positions:
+            return []
+        return [(chat_history_file.blocks[positions[-1]], "Last inventory")]
 
 
 class UnionFilter(ChatHistoryFilter):
@@ -117,21 +325,19 @@ class UnionFilter(ChatHistoryFilter):
     def dedupe_results(
         self, input: List[Tuple[Block, Optional[str]]]
     ) -> List[Tuple[Block, Optional[str]]]:
-        input.sort(key=lambda x: x[0].index_in_file)
-        result: List[Tuple[Block, Optional[str]]] = []
-        for included in input:
-            if len(result) == 0:
-                result.append(included)
-            else:
-                last_appended = result[-1]
-                if last_appended[0].index_in_file == included[0].index_in_file:
-                    result[-1] = (
-                        last_appended[0],
-                        f"{last_appended[1]} && {included[1]}",
-                    )
-                else:
-                    result.append(included)
-        return result
+        """Keep each block once, in order. Its inclusion reasons are only merged if debug logging is on."""
+        merge_reasons = _debug_enabled()
+        by_index: Dict[int, Tuple[Block, Optional[str]]] = {}
+        for block, reason in input:
+            if block.index_in_file not in by_index:
+                by_index[block.index_in_file] = (block, reason)
+            elif merge_reasons:
+                included_block, included_reason = by_index[block.index_in_file]
+                by_index[block.index_in_file] = (
+                    included_block,
+                    f"{included_reason} && {reason}",
+                )
+        return [by_index[index_in_file] for index_in_file in sorted(by_index)]
 
 
 ROLE_TOKEN_BUFFER_SIZE = 10
@@ -144,39 +350,75 @@ class TrimmingStoryContextFilter(ChatHistoryFilter):
         current_quest_id: str,
         game_state: GameState,
         max_tokens: int,
+        tokenizer: Tokenizer = DEFAULT_TOKENIZER,
     ):
         self._base_filter = base_filter
         self._current_quest_id = current_quest_id
         self._game_state = game_state
         self._max_tokens = max_tokens
-
-    def _calculate_and_store_token_count(self, block: Block) -> int:
-        if not block.text:
-            return 0
-        if value := get_tag_value_key(
-            block.tags, key=TagValueKey.NUMBER_VALUE, kind=TagKindExtensions.TOKEN_COUNT
-        ):
-            return value
-        block_tokens = tokens(block)
-        if block.client and block.id:
-            tag = Tag.create(
-                block.client,
-                file_id=block.file_id,
-                block_id=block.id,
-                kind=TagKindExtensions.TOKEN_COUNT,
-                value={TagValueKey.NUMBER_VALUE: block_tokens},
-            )
-        else:
-            tag = Tag(
-                kind=TagKindExtensions.TOKEN_COUNT,
-                value={TagValueKey.NUMBER_VALUE: block_tokens},
+        self._tokenizer = tokenizer
+        self.rolling_summary: Optional[Block] = None
+        self.uncompacted_blocks: List[Block] = []
+        """After filtering: the current quest's latest rolling summary, and its messages older than any left in the
+        context and not yet covered by that summary. See `generation_utils.compact_quest_history`."""
+
+    def _classify(  # noqa: C901
+        self, blocks: List[Block]
+    ) -> Tuple[
+        Optional[Block], Optional[Block], Optional[Block], List[Block], List[Block]
+    ]:
+        """Sort the candidate blocks into what the trimmed context is assembled from, in a single pass.
+
+        Returns the onboarding block, the current quest's beginning prompt, the current quest's latest rolling summary,
+        the current quest's assistant/user messages (newest first) and the quest summaries (newest first).
+        """
+        onboarding_block = None
+        quest_block = None
+        rolling_summary = None
+        quest_messages = []
+        summaries = []
+        for block in reversed(blocks):
+            is_onboarding = is_quest_instructions = is_summary = False
+            is_rolling_summary = False
+            quest_id = None
+            for tag in block.tags:
+                if tag.kind == TagKindExtensions.INSTRUCTIONS:
+                    if tag.name == InstructionsTag.ONBOARDING:
+                        is_onboarding = True
+                    elif tag.name == InstructionsTag.QUEST:
+                        is_quest_instructions = True
+                elif tag.kind == TagKindExtensions.QUEST:
+                    if tag.name == QuestTag.QUEST_ID and quest_id is None:
+                        quest_id = (tag.value or {}).get("id")
+                    elif tag.name == QuestTag.QUEST_SUMMARY:
+                        is_summary = True
+                    elif tag.name == QuestTag.ROLLING_SUMMARY:
+                        is_rolling_summary = True
+
+            if is_onboarding:
+                onboarding_block = (
+                    block  # Iterating in reverse, so this ends on the first one
+                )
+            is_current_quest = (
+                quest_id is not None and quest_id == self._current_quest_id
             )
-        block.tags.append(tag)
-        return block_tokens
+            if is_current_quest and is_quest_instructions and quest_block is None:
+                quest_block = block
+            if is_current_quest and is_rolling_summary and rolling_summary is None:
+                rolling_summary = block
+            if is_current_quest and block.chat_role in [
+                RoleTag.ASSISTANT,
+                RoleTag.USER,
+            ]:
+                quest_messages.append(block)
+            if is_summary:
+                summaries.append(block)
+        return onboarding_block, quest_block, rolling_summary, quest_messages, summaries
 
-    def filter_blocks(  # noqa: C901
+    def filter_blocks(
         self, chat_history_file: File
     ) -> List[Tuple[Block, Optional[str]]]:
+        ChatHistoryIndex.for_file(chat_history_file).tokenizer = self._tokenizer
         block_tuples = self._base_filter.filter_blocks(
             chat_history_file=chat_history_file
         )
@@ -189,99 +431,77 @@ class TrimmingStoryContextFilter(ChatHistoryFilter):
         ]
 
         id_to_reasons = {t[0].id: t[1] for t in block_tuples}
-        blocks = [t[0] for t in block_tuples]
+        (
+            onboarding_block,
+            quest_block,
+            rolling_summary,
+            quest_messages,
+            summaries,
+        ) = self._classify([t[0] for t in block_tuples])
+
+        # The rolling summary stands in for the quest messages it covers.
+        if rolling_summary is not None:
+            compacted_through = get_tag_value_key(
+                rolling_summary.tags,
+                key=TagValueKey.NUMBER_VALUE,
+                kind=TagKindExtensions.QUEST,
+                name=QuestTag.ROLLING_SUMMARY,
+            )
+            quest_messages = [
+                block
+                for block in quest_messages
+                if compacted_through is None or block.index_in_file > compacted_through
+            ]
 
         total_tokens = 0
-
-        # MUST include onboarding message, as it provides the proper overall context.
         selected_blocks = []
-        for block in blocks:
-            if get_tag(
-                tags=block.tags,
-                kind=TagKindExtensions.INSTRUCTIONS,
-                name=InstructionsTag.ONBOARDING,
-            ):
-                logging.debug(
-                    f"Selecting block: ({block.index_in_file}) [{block.chat_role}] {block.text}"
-                )
-                selected_blocks.append(block)
-                total_tokens += (
-                    self._calculate_and_store_token_count(block)
-                    + ROLE_TOKEN_BUFFER_SIZE
-                )
-                logging.debug(f"Total tokens: {total_tokens }")
-                break
 
-        # Also, MUST include quest beginning prompt
-        for block in reversed(blocks):
-            if not get_tag(
-                tags=block.tags,
-                kind=TagKindExtensions.INSTRUCTIONS,
-                name=InstructionsTag.QUEST,
-            ):
-                continue
-            if value := get_tag_value_key(
-                tags=block.tags,
-                kind=TagKindExtensions.QUEST,
-                name=QuestTag.QUEST_ID,
-                key="id",
-            ):
-                if value == self._current_quest_id:
-                    logging.debug(
-                        f"Selecting block: ({block.index_in_file}) [{block.chat_role}] {block.text}"
-                    )
-                    selected_blocks.append(block)
-                    total_tokens += (
-                        self._calculate_and_store_token_count(block)
-                        + ROLE_TOKEN_BUFFER_SIZE
-                    )
-                    logging.debug(f"Total tokens: {total_tokens}")
-                    break
+        def select(block: Block, block_tokens: int):
+            nonlocal total_tokens
+            logging.debug(
+                f"Selecting block: ({block.index_in_file}) [{block.chat_role}] {block.text}"
+            )
+            selected_blocks.append(block)
+            total_tokens += block_tokens + ROLE_TOKEN_BUFFER_SIZE
+            logging.debug(f"Total tokens: {total_tokens}")
 
-        # Now include any assistant/user messages that provide the context.
-        for block in reversed(blocks):
-            if block.chat_role not in [RoleTag.ASSISTANT, RoleTag.USER]:
+        # MUST include onboarding message, as it provides the proper overall context.
+        # Also, MUST include quest beginning prompt, and the summary of the quest's earlier turns
+        for block in [onboarding_block, quest_block, rolling_summary]:
+            if block is not None:
+                select(block, TokenCountCache.count(block, self._tokenizer))
+
+        # Now include any assistant/user messages that provide the context, and then the summaries of prior quests.
+        for block in [*quest_messages, *summaries]:
+            if total_tokens >= self._max_tokens:
+                break
+            if any(block is selected for selected in selected_blocks):
                 continue
-            if value := get_tag_value_key(
-                tags=block.tags,
-                kind=TagKindExtensions.QUEST,
-                name=QuestTag.QUEST_ID,
-                key="id",
-            ):
-                if value == self._current_quest_id:
-                    if total_tokens < self._max_tokens:
-                        block_tokens = self._calculate_and_store_token_count(block)
-                        if (
-                            block_tokens + total_tokens + ROLE_TOKEN_BUFFER_SIZE
-                            < self._max_tokens
-                        ):
-                            logging.debug(
-                                f"Selecting block: ({block.index_in_file}) [{block.chat_role}] {block.text}"
-                            )
-                            selected_blocks.append(block)
-                            total_tokens += block_tokens + ROLE_TOKEN_BUFFER_SIZE
-                            logging.debug(f"Total tokens: {total_tokens}")
-
-        if total_tokens < self._max_tokens:
-            for block in reversed(blocks):
-                if not get_tag(
-                    tags=block.tags,
-                    kind=TagKindExtensions.QUEST,
-                    name=QuestTag.QUEST_SUMMARY,
-                ):
-                    continue
-                if total_tokens < self._max_tokens:
-                    block_tokens = self._calculate_and_store_token_count(block)
-                    if (
-                        block_tokens + total_tokens + ROLE_TOKEN_BUFFER_SIZE
-                        < self._max_tokens
-                    ):
-                        logging.debug(
-                            f"Selecting block: ({block.index_in_file}) [{block.chat_role}] {block.text}"
-                        )
-                        selected_blocks.append(block)
-                        total_tokens += block_tokens + ROLE_TOKEN_BUFFER_SIZE
-                        logging.debug(f"Total tokens: {total_tokens}")
+            # Estimates are good enough unless the block only just fits (or only just doesn't).
+            block_tokens = TokenCountCache.count_for_selection(
+                block,
+                self._tokenizer,
+                self._max_tokens - total_tokens - ROLE_TOKEN_BUFFER_SIZE - 1,
+            )
+            if block_tokens + total_tokens + ROLE_TOKEN_BUFFER_SIZE < self._max_tokens:
+                select(block, block_tokens)
+
+        self.rolling_summary = rolling_summary
+        # Messages that didn't fit can sit between ones that did. Only those older than every selected message are
+        # left for the summary, which must cover an unbroken run of messages: it stands in for all of them.
+        oldest_selected = min(
+            (
+                block.index_in_file
+                for block in quest_messages
+                if any(block is selected for selected in selected_blocks)
+            ),
+            default=None,
+        )
+        self.uncompacted_blocks = [
+            block
+            for block in reversed(quest_messages)
+            if oldest_selected is None or block.index_in_file < oldest_selected
+        ]
 
         logging.debug(f"TOTAL_TOKENS = {total_tokens}, MAX_TOKENS = {self._max_tokens}")
         block_list = sorted(selected_blocks, key=lambda b: b.index_in_file)
@@ -9,19 +9,24 @@ from steamship.agents.schema import Action, Agent, FinishAction
 from steamship.agents.schema.context import AgentContext, EmitFunc, Metadata
 from steamship.agents.utils import with_llm
 from steamship.data import TagKind
-from steamship.data.tags.tag_constants import ChatTag
 from steamship.invocable import PackageService, post
 from steamship.invocable.invocable_response import StreamingResponse
 
 from utils.context_utils import (
     RunNextAgentException,
+    deferred_saves,
     emit,
+    get_current_quest,
     get_game_state,
     get_server_settings,
+    streamed_turn,
+    switch_history_to_current_quest,
     with_game_state,
+    with_local_backend,
     with_server_settings,
 )
 from utils.error_utils import record_and_throw_unrecoverable_error
+from utils.local_backend import LocalBackend, LocalFile
 from utils.tags import QuestIdTag
 
 
@@ -77,14 +82,6 @@ def build_context_appending_emit_func(
     return chat_history_append_func
 
 
-def _context_key_from_file(key: str, file: File) -> Optional[str]:
-    for tag in file.tags:
-        if tag.kind == TagKind.CHAT and tag.name == ChatTag.CONTEXT_KEYS:
-            if value := tag.value:
-                return value.get(key, None)
-    return None
-
-
 class AgentService(PackageService):
     """AgentService is a Steamship Package that can use an Agent, Tools, and a provided AgentContext to
     respond to user input."""
@@ -112,6 +109,9 @@ class AgentService(PackageService):
     on tool runs that consume resources with a cost-basis (e.g. prompt completions, embedding operations, vector lookups)
     """
 
+    local_backend: Optional[LocalBackend]
+    """If set, game state and chat history are kept in this local database rather than in the Steamship workspace."""
+
     _agent_context: Optional[AgentContext] = None
 
     def __init__(
@@ -121,8 +121,10 @@ class AgentService(PackageService):
         max_actions_per_run: Optional[int] = 5,
         max_actions_per_tool: Optional[Dict[str, int]] = None,
         agent: Optional[Agent] = None,
+        local_backend: Optional[LocalBackend] = None,
         **kwargs,
     ):
+        self.local_backend = local_backend
         self.use_llm_cache = use_llm_cache
         self.use_action_cache = use_action_cache
         self.max_actions_per_run = max_actions_per_run
@@ -403,19 +405,28 @@ class AgentService(PackageService):
         include_llm_messages = kwargs.get("include_llm_messages", True)
         include_tool_messages = kwargs.get("include_tool_messages", True)
 
-        context = AgentContext.get_or_create(
-            client=self.client,
-            context_keys={"id": f"{context_id}"},
-            use_llm_cache=use_llm_cache,
-            use_action_cache=use_action_cache,
-            streaming_opts=StreamingOpts(
-                include_agent_messages=include_agent_messages,
-                include_llm_messages=include_llm_messages,
-                include_tool_messages=include_tool_messages,
-            ),
-            initial_system_message="",  # None necessary
-            searchable=False,
+        streaming_opts = StreamingOpts(
+            include_agent_messages=include_agent_messages,
+            include_llm_messages=include_llm_messages,
+            include_tool_messages=include_tool_messages,
         )
+        if self.local_backend:
+            context = self.local_backend.get_or_create_context(
+                client=self.client,
+                context_keys={"id": f"{context_id}"},
+                streaming_opts=streaming_opts,
+            )
+            context = with_local_backend(self.local_backend, context)
+        else:
+            context = AgentContext.get_or_create(
+                client=self.client,
+                context_keys={"id": f"{context_id}"},
+                use_llm_cache=use_llm_cache,
+                use_action_cache=use_action_cache,
+                streaming_opts=streaming_opts,
+                initial_system_message="",  # None necessary
+                searchable=False,
+            )
 
         # Add a default LLM to the context, using the Agent's if it exists.
         llm = ChatOpenAI(client=self.client)
@@ -430,6 +441,9 @@ class AgentService(PackageService):
         context = with_server_settings(
             server_settings, context
         )  # TODO: This shouldn't bve necessary since get_server_settings caches it.
+
+        # While on a quest, the story goes into the quest's own chat history.
+        context = switch_history_to_current_quest(context)
         # TODO(doug): figure out how to make this selectable.
 
         self._agent_context = context
@@ -438,7 +452,6 @@ class AgentService(PackageService):
     def _history_file_for_context(
         self, context_id: Optional[str] = None, **kwargs
     ) -> File:
-
         # NOTA BENE!
         context_id = "default"
 
@@ -448,6 +461,23 @@ class AgentService(PackageService):
         # if context_id is None:
         #     context_id = uuid.uuid4()
 
+        # While on a quest, stream from the quest's own chat history. Only the game state is needed to tell which file
+        # that is, not the whole context.
+        if self._agent_context is not None:
+            return self._agent_context.chat_history.file
+        state_context = AgentContext()
+        state_context.client = self.client
+        if self.local_backend:
+            state_context = with_local_backend(self.local_backend, state_context)
+        quest = get_current_quest(state_context)
+        if quest and quest.chat_file_id:
+            if self.local_backend:
+                return LocalFile(self.local_backend, quest.chat_file_id)
+            return File(client=self.client, id=quest.chat_file_id)
+
+        if self.local_backend:
+            return self.local_backend.get_or_create_file({"id": f"{context_id}"})
+
         ctx = AgentContext.get_or_create(
             self.client,
             context_keys={"id": f"{context_id}"},
@@ -460,18 +490,9 @@ class AgentService(PackageService):
         self, context_id: Optional[str] = None, **kwargs
     ) -> Tuple[Optional[str], File]:
         history_file = self._history_file_for_context(context_id=context_id)
-        ctx_id = context_id
-
-        # if no context ID is provided, try to get a consistent ID from history_file
-        if not ctx_id:
-            ctx_id = _context_key_from_file(key="id", file=history_file)
-
-        # if you can't find a consistent context_id, then something has gone wrong, preventing streaming
-        if not ctx_id:
-            # TODO(dougreid): this points to a slight flaw in the context_keys vs. context_id
-            raise SteamshipError("Error setting up context: no id found for context.")
-
-        return ctx_id, history_file
+        # NOTA BENE! The game always runs in the `default` context, whichever chat history -- e.g. a quest's -- it
+        # streams from, so there's no need to read the context id from the file's tags.
+        return context_id or "default", history_file
 
     @post("async_prompt")
     def async_prompt(
@@ -536,39 +557,45 @@ class AgentService(PackageService):
                     )
                 )
 
-            had_exception = (
-                True  # Not true, but it causes the loop to execute at least once.
-            )
-            max_exceptions_allowed = 4
-            exception_count = 0
-            while had_exception:
-                try:
-                    self._prompt(prompt, context)
-                    had_exception = False
-                except RunNextAgentException as e:
-                    exception_count += 1
-                    if exception_count > max_exceptions_allowed:
-                        raise SteamshipError(message="Maximum agent switches exceeded")
-
-                    logging.info(
-                        "Got RunNextAgentException. Loading next agent.",
-                        extra={
-                            AgentLogging.IS_MESSAGE: True,
-                            AgentLogging.MESSAGE_TYPE: AgentLogging.THOUGHT,
-                            AgentLogging.MESSAGE_AUTHOR: AgentLogging.AGENT,
-                        },
-                    )
-                    self.agent = None
+            # Buffer every game state / server settings save made during this turn and write them once at the end.
+            # Whatever the turn tells in another chat history than the one `async_prompt` streams to web clients is
+            # copied there.
+            with deferred_saves(context), streamed_turn(context):
+                had_exception = (
+                    True  # Not true, but it causes the loop to execute at least once.
+                )
+                max_exceptions_allowed = 4
+                exception_count = 0
+                while had_exception:
+                    try:
+                        self._prompt(prompt, context)
+                        had_exception = False
+                    except RunNextAgentException as e:
+                        exception_count += 1
+                        if exception_count > max_exceptions_allowed:
+                            raise SteamshipError(
+                                message="Maximum agent switches exceeded"
+                            )
+
+                        logging.info(
+                            "Got RunNextAgentException. Loading next agent.",
+                            extra={
+                                AgentLogging.IS_MESSAGE: True,
+                                AgentLogging.MESSAGE_TYPE: AgentLogging.THOUGHT,
+                                AgentLogging.MESSAGE_AUTHOR: AgentLogging.AGENT,
+                            },
+                        )
+                        self.agent = None
 
-                    had_exception = True
-                    for block in e.action.output or []:
-                        emit(output=block, context=context)
+                        had_exception = True
+                        for block in e.action.output or []:
+                            emit(output=block, context=context)
 
-                    prompt = "Hi."
-                    if e.action.input:
-                        prompt = e.action.input[0].text
-                except BaseException as e:
-                    record_and_throw_unrecoverable_error(e, context)
+                        prompt = "Hi."
+                        if e.action.input:
+                            prompt = e.action.input[0].text
+                    except BaseException as e:
+                        record_and_throw_unrecoverable_error(e, context)
 
             # timings = API_TIMINGS
             # pretty_print_timings(timings)
@@ -1,11 +1,10 @@
 import os
-import time
 from datetime import datetime
-from typing import List, TextIO
+from typing import Dict, List, Optional, TextIO
 
 from pydantic_yaml import parse_yaml_raw_as
 from steamship import Block, Steamship, Workspace
-from steamship.agents.schema import AgentContext
+from steamship.agents.schema import AgentContext, ChatHistory
 from steamship.data import TagKind
 from steamship.data.block import StreamState
 from steamship.data.tags.tag_constants import RoleTag
@@ -21,12 +20,17 @@ from schema.characters import HumanCharacter
 from schema.game_state import ActiveMode
 from schema.server_settings import ServerSettings
 from utils.context_utils import (
+    chat_histories_since,
+    chat_history_blocks_after,
+    get_block,
     get_game_state,
     get_story_text_generator,
     save_game_state,
     save_server_settings,
 )
 from utils.dummy_generator import DummyGenerator
+from utils.moderation_utils import is_block_excluded
+from utils.stream_waiter import StreamTimeoutError, StreamWaiter
 from utils.tags import QuestArcTag, QuestTag, TagKindExtensions
 
 output_tags = [
@@ -44,7 +48,8 @@ class AutoPlayHarness:
     workspace: Workspace
     client: Steamship
     service: AdventureGameService
-    last_seen_block = -1
+    last_seen_blocks: Dict[str, int]  # By chat history file ID
+    last_seen_history: Optional[ChatHistory] = None
     last_content_block: Block
     context: AgentContext
     output_file: TextIO
@@ -80,27 +85,28 @@ class AutoPlayHarness:
         set_music_generator(self.context, dummy_generator)
 
         self.output_file = open(output_path, "w", encoding="utf-8")
+        self.last_seen_blocks = {}
 
     def print_object_or_objects(self, output: List[Block]):
-        context = AgentContext.get_or_create(
-            client=self.client,
-            context_keys={"id": "default"},
-            searchable=False,
-        )
-        for block in context.chat_history.file.blocks:
-            if block.index_in_file > self.last_seen_block:
+        # self.context is the service's own (cached) context: one refresh per turn brings in the blocks plugins
+        # appended server-side, and only the blocks after the last one printed are walked.
+        context = self.context
+        for history in chat_histories_since(self.last_seen_history, context):
+            history.file.refresh()
+            for block in chat_history_blocks_after(
+                self.last_seen_blocks.get(history.file.id, -1), context, history
+            ):
+                self.last_seen_blocks[history.file.id] = block.index_in_file
+                if is_block_excluded(block):
+                    continue
                 if block.stream_state == StreamState.STARTED:
-                    start_time = time.perf_counter()
-                    while (
-                        block.stream_state
-                        not in [
-                            StreamState.COMPLETE,
-                            StreamState.ABORTED,
-                        ]
-                        and (time.perf_counter() - start_time) < 30
-                    ):
-                        time.sleep(0.4)
-                        block = Block.get(block.client, _id=block.id)
+                    try:
+                        block = StreamWaiter(
+                            deadline=30, fetch=lambda b: get_block(b.id, context)
+                        ).wait(block)
+                    except StreamTimeoutError as e:
+                        print(f"WARNING: {e.message}")
+                        block = e.block  # Show what there is of it
                 for tag in block.tags:
                     if (
                         tag.kind == TagKindExtensions.QUEST
@@ -109,8 +115,8 @@ class AutoPlayHarness:
                         self.last_content_block = block
 
                 self.print_new_block(block)
-        self.last_seen_block = context.chat_history.file.blocks[-1].index_in_file
-        print(f"LAST SEEN BLOCK: {self.last_seen_block}")
+        self.last_seen_history = context.chat_history
+        print(f"LAST SEEN BLOCKS: {self.last_seen_blocks}")
 
     def print_new_block(self, block: Block):
         tag_kinds = {tag.kind for tag in block.tags}
@@ -17,23 +17,46 @@ layered on top to boot.
 
 That reduces the need of the game code to perform verbose plumbing operations.
 """
+import hashlib
+import json
 import logging
-from typing import List, Optional, Union
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Dict, List, Optional, Tuple, Union
 
-from steamship import Block, PluginInstance
+from steamship import Block, PluginInstance, Tag
 from steamship.agents.llms.openai import ChatOpenAI
 from steamship.agents.logging import AgentLogging
 from steamship.agents.schema import ChatHistory, ChatLLM, FinishAction
 from steamship.agents.schema.agent import AgentContext
+from steamship.data import TagKind
+from steamship.data.tags.tag_constants import RoleTag
+from steamship.utils import kv_store as steamship_kv_store
 from steamship.utils.kv_store import KeyValueStore
 
 from generators.cascading_plugin import CascadingPlugin
 from schema.game_state import GameState
 from schema.image_theme import DEFAULT_THEME, PREMADE_THEMES, ImageTheme
+from schema.quest import Quest
 from schema.server_settings import ServerSettings
-from utils.tags import QuestIdTag
+from schema.tracked_model import ROOT_SUBTREE, TrackedModel
+from utils.ChatHistoryFilter import ChatHistoryIndex
+from utils.kv_encoding import decode_value, encode_value
+from utils.model_capabilities import prompt_budget
+from utils.moderation_utils import excluded_tag
+from utils.tags import (
+    CharacterTag,
+    InstructionsTag,
+    QuestIdTag,
+    QuestTag,
+    TagKindExtensions,
+)
+from utils.tokenizers import Tokenizer, tokenizer_for_model
 
 _STORY_GENERATOR_KEY = "story-generator"
+_STORY_MODELS_KEY = "story-models"
 _FUNCTION_CAPABLE_LLM = (
     "function-capable-llm"  # This could be distinct from the one generating the story.
 )
@@ -41,6 +64,52 @@ _BACKGROUND_MUSIC_GENERATOR_KEY = "background-music-generator"
 _NARRATION_GENERATOR_KEY = "narration-generator"
 _SERVER_SETTINGS_KEY = "server-settings"
 _GAME_STATE_KEY = "user-settings"
+_QUEST_ARCHIVE_KEY = "quest-archive"
+_PENDING_SAVES_KEY = "pending-saves"
+_LOCAL_BACKEND_KEY = "local-backend"
+_MAIN_CHAT_HISTORY_KEY = "main-chat-history"
+_TURN_CHAT_HISTORIES_KEY = "turn-chat-histories"
+_VERSION_SUBTREE = "__version__"
+_VERSION_STORE_SUFFIX = "-version"
+_MAX_SAVE_ATTEMPTS = 3
+
+# Parsed ServerSettings shared by every invocation this process serves, keyed by workspace handle (and local backend,
+# if any) and stored as (version, server settings). Settings are read far more often than they are saved, and parsing them is expensive.
+_server_settings_cache: Dict[Tuple, Tuple[int, "ServerSettings"]] = {}
+
+# Generated texts shared by every invocation this process serves, keyed by workspace handle (and local backend, if any)
+# and generation (see `generation_cache_key`), least recently used first, and stored as (expiry time, text). They are
+# only kept in memory: a shared store would cost more round trips than the generations it saves.
+_generation_cache: "OrderedDict[Tuple, Tuple[float, str]]" = OrderedDict()
+_generation_cache_lock = threading.Lock()
+_MAX_CACHED_GENERATIONS = 1024
+
+
+def with_local_backend(
+    backend: "LocalBackend", context: AgentContext  # noqa: F821
+) -> AgentContext:
+    """Keep the game's state in `backend` rather than in the Steamship workspace. See `utils.local_backend`."""
+    context.metadata[_LOCAL_BACKEND_KEY] = backend
+    return context
+
+
+def get_local_backend(
+    context: AgentContext,
+) -> Optional["LocalBackend"]:  # noqa: F821
+    return context.metadata.get(_LOCAL_BACKEND_KEY)
+
+
+def _key_value_store(context: AgentContext, store_identifier: str) -> KeyValueStore:
+    if backend := get_local_backend(context):
+        return backend.key_value_store(store_identifier)
+    return KeyValueStore(context.client, store_identifier)
+
+
+def get_block(block_id: str, context: AgentContext) -> Block:
+    """Fetch the Block with ID `block_id`, from the context's local backend if it has one."""
+    if backend := get_local_backend(context):
+        return backend.get_block(block_id)
+    return Block.get(context.client, _id=block_id)
 
 
 def with_function_capable_llm(instance: ChatLLM, context: AgentContext) -> AgentContext:
@@ -88,6 +157,7 @@ def get_story_text_generator(
         elif model_name in replicate_models:
             plugin_handle = "replicate-llm"
 
+        context.metadata[_STORY_MODELS_KEY] = [model_name]
         generator = context.client.use_plugin(
             plugin_handle,
             config={
@@ -98,28 +168,65 @@ def get_story_text_generator(
         )
 
         if server_settings.allow_backup_story_models:
-            providers = [
-                lambda: generator
-            ]
+            primary_generator = generator
+            providers = [lambda: primary_generator]
             for backup_model_name in open_ai_models:
                 if backup_model_name == model_name:
                     continue
-                provider = lambda: context.client.use_plugin(
+                provider = lambda backup_model_name=backup_model_name: context.client.use_plugin(  # noqa: E731
                     "gpt-4",
                     config={
                         "model": backup_model_name,
                         "max_tokens": server_settings.default_story_max_tokens,
-                        "temperature": server_settings.default_story_temperature
-                    }
+                        "temperature": server_settings.default_story_temperature,
+                    },
                 )
                 providers.append(provider)
-            generator = CascadingPlugin(instance_providers=providers)
+                context.metadata[_STORY_MODELS_KEY].append(backup_model_name)
+            # Named by model, so that a failing model is skipped by the generators of later requests too.
+            generator = CascadingPlugin(
+                instance_providers=providers,
+                provider_names=list(context.metadata[_STORY_MODELS_KEY]),
+            )
 
         context.metadata[_STORY_GENERATOR_KEY] = generator
 
     return generator
 
 
+def get_story_models(context: AgentContext) -> List[str]:
+    """Return the models the story text generator may use: its own model first, then any backup models."""
+    get_story_text_generator(context)
+    return context.metadata.get(_STORY_MODELS_KEY) or [
+        get_server_settings(context).default_story_model
+    ]
+
+
+def get_story_model(context: AgentContext) -> str:
+    """Return the model the next story generation will go to: the story model, unless its generator is skipping it for
+    a backup model (see `CascadingPlugin`)."""
+    generator = get_story_text_generator(context)
+    models = get_story_models(context)
+    if isinstance(generator, CascadingPlugin):
+        return models[generator.next_provider()]
+    return models[0]
+
+
+def get_story_tokenizer(context: AgentContext) -> Tokenizer:
+    """Return the tokenizer matching the model of the next story generation."""
+    return tokenizer_for_model(get_story_model(context))
+
+
+def get_story_prompt_budget(context: AgentContext) -> int:
+    """Return how many tokens the next story prompt may have (see `model_capabilities.prompt_budget`)."""
+    server_settings = get_server_settings(context)
+    return prompt_budget(
+        get_story_model(context),
+        max_output_tokens=server_settings.default_story_max_tokens,
+        target_prompt_tokens=server_settings.story_prompt_target_tokens,
+    )
+
+
 def get_background_music_generator(
     context: AgentContext, default: Optional[PluginInstance] = None
 ) -> Optional[PluginInstance]:
@@ -188,21 +295,122 @@ def get_server_settings(
         # )
         return context.metadata.get(_SERVER_SETTINGS_KEY)
 
-    # Get it from the KV Store
-    kv = KeyValueStore(context.client, _SERVER_SETTINGS_KEY)
-    value = kv.get(_SERVER_SETTINGS_KEY)
+    # Get it from the process-wide cache if nothing has been saved since it was cached
+    cached_version, cached_server_settings = _server_settings_cache.get(
+        _server_settings_cache_key(context), (None, None)
+    )
+    if cached_server_settings and cached_version == _stored_version(
+        context, _SERVER_SETTINGS_KEY
+    ):
+        server_settings = cached_server_settings.copy(deep=True)
+        context.metadata[_SERVER_SETTINGS_KEY] = server_settings
+        return server_settings
 
-    if value:
-        logging.debug(f"Parsing Server Settings from stored value: {value}")
-        server_settings = ServerSettings.parse_obj(value)
+    # Get it from the KV Store
+    subtrees, version, schema = _load_document(context, _SERVER_SETTINGS_KEY)
+
+    if subtrees.get(ROOT_SUBTREE):
+        logging.debug(f"Parsing Server Settings from stored value: {subtrees}")
+        # Values saved by code with this same schema don't need to be validated again.
+        trusted = schema == ServerSettings.schema_fingerprint()
+        server_settings = ServerSettings.from_persisted_subtrees(
+            subtrees, trusted=trusted
+        )
+        server_settings.mark_clean(subtrees, version)
+        if not trusted:
+            # Have the next save rewrite it with this schema.
+            server_settings.mark_needs_rewrite()
+        _cache_server_settings(server_settings, context)
     else:
         logging.debug("Creating new Server Settings -- one didn't exist!")
         server_settings = ServerSettings()
+        server_settings.mark_clean(subtrees, version)
+        server_settings.mark_needs_rewrite()
 
     context.metadata[_SERVER_SETTINGS_KEY] = server_settings
     return server_settings
 
 
+def _cache_server_settings(server_settings: ServerSettings, context: AgentContext):
+    """Remember a copy of `server_settings` as the latest for this workspace, replacing any older copy.
+
+    Only versioned settings are cached: without a version there is no way to tell that the cached copy is stale.
+    """
+    cache_key = _server_settings_cache_key(context)
+    if server_settings.persisted_version:
+        _server_settings_cache[cache_key] = (
+            server_settings.persisted_version,
+            server_settings.copy(deep=True),
+        )
+    else:
+        _server_settings_cache.pop(cache_key, None)
+
+
+def _server_settings_cache_key(context: AgentContext) -> Tuple:
+    return (
+        context.client.config.workspace_handle,
+        get_local_backend(context),
+    )
+
+
+def generation_cache_key(
+    context: AgentContext,
+    prompt: str,
+    blocks: List[Block],
+    options: Optional[dict] = None,
+) -> str:
+    """Identify a story text generation by its prompt, its context blocks and the configuration of its models."""
+    server_settings = get_server_settings(context)
+    description = {
+        "prompt": prompt,
+        "blocks": [[block.id, block.text] for block in blocks],
+        "models": get_story_models(context),
+        "max_tokens": server_settings.default_story_max_tokens,
+        "temperature": server_settings.default_story_temperature,
+        "options": options or {},
+    }
+    return hashlib.sha256(
+        json.dumps(description, sort_keys=True).encode("utf-8")
+    ).hexdigest()
+
+
+def get_cached_generation(context: AgentContext, key: str) -> Optional[str]:
+    """Return the text generated for `key` (see `generation_cache_key`), if it was cached and hasn't expired."""
+    if not get_server_settings(context).generation_cache_ttl_seconds:
+        return None
+    cache_key = (*_server_settings_cache_key(context), key)
+    with _generation_cache_lock:
+        if cache_key not in _generation_cache:
+            return None
+        expires, text = _generation_cache[cache_key]
+        if expires < time.time():
+            del _generation_cache[cache_key]
+            return None
+        _generation_cache.move_to_end(cache_key)
+        return text
+
+
+def cache_generation(context: AgentContext, key: str, text: str):
+    """Remember `text` as the generation for `key`, for the workspace's generation cache TTL."""
+    ttl = get_server_settings(context).generation_cache_ttl_seconds
+    if not ttl:
+        return
+    now = time.time()
+    with _generation_cache_lock:
+        for expired_key in [
+            cache_key
+            for cache_key, (expires, _) in _generation_cache.items()
+            if expires < now
+        ]:
+            del _generation_cache[expired_key]
+        _generation_cache[(*_server_settings_cache_key(context), key)] = (
+            now + ttl,
+            text,
+        )
+        while len(_generation_cache) > _MAX_CACHED_GENERATIONS:
+            _generation_cache.popitem(last=False)
+
+
 def get_game_state(context: AgentContext) -> Optional["GameState"]:  # noqa: F821
     logging.debug(
         f"Refreshing Game State from workspace {context.client.config.workspace_handle}.",
@@ -216,16 +424,23 @@ def get_game_state(context: AgentContext) -> Optional["GameState"]:  # noqa: F82
     if _GAME_STATE_KEY in context.metadata:
         return context.metadata.get(_GAME_STATE_KEY)
 
-    # Get it from the KV Store
-    kv = KeyValueStore(context.client, _GAME_STATE_KEY)
-    value = kv.get(_GAME_STATE_KEY)
-
-    if value:
-        logging.debug(f"Parsing game state from stored value: \n{value}")
-        game_state = GameState.parse_obj(value)
+    # Get it from the KV Store. All of its sub-trees live in the same store, so one fetch retrieves them all.
+    subtrees, version, schema = _load_document(context, _GAME_STATE_KEY)
+
+    if subtrees.get(ROOT_SUBTREE):
+        logging.debug(f"Parsing game state from stored value: \n{subtrees}")
+        # Values saved by code with this same schema don't need to be validated again.
+        trusted = schema == GameState.schema_fingerprint()
+        game_state = GameState.from_persisted_subtrees(subtrees, trusted=trusted)
+        game_state.mark_clean(subtrees, version)
+        if not trusted:
+            # Including legacy single-document values: have the next save rewrite every sub-tree with this schema.
+            game_state.mark_needs_rewrite()
     else:
         logging.debug("Creating new game state -- one didn't exist!")
         game_state = GameState()
+        game_state.mark_clean(subtrees, version)
+        game_state.mark_needs_rewrite()
 
     context.metadata[_GAME_STATE_KEY] = game_state
     return game_state
@@ -247,14 +462,19 @@ def save_server_settings(server_settings, context: AgentContext):
         f"Saving server_settings from workspace {context.client.config.workspace_handle} generation_task_id={server_settings.generation_task_id}.",
     )
 
-    # Save it to the KV Store
-    value = server_settings.dict()
-    kv = KeyValueStore(context.client, _SERVER_SETTINGS_KEY)
-    kv.set(_SERVER_SETTINGS_KEY, value)
-
     # Also save it to the context
     context.metadata[_SERVER_SETTINGS_KEY] = server_settings
 
+    if _defer_save(_SERVER_SETTINGS_KEY, context):
+        return
+
+    _write_server_settings(server_settings, context)
+
+
+def _write_server_settings(server_settings, context: AgentContext):
+    _write_document(server_settings, _SERVER_SETTINGS_KEY, context)
+    _cache_server_settings(server_settings, context)
+
 
 def save_game_state(game_state, context: AgentContext):
     """Save GameState to the KeyValue store."""
@@ -268,14 +488,211 @@ def save_game_state(game_state, context: AgentContext):
         },
     )
 
-    # Save it to the KV Store
-    value = game_state.dict()
-    kv = KeyValueStore(context.client, _GAME_STATE_KEY)
-    kv.set(_GAME_STATE_KEY, value)
-
     # Also save it to the context
     context.metadata[_GAME_STATE_KEY] = game_state
 
+    if _defer_save(_GAME_STATE_KEY, context):
+        return
+
+    _write_game_state(game_state, context)
+
+
+def _write_game_state(game_state, context: AgentContext):
+    _write_document(game_state, _GAME_STATE_KEY, context)
+
+
+def _write_document(document: TrackedModel, key: str, context: AgentContext):
+    """Save the changed sub-trees of `document` to the KV Store, conditional on its version.
+
+    The version stored next to the document is compared with the one `document` was loaded at. If another
+    invocation saved in between, `document.rebase` merges our changes onto that save before writing, rather than
+    letting the last writer silently win. The KV Store has no atomic compare-and-set, so this narrows the race
+    window to the check-then-write gap rather than closing it entirely.
+    """
+    subtrees, changed, removed = document.changed_subtrees()
+    if not changed and not removed:
+        return
+
+    for _ in range(_MAX_SAVE_ATTEMPTS):
+        stored_version = _stored_version(context, key)
+        if stored_version == document.persisted_version:
+            break
+        logging.info(
+            f"{key} was saved concurrently (stored version {stored_version}, loaded version "
+            f"{document.persisted_version}). Merging before saving."
+        )
+        theirs, their_version, _ = _load_document(context, key)
+        document.rebase(theirs, their_version)
+        subtrees, changed, removed = document.changed_subtrees()
+    else:
+        logging.warning(f"{key} kept changing while saving. Overwriting.")
+
+    # After the last rebase, the model is at the version it was rebased onto, which may be newer than the one checked.
+    new_version = max(stored_version, document.persisted_version) + 1
+    _save_subtrees(_key_value_store(context, key), key, changed, removed)
+    # The stamp is written last, so that a version is never visible before the data saved at it.
+    _write_entries(
+        _version_store(context, key),
+        {key: {"version": new_version, "schema": document.schema_fingerprint()}},
+    )
+    document.mark_clean(subtrees, new_version)
+
+
+@contextmanager
+def deferred_saves(context: AgentContext):
+    """Buffer save_game_state / save_server_settings calls, writing each object at most once on exit.
+
+    USAGE:
+
+        with deferred_saves(context):
+            ...  # any number of save_game_state(..) calls
+        # <- a single KV write here
+
+    The saved objects are updated in the context immediately, so reads within the block see them. Only the KV write
+    is deferred, which means a separate invocation (an invoke_later task, a web request) won't see the changes until
+    the block exits or `flush_saves` is called. Nested blocks join the outermost one.
+    """
+    if _PENDING_SAVES_KEY in context.metadata:
+        yield context
+        return
+
+    context.metadata[_PENDING_SAVES_KEY] = set()
+    try:
+        yield context
+    finally:
+        try:
+            flush_saves(context)
+        finally:
+            context.metadata.pop(_PENDING_SAVES_KEY, None)
+
+
+def flush_saves(context: AgentContext):
+    """Immediately write any saves buffered by `deferred_saves`.
+
+    Call this before handing control to anything that reads state from the KV Store rather than the context.
+    """
+    pending = context.metadata.get(_PENDING_SAVES_KEY)
+    if not pending:
+        return
+
+    logging.debug(f"Flushing deferred saves: {sorted(pending)}")
+    if _SERVER_SETTINGS_KEY in pending:
+        _write_server_settings(context.metadata[_SERVER_SETTINGS_KEY], context)
+    if _GAME_STATE_KEY in pending:
+        _write_game_state(context.metadata[_GAME_STATE_KEY], context)
+    pending.clear()
+
+
+def _defer_save(key: str, context: AgentContext) -> bool:
+    """Record a pending save of `key` if a `deferred_saves` block is open. Returns whether it was deferred."""
+    pending = context.metadata.get(_PENDING_SAVES_KEY)
+    if pending is None:
+        return False
+    pending.add(key)
+    return True
+
+
+def _subtree_key(key: str, subtree: str) -> str:
+    """The KeyValueStore key under which `subtree` of the document stored at `key` lives."""
+    if subtree == ROOT_SUBTREE:
+        return key
+    return f"{key}/{subtree}"
+
+
+def _load_subtrees(kv: KeyValueStore, key: str) -> Dict[str, dict]:
+    """Load every sub-tree of the document stored at `key`."""
+    subtrees = {}
+    prefix = f"{key}/"
+    for item_key, value in kv.items():
+        if item_key == key:
+            subtrees[ROOT_SUBTREE] = decode_value(value)
+        elif item_key.startswith(prefix):
+            subtrees[item_key[len(prefix) :]] = decode_value(value)
+    return subtrees
+
+
+def _version_store(context: AgentContext, key: str) -> KeyValueStore:
+    """The KV store holding the version stamp of the document stored at `key`.
+
+    It is kept apart from the document, so that checking the version -- done before every save, and by every cached
+    read of the server settings -- only downloads the stamp rather than the whole document.
+    """
+    return _key_value_store(context, f"{key}{_VERSION_STORE_SUFFIX}")
+
+
+def _load_document(
+    context: AgentContext, key: str
+) -> Tuple[Dict[str, dict], int, Optional[str]]:
+    """Load every sub-tree of the document stored at `key`, along with its version and the schema fingerprint
+    of the code that saved it."""
+    # Read the stamp first: it is written after the data, so the data loaded is at least as new as its version.
+    stamp = _version_store(context, key).get(key)
+    subtrees = _load_subtrees(_key_value_store(context, key), key)
+    # Documents saved before stamps had a store of their own keep theirs as a sub-tree. It is only read until the next
+    # save stamps the document in the version store.
+    legacy_stamp = subtrees.pop(_VERSION_SUBTREE, None)
+    stamp = stamp or legacy_stamp or {}
+    return subtrees, stamp.get("version", 0), stamp.get("schema")
+
+
+def _stored_version(context: AgentContext, key: str) -> int:
+    """Return the version of the document stored at `key`, reading only its stamp from the version store."""
+    stamp = _version_store(context, key).get(key)
+    if stamp is None:
+        # Not saved since stamps moved to the version store, or never saved at all.
+        stamp = _key_value_store(context, key).get(_subtree_key(key, _VERSION_SUBTREE))
+    return (stamp or {}).get("version", 0)
+
+
+def _save_subtrees(
+    kv: KeyValueStore, key: str, changed: Dict[str, dict], removed: List[str]
+):
+    """Write the changed sub-trees of the document stored at `key`, in the compact encoding of `kv_encoding`.
+
+    The root is written last: it records which sub-trees exist, so it should never point at ones not yet written.
+    """
+    entries = {_subtree_key(key, subtree): None for subtree in removed}
+    for subtree, value in changed.items():
+        if subtree != ROOT_SUBTREE:
+            entries[_subtree_key(key, subtree)] = encode_value(value)
+    if ROOT_SUBTREE in changed:
+        entries[key] = encode_value(changed[ROOT_SUBTREE])
+    _write_entries(kv, entries)
+
+
+def _write_entries(kv: KeyValueStore, entries: Dict[str, Optional[dict]]):
+    """Set each entry of `kv` in `entries`, in order, deleting those whose value is None.
+
+    Steamship's KeyValueStore downloads its whole File -- every entry -- once for each `delete`, and twice for each
+    `set`. For those stores, the File is fetched once here and its tags deleted and created directly.
+    """
+    if not isinstance(kv, steamship_kv_store.KeyValueStore):
+        for entry_key, value in entries.items():
+            if value is None:
+                kv.delete(entry_key)
+            else:
+                kv.set(entry_key, value)
+        return
+
+    file = kv._get_file(or_create=True)
+    stored_tags = [tag for tag in file.tags if tag.kind == kv.store_identifier]
+    for entry_key, value in entries.items():
+        # Delete before creating, as KeyValueStore.set does, so that no entry ever has two values.
+        for tag in stored_tags:
+            if tag.name == entry_key:
+                tag.delete()
+        if value is not None:
+            kv.client.post(
+                "tag/create",
+                Tag(
+                    file_id=file.id,
+                    kind=kv.store_identifier,
+                    name=entry_key,
+                    value=value,
+                ),
+                expect=Tag,
+            )
+
 
 def get_current_quest(context: AgentContext) -> Optional["Quest"]:  # noqa: F821
     """Return current Quest, or None."""
@@ -295,6 +712,32 @@ def get_current_quest(context: AgentContext) -> Optional["Quest"]:  # noqa: F821
     return None
 
 
+def get_quest(quest_name: str, context: AgentContext) -> Optional[Quest]:
+    """Return the full Quest named `quest_name`, loading it from the quest archive if it has been archived."""
+    game_state = get_game_state(context)
+    for quest in game_state.quests or []:
+        if quest.name == quest_name:
+            return quest
+
+    kv = _key_value_store(context, _QUEST_ARCHIVE_KEY)
+    value = kv.get(quest_name)
+    return Quest.parse_obj(decode_value(value)) if value else None
+
+
+def archive_quests(game_state: GameState, context: AgentContext):
+    """Move every quest but the current one out of the game state and into the quest archive.
+
+    This keeps the game state -- which is loaded and saved on every request -- from growing with each quest played.
+    Only a QuestSummary of each archived quest is left behind in `game_state.archived_quests`.
+    """
+    archived = game_state.archive_quests()
+    if not archived:
+        return
+    kv = _key_value_store(context, _QUEST_ARCHIVE_KEY)
+    for quest in archived:
+        kv.set(quest.name, encode_value(quest.dict()))
+
+
 def get_current_conversant(
     context: AgentContext,
 ) -> Optional["NpcCharacter"]:  # noqa: F821
@@ -342,28 +785,237 @@ def switch_history_to_current_conversant(
     return context
 
 
+def _get_or_create_chat_history(
+    context_keys: Dict[str, str], context: AgentContext
+) -> ChatHistory:
+    if backend := get_local_backend(context):
+        return ChatHistory(backend.get_or_create_file(context_keys), None)
+    return ChatHistory.get_or_create(context.client, context_keys, [], searchable=False)
+
+
+def _quest_chat_history_keys(quest: Quest) -> Dict[str, str]:
+    return {"id": f"quest:{quest.name}"}
+
+
+def _copy_blocks_to_chat_history(
+    blocks: List[Block], chat_history: ChatHistory, excluded: bool = False
+):
+    """Append copies of `blocks` -- text, role and (non-chat) tags -- to `chat_history`.
+
+    With `excluded`, the copies are left out of the context of generations.
+    """
+    for block in blocks:
+        tags = [
+            Tag(kind=tag.kind, name=tag.name, value=tag.value)
+            for tag in block.tags or []
+            if tag.kind != TagKind.CHAT
+        ]
+        if excluded:
+            tags.append(excluded_tag())
+        chat_history.append_message_with_role(
+            text=block.text, role=block.chat_role or RoleTag.SYSTEM, tags=tags
+        )
+
+
+def _main_chat_history(context: AgentContext) -> ChatHistory:
+    return context.metadata.setdefault(_MAIN_CHAT_HISTORY_KEY, context.chat_history)
+
+
+def _chat_history_for_quest(
+    quest: Optional[Quest], context: AgentContext
+) -> ChatHistory:
+    main_history = _main_chat_history(context)
+    if quest and quest.chat_file_id and quest.chat_file_id != main_history.file.id:
+        if context.chat_history.file.id == quest.chat_file_id:
+            return context.chat_history
+        return _get_or_create_chat_history(_quest_chat_history_keys(quest), context)
+    return main_history
+
+
+def get_quest_chat_history(quest_name: str, context: AgentContext) -> ChatHistory:
+    """Return the chat history holding the story of the quest `quest_name`."""
+    return _chat_history_for_quest(get_quest(quest_name, context), context)
+
+
 def switch_history_to_current_quest(
     context: AgentContext,
 ) -> AgentContext:  # noqa: F821
-    """Return the NpcCharacter of the current conversation, or None."""
-    quest = get_current_quest(context)
+    """Point the context at the chat history of the current quest, or back at the game's main chat history.
 
-    if quest:
+    Quests started by `start_quest_chat_history` keep their story in a file of their own, so that filtering and
+    trimming the context of a generation only has to look at the current quest. Quests whose `chat_file_id` is the
+    main history's (those started before quests had their own files) stay in the main history.
+    """
+    history = _chat_history_for_quest(get_current_quest(context), context)
+    if context.chat_history is not history:
         logging.info(
-            f"Switching to Quest Chat History: {quest.name}",
+            f"Switching to Chat History: {history.file.id}",
             extra={
                 AgentLogging.IS_MESSAGE: True,
                 AgentLogging.MESSAGE_TYPE: AgentLogging.THOUGHT,
                 AgentLogging.MESSAGE_AUTHOR: AgentLogging.AGENT,
             },
         )
-        history = ChatHistory.get_or_create(
-            context.client, {"id": f"quest:{quest.name}"}, [], searchable=True
-        )
         context.chat_history = history
     return context
 
 
+def start_quest_chat_history(quest: Quest, context: AgentContext) -> ChatHistory:
+    """Create the chat history for a new quest, seeded with the context shared by all quests.
+
+    The onboarding instructions, the latest inventory and the summaries of prior quests are copied over from the main
+    chat history, so that the quest's generations find them in the quest's own file.
+    """
+    main_history = _main_chat_history(context)
+    main_blocks = main_history.file.blocks or []
+    index = ChatHistoryIndex.for_file(main_history.file)
+    onboarding = index.with_tag(
+        TagKindExtensions.INSTRUCTIONS, InstructionsTag.ONBOARDING
+    )
+    inventory = index.with_tag(TagKindExtensions.CHARACTER, CharacterTag.INVENTORY)
+    summaries = index.with_tag(TagKindExtensions.QUEST, QuestTag.QUEST_SUMMARY)
+    positions = set(summaries)
+    if onboarding:
+        positions.add(onboarding[-1])
+    if inventory:
+        positions.add(inventory[-1])
+
+    history = _get_or_create_chat_history(_quest_chat_history_keys(quest), context)
+    if not history.file.blocks:
+        _copy_blocks_to_chat_history(
+            [main_blocks[position] for position in sorted(positions)], history
+        )
+    quest.chat_file_id = history.file.id
+    _join_streamed_turn(history, context)
+    return history
+
+
+def end_quest_chat_history(shared_blocks: List[Block], context: AgentContext):
+    """Switch back to the main chat history after a quest, copying over the blocks later quests need to see (its
+    summary and the updated inventory) if the quest had a chat history of its own."""
+    on_quest_history = context.chat_history
+    switch_history_to_current_quest(context)
+    if context.chat_history is not on_quest_history:
+        _copy_blocks_to_chat_history(
+            [block for block in shared_blocks if block is not None],
+            context.chat_history,
+        )
+        _join_streamed_turn(context.chat_history, context)
+
+
+@contextmanager
+def streamed_turn(context: AgentContext):
+    """Copy what a turn tells in other chat histories to the one it starts in, which web clients stream, on exit.
+
+    USAGE:
+
+        with streamed_turn(context):
+            ...  # run the turn
+
+    A turn that starts a quest goes on in the quest's new chat history, and one that ends a quest in the main chat
+    history. The blocks appended to those after they join the turn (see `_join_streamed_turn`) are copied to the
+    streamed one for clients to see -- excluded from generations, which find them where they were told.
+    """
+    streamed_history = context.chat_history
+    context.metadata[_TURN_CHAT_HISTORIES_KEY] = {}
+    try:
+        yield context
+        live_histories = {
+            history.file.id: history
+            for history in [
+                context.metadata.get(_MAIN_CHAT_HISTORY_KEY),
+                context.chat_history,
+            ]
+            if history is not None
+        }
+        for file_id, (history, joined_after) in context.metadata[
+            _TURN_CHAT_HISTORIES_KEY
+        ].items():
+            if file_id == streamed_history.file.id:
+                continue
+            if file_id in live_histories:
+                history = live_histories[file_id]
+            else:
+                # No longer the context's, and possibly appended to through another ChatHistory: bring it up to date.
+                history.file.refresh()
+            _copy_blocks_to_chat_history(
+                chat_history_blocks_after(joined_after, context, history),
+                streamed_history,
+                excluded=True,
+            )
+    finally:
+        context.metadata.pop(_TURN_CHAT_HISTORIES_KEY, None)
+
+
+def _join_streamed_turn(chat_history: ChatHistory, context: AgentContext):
+    """Have `streamed_turn` copy whatever is appended to `chat_history` from now on, if a turn is being streamed."""
+    histories = context.metadata.get(_TURN_CHAT_HISTORIES_KEY)
+    if histories is None or chat_history.file.id in histories:
+        return
+    blocks = chat_history.file.blocks
+    histories[chat_history.file.id] = (
+        chat_history,
+        blocks[-1].index_in_file if blocks else -1,
+    )
+
+
+def merge_into_chat_history(blocks: List[Block], context: AgentContext):
+    """Bring the local copy of the chat history up to date with `blocks`, which are known to have been appended to
+    (or updated in) the chat history file server-side -- e.g. by a streaming generation.
+
+    This avoids re-fetching the entire file: a block that directly follows the last known one is appended, and a block
+    that is already known is replaced. Only if there is a gap -- meaning something else was appended in between --
+    does this fall back to a full refresh.
+    """
+    file = context.chat_history.file
+    for block in sorted(blocks, key=lambda b: b.index_in_file):
+        if block.file_id != file.id or block.index_in_file is None:
+            continue
+
+        last_index = file.blocks[-1].index_in_file if file.blocks else -1
+        if block.index_in_file == last_index + 1:
+            file.blocks.append(block)
+        elif block.index_in_file > last_index + 1:
+            file.refresh()
+            return
+        else:
+            for position in range(len(file.blocks) - 1, -1, -1):
+                if file.blocks[position].index_in_file == block.index_in_file:
+                    file.blocks[position] = block
+                    break
+                if file.blocks[position].index_in_file < block.index_in_file:
+                    break
+
+
+def chat_history_blocks_after(
+    index_in_file: int,
+    context: AgentContext,
+    chat_history: Optional[ChatHistory] = None,
+) -> List[Block]:
+    """Return the blocks of the local copy of the chat history (the context's, unless given) after `index_in_file`.
+
+    Scans back from the end, so the cost depends on the number of new blocks rather than the length of the history.
+    """
+    chat_history = chat_history or context.chat_history
+    new_blocks = []
+    for block in reversed(chat_history.file.blocks):
+        if block.index_in_file <= index_in_file:
+            break
+        new_blocks.append(block)
+    return list(reversed(new_blocks))
+
+
+def chat_histories_since(
+    last_history: Optional[ChatHistory], context: AgentContext
+) -> List[ChatHistory]:
+    """Return the chat histories that may have new blocks since `last_history` was the context's: that one too, if the
+    context has switched to another since (on starting or ending a quest), then the context's.
+    """
+    if last_history and last_history.file.id != context.chat_history.file.id:
+        return [last_history, context.chat_history]
+    return [context.chat_history]
+
+
 def get_function_capable_llm(
     context: AgentContext, default: Optional[ChatLLM] = None  # noqa: F821
 ) -> Optional[ChatLLM]:  # noqa: F821
@@ -10,34 +10,48 @@ While at the same time not committing to any huge abstraction overhead: this is
 functions whose mechanics can change under the hood as we discover better ways to do things, and the game developer
 doesn't need to know.
 """
-import json
 import logging
+import threading
 import time
-from typing import List, Optional, Tuple
+from collections import OrderedDict
+from typing import Callable, List, Optional, Tuple, TypeVar
 
-from steamship import Block, Tag
+from steamship import Block, SteamshipError, Tag, Task, TaskState
 from steamship.agents.schema import AgentContext
-from steamship.agents.schema.message_selectors import tokens
 from steamship.data import TagKind
-from steamship.data.block import StreamState
+from steamship.data.operations.generator import GenerateResponse
 from steamship.data.tags.tag_constants import ChatTag, RoleTag, TagValueKey
 
+from generators.cascading_plugin import MonitoredTask, report_finished
 from schema.characters import HumanCharacter
-from schema.quest import QuestDescription
+from schema.quest import Quest, QuestDescription
 from utils.ChatHistoryFilter import (
     ChatHistoryFilter,
     LastInventoryFilter,
     QuestNameFilter,
     TagFilter,
+    TokenCountCache,
     TrimmingStoryContextFilter,
     UnionFilter,
 )
 from utils.context_utils import (
+    cache_generation,
     emit,
+    generation_cache_key,
+    get_block,
+    get_cached_generation,
+    get_current_quest,
     get_game_state,
+    get_local_backend,
     get_server_settings,
+    get_story_prompt_budget,
     get_story_text_generator,
+    get_story_tokenizer,
+    merge_into_chat_history,
+    save_game_state,
 )
+from utils.stream_waiter import StreamWaiter
+from utils.structured_output import parse_json_list, parse_json_object
 from utils.tags import (
     AgentStatusMessageTag,
     CharacterTag,
@@ -49,6 +63,8 @@ from utils.tags import (
     TagKindExtensions,
 )
 
+T = TypeVar("T")
+
 
 def send_agent_status_message(
     name: AgentStatusMessageTag, context: AgentContext, value: Optional[dict] = None
@@ -65,9 +81,13 @@ def send_agent_status_message(
 
 
 def send_story_generation(
-    prompt: str, quest_name: str, context: AgentContext
+    prompt: str, quest_name: str, context: AgentContext, paragraphs: int = 1
 ) -> Optional[Block]:
-    """Generates and sends a background image to the player."""
+    """Generates and sends a background image to the player.
+
+    A single paragraph stops at the first line break. Ask for more in the prompt to have them streamed in one block,
+    one per line, and `split_paragraphs` them once it is complete.
+    """
     block = do_token_trimmed_generation(
         context,
         prompt,
@@ -98,16 +118,29 @@ def send_story_generation(
             ]
         ),
         generation_for="Quest Content",
-        stop_tokens=["\n"],
+        stop_tokens=["\n"] if paragraphs == 1 else None,
     )
     return block
 
 
+def split_paragraphs(text: Optional[str]) -> List[str]:
+    """Split the text of a multi-paragraph story generation into its paragraphs."""
+    return [line.strip() for line in (text or "").splitlines() if line.strip()]
+
+
 def generate_likelihood_estimation(
     prompt: str, quest_name: str, context: AgentContext
 ) -> Optional[Block]:
     """Generates a likelihood calculation of success for an event."""
-    block = do_token_trimmed_generation(
+    task = start_likelihood_estimation(prompt, quest_name, context)
+    return finish_generation(task, context)
+
+
+def start_likelihood_estimation(
+    prompt: str, quest_name: str, context: AgentContext
+) -> Task[GenerateResponse]:
+    """Start `generate_likelihood_estimation`, returning its task instead of waiting for it."""
+    return start_token_trimmed_generation(
         context,
         prompt,
         prompt_tags=[
@@ -136,6 +169,43 @@ def generate_likelihood_estimation(
         stop_tokens=["\n"],
         new_file=True,
         streaming=False,
+        cache=True,
+    )
+
+
+def generate_action_judgment(
+    prompt: str, quest_name: str, context: AgentContext
+) -> Optional[Block]:
+    """Decides, in one generation, whether input is an attempt to solve the problem and how likely it is to succeed."""
+    block = do_token_trimmed_generation(
+        context,
+        prompt,
+        prompt_tags=[
+            Tag(kind=TagKindExtensions.QUEST, name=QuestTag.ACTION_JUDGMENT),
+            QuestIdTag(quest_name),
+        ],
+        output_tags=[],
+        filter=UnionFilter(
+            [
+                TagFilter(
+                    tag_types=[
+                        (TagKindExtensions.CHARACTER, CharacterTag.NAME),
+                        (TagKindExtensions.CHARACTER, CharacterTag.MOTIVATION),
+                        (TagKindExtensions.CHARACTER, CharacterTag.DESCRIPTION),
+                        (TagKindExtensions.CHARACTER, CharacterTag.BACKGROUND),
+                        (TagKindExtensions.STORY_CONTEXT, StoryContextTag.TONE),
+                        (TagKindExtensions.STORY_CONTEXT, StoryContextTag.BACKGROUND),
+                        (TagKindExtensions.QUEST, QuestTag.QUEST_SUMMARY),
+                    ]
+                ),
+                QuestNameFilter(quest_name=quest_name),
+                LastInventoryFilter(),
+            ]
+        ),
+        generation_for="Action judgment",
+        new_file=True,
+        streaming=False,
+        cache=True,
     )
     return block
 
@@ -144,7 +214,15 @@ def generate_is_solution_attempt(
     prompt: str, quest_name: str, context: AgentContext
 ) -> Optional[Block]:
     """Decides whether input is an attempt to solve the problem."""
-    block = do_token_trimmed_generation(
+    task = start_is_solution_attempt(prompt, quest_name, context)
+    return finish_generation(task, context)
+
+
+def start_is_solution_attempt(
+    prompt: str, quest_name: str, context: AgentContext
+) -> Task[GenerateResponse]:
+    """Start `generate_is_solution_attempt`, returning its task instead of waiting for it."""
+    return start_token_trimmed_generation(
         context,
         prompt,
         prompt_tags=[
@@ -173,8 +251,8 @@ def generate_is_solution_attempt(
         stop_tokens=["\n"],
         new_file=True,
         streaming=False,
+        cache=True,
     )
-    return block
 
 
 def generate_quest_summary(
@@ -235,12 +313,53 @@ def generate_quest_item(
         streaming=False,
     )
 
-    json_block_text = block.text
-    tidy_json = json_block_text.replace("```json", "").replace("```", "")
-    item_json = json.loads(tidy_json.strip())
+    item_json = parse_or_fix_up(
+        block.text,
+        parse=lambda text: parse_json_object(
+            text, required_keys=["name", "description", "visualDescription"]
+        ),
+        expected="a JSON object with the string fields 'name', 'description' and 'visualDescription'",
+        context=context,
+    )
     return item_json["name"], item_json["description"], item_json["visualDescription"]
 
 
+def parse_or_fix_up(
+    text: str,
+    parse: Callable[[str], Optional[T]],
+    expected: str,
+    context: AgentContext,
+) -> T:
+    """Parse the output of a generation with `parse`, asking the model to fix it once if that fails.
+
+    The fix-up prompt holds only the output and what was `expected` of it, rather than the context of the original
+    generation, so it is much shorter (and quicker) than generating again.
+    """
+    value = parse(text)
+    if value is not None:
+        return value
+
+    logging.warning(f"Asking to fix up output that isn't {expected}: {text}")
+    prompt = (
+        f"The following text should be {expected}, but isn't:\n{text}\n"
+        f"Correct it. Return ONLY the corrected JSON."
+    )
+    block = do_generation(
+        context,
+        prompt,
+        prompt_tags=[Tag(kind=TagKindExtensions.QUEST, name=QuestTag.FIX_UP_PROMPT)],
+        output_tags=[],
+        filter=TagFilter([]),  # Only the prompt itself
+        generation_for="Fix-up",
+        new_file=True,
+        streaming=False,
+    )
+    value = parse(block.text)
+    if value is None:
+        raise SteamshipError(f"The generation should be {expected}, but was: {text}")
+    return value
+
+
 def generate_merchant_inventory(
     player: HumanCharacter, context: AgentContext
 ) -> List[Tuple[str, str]]:
@@ -315,14 +434,29 @@ def generate_quest_arc(
         f"QUEST GOAL: win an award QUEST LOCATION: Westminister Dog Show\n"
     )
     result: List[QuestDescription] = []
-    while len(result) != server_settings.quests_per_arc:
+    for _ in range(server_settings.quest_arc_attempts):
+        missing = server_settings.quests_per_arc - len(result)
+        prompt_tag = QuestArcTag.PROMPT
+        if result:
+            # Keep the quests so far, and only ask for the rest.
+            listed_quests = "\n".join(
+                f"QUEST GOAL: {quest.goal} QUEST LOCATION: {quest.location}"
+                for quest in result
+            )
+            prompt = (
+                f"So far, the quests that {player.name} will go on are:\n{listed_quests}\n"
+                f"Please list {missing} more quests of increasing difficulty that follow these, to achieve their "
+                f"overall goal of {server_settings.adventure_goal}. DO NOT repeat the quests so far. Responses should "
+                f"only be in the form of: QUEST GOAL: <goal> QUEST LOCATION: <location name>\n"
+            )
+            prompt_tag = QuestArcTag.TOP_UP_PROMPT
         block = do_generation(
             context,
             prompt,
             prompt_tags=[
                 Tag(
                     kind=TagKindExtensions.QUEST_ARC,
-                    name=QuestArcTag.PROMPT,
+                    name=prompt_tag,
                 )
             ],
             output_tags=[
@@ -341,17 +475,34 @@ def generate_quest_arc(
             generation_for="Quest Arc",
             streaming=False,
         )
-        result = []
-        items = block.text.split("QUEST GOAL:")
-        for item in items:
-            if len(item.strip()) > 0 and "QUEST LOCATION" in item:
-                parts = item.split("QUEST LOCATION:")
-                if len(parts) == 2:
-                    goal = parts[0].strip()
-                    location = parts[1].strip().rstrip(".")
-                    if "\n" in location:
-                        location = location[: location.index("\n")]
-                    result.append(QuestDescription(goal=goal, location=location))
+        result.extend(parse_quest_arc(block.text)[:missing])
+        if len(result) == server_settings.quests_per_arc:
+            return result
+
+    if not result:
+        raise SteamshipError(
+            f"Unable to generate a quest arc in {server_settings.quest_arc_attempts} attempts."
+        )
+    logging.warning(
+        f"Generated only {len(result)} of {server_settings.quests_per_arc} quests for the arc in "
+        f"{server_settings.quest_arc_attempts} attempts."
+    )
+    return result
+
+
+def parse_quest_arc(text: Optional[str]) -> List[QuestDescription]:
+    """Parse the quests listed in a quest arc generation, skipping any that aren't in the requested form."""
+    result = []
+    items = (text or "").split("QUEST GOAL:")
+    for item in items:
+        if len(item.strip()) > 0 and "QUEST LOCATION" in item:
+            parts = item.split("QUEST LOCATION:")
+            if len(parts) == 2:
+                goal = parts[0].strip()
+                location = parts[1].strip().rstrip(".")
+                if "\n" in location:
+                    location = location[: location.index("\n")]
+                result.append(QuestDescription(goal=goal, location=location))
     return result
 
 
@@ -397,29 +548,138 @@ def do_token_trimmed_generation(
     stop_tokens: Optional[List[str]] = None,
     new_file: bool = False,
     streaming: bool = True,
+    cache: bool = False,
 ) -> Block:
-    game_state = get_game_state(context=context)
-    server_settings = get_server_settings(context)
-    avail_tokens = 4096 - server_settings.default_story_max_tokens
-    avail_tokens -= tokens(Block(text=prompt))
+    task = start_token_trimmed_generation(
+        context,
+        prompt,
+        prompt_tags=prompt_tags,
+        output_tags=output_tags,
+        filter=filter,
+        generation_for=generation_for,
+        stop_tokens=stop_tokens,
+        new_file=new_file,
+        streaming=streaming,
+        cache=cache,
+    )
+    return finish_generation(task, context)
 
-    block = do_generation(
+
+def start_token_trimmed_generation(
+    context: AgentContext,
+    prompt: str,
+    prompt_tags: List[Tag],
+    output_tags: List[Tag],
+    filter: ChatHistoryFilter,
+    generation_for: str,  # For debugging output
+    stop_tokens: Optional[List[str]] = None,
+    new_file: bool = False,
+    streaming: bool = True,
+    cache: bool = False,
+) -> Task[GenerateResponse]:
+    """Start a generation like `do_token_trimmed_generation`, returning its task instead of waiting for it."""
+    game_state = get_game_state(context=context)
+    tokenizer = get_story_tokenizer(context)
+    avail_tokens = get_story_prompt_budget(context) - tokenizer.count(prompt)
+
+    quest = get_current_quest(context)
+    if quest:
+        collect_rolling_summary(quest, context)
+
+    trimming_filter = TrimmingStoryContextFilter(
+        base_filter=filter,
+        current_quest_id=game_state.current_quest,
+        game_state=game_state,
+        max_tokens=avail_tokens,
+        tokenizer=tokenizer,
+    )
+    task = start_generation(
         context,
         prompt,
         prompt_tags=prompt_tags,
         output_tags=output_tags,
-        filter=TrimmingStoryContextFilter(
-            base_filter=filter,
-            current_quest_id=game_state.current_quest,
-            game_state=game_state,
-            max_tokens=avail_tokens,
-        ),
+        filter=trimming_filter,
         generation_for=generation_for,
         stop_tokens=stop_tokens,
         new_file=new_file,
         streaming=streaming,
+        cache=cache,
+    )
+
+    if quest:
+        compact_quest_history(quest, trimming_filter, context)
+    return task
+
+
+def compact_quest_history(
+    quest: Quest, trimming_filter: TrimmingStoryContextFilter, context: AgentContext
+):
+    """Start summarizing the turns of `quest` that have fallen out of the trimmed context, once there are enough.
+
+    The summary is generated in the background, folding in the previous rolling summary, and picked up by
+    `collect_rolling_summary` on a later generation. From then on, it stands in for the turns it covers.
+    """
+    server_settings = get_server_settings(context)
+    threshold = server_settings.rolling_summary_threshold
+    blocks = trimming_filter.uncompacted_blocks
+    if not threshold or not blocks or quest.rolling_summary_task_id:
+        return
+    tokenizer = get_story_tokenizer(context)
+    if sum(TokenCountCache.count(block, tokenizer) for block in blocks) < threshold:
+        return
+
+    # Built as a one-off prompt, so the instruction to summarize never lands in the chat history.
+    story = [block.text for block in blocks]
+    if trimming_filter.rolling_summary is not None:
+        story.insert(0, trimming_filter.rolling_summary.text)
+    prompt = (
+        "\n\n".join(story)
+        + "\n\nSummarize the story above in one paragraph, keeping track of the characters, items and places "
+        "involved and of anything left unresolved."
     )
-    return block
+
+    generator = get_story_text_generator(context)
+    task = generator.generate(text=prompt, streaming=False, append_output_to_file=False)
+    quest.rolling_summary_task_id = task.task_id
+    # The blocks run, unbroken, up to the oldest message left in the context.
+    quest.rolling_summary_through = blocks[-1].index_in_file
+    save_game_state(get_game_state(context), context)
+
+
+def collect_rolling_summary(quest: Quest, context: AgentContext):
+    """Add the rolling summary started by `compact_quest_history` to the chat history, if it has finished."""
+    if not quest.rolling_summary_task_id:
+        return
+
+    task = Task(
+        client=context.client,
+        task_id=quest.rolling_summary_task_id,
+        expect=GenerateResponse,
+    )
+    try:
+        task.refresh()
+        report_finished(task)
+    except SteamshipError as e:
+        logging.warning(f"Unable to check on the rolling summary of {quest.name}: {e}")
+        task.state = TaskState.failed
+
+    if task.state in [TaskState.waiting, TaskState.running]:
+        return
+    if task.state == TaskState.succeeded and task.output and task.output.blocks:
+        context.chat_history.append_system_message(
+            text=task.output.blocks[0].text,
+            tags=[
+                Tag(
+                    kind=TagKindExtensions.QUEST,
+                    name=QuestTag.ROLLING_SUMMARY,
+                    value={TagValueKey.NUMBER_VALUE: quest.rolling_summary_through},
+                ),
+                QuestIdTag(quest.name),
+            ],
+        )
+    quest.rolling_summary_task_id = None
+    quest.rolling_summary_through = None
+    save_game_state(get_game_state(context), context)
 
 
 def do_generation(
@@ -434,7 +694,39 @@ def do_generation(
     streaming: bool = True,
 ) -> Block:
     """Generates the inventory for a merchant"""
+    task = start_generation(
+        context,
+        prompt,
+        prompt_tags=prompt_tags,
+        output_tags=output_tags,
+        filter=filter,
+        generation_for=generation_for,
+        stop_tokens=stop_tokens,
+        new_file=new_file,
+        streaming=streaming,
+    )
+    return finish_generation(task, context)
+
 
+def start_generation(
+    context: AgentContext,
+    prompt: str,
+    prompt_tags: List[Tag],
+    output_tags: List[Tag],
+    filter: ChatHistoryFilter,
+    generation_for: str,  # For debugging output
+    stop_tokens: Optional[List[str]] = None,
+    new_file: bool = False,
+    streaming: bool = True,
+    cache: bool = False,
+) -> Task[GenerateResponse]:
+    """Start a generation like `do_generation`, returning its task instead of waiting for it.
+
+    Generations started one after the other run concurrently; `finish_generation` waits for each.
+
+    With `cache`, the text generated is reused for the same prompt and context blocks for a while (see
+    `context_utils.get_cached_generation`): only use it for classifications, not for story.
+    """
     generator = get_story_text_generator(context)
 
     output_tags.extend(
@@ -466,14 +758,38 @@ def do_generation(
     if stop_tokens:
         options["stop"] = stop_tokens
 
+    cache_key = None
+    if cache:
+        blocks_by_index = {
+            block.index_in_file: block for block in context.chat_history.file.blocks
+        }
+        cache_key = generation_cache_key(
+            context,
+            prompt,
+            [
+                blocks_by_index[index]
+                for index in sorted(block_indices)
+                if index != prompt_block.index_in_file and index in blocks_by_index
+            ],
+            options,
+        )
+        if (text := get_cached_generation(context, cache_key)) is not None:
+            logging.debug(f"Reusing the cached generation for {generation_for}")
+            return Task[GenerateResponse](
+                state=TaskState.succeeded,
+                output=GenerateResponse(blocks=[Block(text=text, tags=output_tags)]),
+            )
+
     output_file_id = None if new_file else context.chat_history.file.id
 
     # don't pollute workspace with temporary/working files that contain data like: "LIKELY"
     append_output_to_file = False if not output_file_id else True
 
-    logging.debug(
-        f"current prompt({prompt_block.index_in_file}, {tokens(prompt_block)}): {prompt}"
-    )
+    if logging.getLogger().isEnabledFor(logging.DEBUG):
+        prompt_tokens = get_story_tokenizer(context).count(prompt)
+        logging.debug(
+            f"current prompt({prompt_block.index_in_file}, {prompt_tokens}): {prompt}"
+        )
     logging.debug(f"selected blocks: {sorted(block_indices)}")
 
     task = generator.generate(
@@ -485,25 +801,122 @@ def do_generation(
         input_file_block_index_list=sorted(block_indices),
         options=options,
     )
+    # Store the token counts taken while selecting the context while the generation runs.
+    TokenCountCache.flush(get_local_backend(context))
+    if cache_key:
+        _remember_cache_key(task.task_id, cache_key)
+    return task
+
+
+# The generation cache keys of generations started with `cache`, by task ID, oldest first, for `finish_generation` to
+# cache their output under. Stored as (expiry time, key): generations never finished in this process -- discarded, timed
+# out, or waited on by another one -- are forgotten after a while.
+_pending_cache_keys: "OrderedDict[str, Tuple[float, str]]" = OrderedDict()
+_pending_cache_keys_lock = threading.Lock()
+_MAX_PENDING_CACHE_KEYS = 1024
+_PENDING_CACHE_KEY_SECONDS = 600
+
+
+def _remember_cache_key(task_id: str, cache_key: str):
+    now = time.time()
+    with _pending_cache_keys_lock:
+        while _pending_cache_keys and next(iter(_pending_cache_keys.values()))[0] < now:
+            _pending_cache_keys.popitem(last=False)
+        _pending_cache_keys[task_id] = (now + _PENDING_CACHE_KEY_SECONDS, cache_key)
+        while len(_pending_cache_keys) > _MAX_PENDING_CACHE_KEYS:
+            _pending_cache_keys.popitem(last=False)
+
+
+def _take_cache_key(task_id: str) -> Optional[str]:
+    with _pending_cache_keys_lock:
+        expires, cache_key = _pending_cache_keys.pop(task_id, (0, None))
+    return cache_key if expires >= time.time() else None
+
+
+def finish_generation(task: Task[GenerateResponse], context: AgentContext) -> Block:
+    """Wait for a generation started by `start_generation`, and emit its output."""
     task.wait()
     blocks = task.output.blocks
     block = blocks[0]
     # only re-fetch block if it is not ephemeral...
     if block.client and block.id:
-        block = Block.get(block.client, _id=block.id)
+        block = get_block(block.id, context)
+    if cache_key := _take_cache_key(task.task_id):
+        cache_generation(context, cache_key, block.text)
     emit(output=block, context=context)  # todo: should emit be optional ?
     return block
 
 
+def discard_generation(task: Task[GenerateResponse]):
+    """Forget a generation started by `start_generation` whose output won't be waited for."""
+    _take_cache_key(task.task_id)
+
+
 def await_streamed_block(block: Block, context: AgentContext) -> Block:
-    while block.stream_state not in [StreamState.COMPLETE, StreamState.ABORTED]:
-        time.sleep(0.4)
-        block = Block.get(block.client, _id=block.id)
-    context.chat_history.file.refresh()
+    block = StreamWaiter(fetch=lambda b: get_block(b.id, context)).wait(block)
+    merge_into_chat_history([block], context)
     return block
 
 
 def generate_action_choices(context: AgentContext) -> Block:
+    task = start_action_choices(context)
+    return finish_generation(task, context)
+
+
+def prefetch_action_choices(quest: Quest, context: AgentContext):
+    """Start generating action choices for the current problem of `quest` in the background, for `get_action_choices`.
+
+    They are discarded when the player next acts (see `Quest.add_user_solution`).
+    """
+    task = start_action_choices(context)
+    if isinstance(task, MonitoredTask):
+        # It's only waited on once the player asks for help, if ever.
+        task.ignore_latency()
+    quest.action_choices_task_id = task.task_id
+    save_game_state(get_game_state(context), context)
+
+
+# How long to wait for prefetched action choices that are still being generated, before generating new ones.
+_PREFETCHED_ACTION_CHOICES_WAIT_SECONDS = 5
+
+
+def get_action_choices(context: AgentContext) -> List[str]:
+    """Return action choices for the current problem: the prefetched ones if there are any, otherwise new ones."""
+    quest = get_current_quest(context)
+    if quest and quest.action_choices_task_id:
+        task = Task(
+            client=context.client,
+            task_id=quest.action_choices_task_id,
+            expect=GenerateResponse,
+        )
+        try:
+            task.refresh()
+            # Rather than waiting out a stuck prefetch, generate them again.
+            task.wait(
+                max_timeout_s=_PREFETCHED_ACTION_CHOICES_WAIT_SECONDS,
+                retry_delay_s=0.2,
+            )
+            report_finished(task)
+            if task.state == TaskState.succeeded:
+                return parse_action_choices(task.output.blocks[0].text, context)
+            logging.warning(f"Prefetching action choices failed: {task.status_message}")
+        except (SteamshipError, ValueError, IndexError) as e:
+            logging.warning(f"Unable to use the prefetched action choices: {e}")
+
+    return parse_action_choices(generate_action_choices(context).text, context)
+
+
+def parse_action_choices(text: str, context: AgentContext) -> List[str]:
+    return parse_or_fix_up(
+        text,
+        parse=parse_json_list,
+        expected="a JSON list of strings",
+        context=context,
+    )
+
+
+def start_action_choices(context: AgentContext) -> Task[GenerateResponse]:
+    """Start `generate_action_choices`, returning its task instead of waiting for it."""
     game_state = get_game_state(context)
     quest_name = game_state.current_quest
 
@@ -516,7 +929,7 @@ def generate_action_choices(context: AgentContext) -> Block:
         f'Example: ["pet the dog", "launch missiles", "dance the Macarena"]'
     )
 
-    block = do_token_trimmed_generation(
+    return start_token_trimmed_generation(
         context,
         prompt,
         prompt_tags=[
@@ -549,4 +962,3 @@ def generate_action_choices(context: AgentContext) -> Block:
         new_file=True,  # don't put this in the chat history. it is help content.
         streaming=False,
     )
-    return block
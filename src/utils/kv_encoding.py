@@ -0,0 +1,88 @@
+"""Compact encoding for the documents the game persists in the KeyValueStore.
+
+The KeyValueStore only holds JSON-able dicts, so an encoded value is still a dict. Large values are encoded as:
+
+- **interned**: every dict key is replaced by a short index into a table of the distinct keys. Game documents repeat
+  the same field names over and over (one set per quest, per challenge, per item, ...).
+- **compressed**: additionally, the interned form is zlib-compressed and base64-encoded, if that makes it smaller.
+  This mostly pays off for the long prompt strings in the server settings.
+
+Values without the `ENCODING_FIELD` marker -- small values, and everything written before this encoding existed --
+are plain JSON and decode to themselves, so existing documents are upgraded transparently the next time they're saved.
+"""
+import base64
+import json
+import zlib
+from typing import Any, Dict, List
+
+ENCODING_FIELD = "__encoding__"
+INTERNED = "interned/1"
+COMPRESSED = "interned+zlib/1"
+
+# Values whose JSON form is smaller than this are stored as-is: there isn't enough to gain.
+_MIN_ENCODED_SIZE = 512
+
+
+def _to_base36(i: int) -> str:
+    digits = "0123456789abcdefghijklmnopqrstuvwxyz"
+    result = ""
+    while True:
+        i, remainder = divmod(i, 36)
+        result = digits[remainder] + result
+        if i == 0:
+            return result
+
+
+def _intern(value: Any, keys: List[str], index: Dict[str, str]) -> Any:
+    if isinstance(value, dict):
+        interned = {}
+        for key, item in value.items():
+            if key not in index:
+                index[key] = _to_base36(len(keys))
+                keys.append(key)
+            interned[index[key]] = _intern(item, keys, index)
+        return interned
+    if isinstance(value, list):
+        return [_intern(item, keys, index) for item in value]
+    return value
+
+
+def _unintern(value: Any, keys: List[str]) -> Any:
+    if isinstance(value, dict):
+        return {
+            keys[int(key, 36)]: _unintern(item, keys) for key, item in value.items()
+        }
+    if isinstance(value, list):
+        return [_unintern(item, keys) for item in value]
+    return value
+
+
+def encode_value(value: dict, compress: bool = True) -> dict:
+    """Encode `value` for storage in the KeyValueStore."""
+    serialized = json.dumps(value, separators=(",", ":"))
+    if len(serialized) < _MIN_ENCODED_SIZE:
+        return value
+
+    keys = []
+    interned = _intern(value, keys, {})
+    if compress:
+        payload = json.dumps([keys, interned], separators=(",", ":")).encode("utf-8")
+        data = base64.b64encode(zlib.compress(payload)).decode("ascii")
+        if len(data) < len(payload):
+            return {ENCODING_FIELD: COMPRESSED, "data": data}
+    return {ENCODING_FIELD: INTERNED, "keys": keys, "value": interned}
+
+
+def decode_value(value: dict) -> dict:
+    """Decode a value read from the KeyValueStore, whether or not it was written by `encode_value`."""
+    if not isinstance(value, dict) or ENCODING_FIELD not in value:
+        return value
+
+    encoding = value[ENCODING_FIELD]
+    if encoding == INTERNED:
+        return _unintern(value["value"], value["keys"])
+    if encoding == COMPRESSED:
+        payload = zlib.decompress(base64.b64decode(value["data"]))
+        keys, interned = json.loads(payload)
+        return _unintern(interned, keys)
+    raise ValueError(f"Unknown KeyValueStore value encoding: {encoding}")
@@ -0,0 +1,289 @@
+"""A local, SQLite-backed stand-in for the Steamship storage the game uses.
+
+The game keeps all of its state in a Steamship workspace: KeyValueStores for the game state and server settings, and a
+ChatHistory File whose Blocks and Tags hold the story. This module implements the same surface over a single SQLite
+database, so that the game logic can be run -- and profiled -- without a network connection:
+
+- `LocalKeyValueStore` mirrors `steamship.utils.kv_store.KeyValueStore`
+- `LocalFile` mirrors the parts of `steamship.File` that `ChatHistory` relies on, so that the real `ChatHistory` (and
+  with it `append_*_message`) runs unmodified on top of it
+- `LocalBackend.get_block` and `LocalBackend.create_tag` mirror `Block.get` and `Tag.create`
+
+USAGE:
+
+    service = AdventureGameService(client=client, config=config, local_backend=LocalBackend("game.db"))
+
+Only storage is local: generation still goes through the plugins in the context (see `context_utils`).
+"""
+import json
+import sqlite3
+import threading
+import uuid
+from typing import Any, Dict, List, Optional, Tuple
+
+from steamship import Block, MimeTypes, Steamship, Tag
+from steamship.agents.logging import StreamingOpts
+from steamship.agents.schema import AgentContext, ChatHistory
+from steamship.data import TagKind
+from steamship.data.tags.tag_constants import ChatTag
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS kv (store TEXT, key TEXT, value TEXT, PRIMARY KEY (store, key));
+CREATE TABLE IF NOT EXISTS files (id TEXT PRIMARY KEY, context_keys TEXT UNIQUE, tags TEXT);
+CREATE TABLE IF NOT EXISTS blocks (
+    id TEXT PRIMARY KEY,
+    file_id TEXT,
+    index_in_file INTEGER,
+    text TEXT,
+    mime_type TEXT,
+    url TEXT,
+    tags TEXT
+);
+CREATE INDEX IF NOT EXISTS blocks_by_file ON blocks (file_id, index_in_file);
+"""
+
+
+class LocalBackend:
+    """A SQLite database holding every KeyValueStore, File, Block and Tag of one local game."""
+
+    path: str
+
+    def __init__(self, path: str = ":memory:"):
+        self.path = path
+        self._lock = threading.RLock()
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.executescript(_SCHEMA)
+
+    def _execute(self, sql: str, parameters: Tuple = ()) -> List[Tuple]:
+        with self._lock, self._connection:
+            return self._connection.execute(sql, parameters).fetchall()
+
+    def key_value_store(self, store_identifier: str) -> "LocalKeyValueStore":
+        return LocalKeyValueStore(self, store_identifier)
+
+    def get_or_create_file(self, context_keys: Dict[str, str]) -> "LocalFile":
+        keys = json.dumps(context_keys, sort_keys=True)
+        with self._lock:
+            rows = self._execute("SELECT id FROM files WHERE context_keys = ?", (keys,))
+            if rows:
+                file_id = rows[0][0]
+            else:
+                file_id = str(uuid.uuid4())
+                tags = [
+                    Tag(
+                        kind=TagKind.CHAT, name=ChatTag.CONTEXT_KEYS, value=context_keys
+                    )
+                ]
+                self._execute(
+                    "INSERT INTO files (id, context_keys, tags) VALUES (?, ?, ?)",
+                    (file_id, keys, json.dumps([tag.dict() for tag in tags])),
+                )
+        return LocalFile(self, file_id).refresh()
+
+    def get_or_create_context(
+        self,
+        client: Steamship,
+        context_keys: Dict[str, str],
+        streaming_opts: Optional[StreamingOpts] = None,
+        initial_system_message: Optional[str] = None,
+    ) -> AgentContext:
+        """The local equivalent of `AgentContext.get_or_create`, without LLM or action caches."""
+        context = AgentContext(streaming_opts=streaming_opts)
+        context.chat_history = ChatHistory(self.get_or_create_file(context_keys), None)
+        context.client = client
+        context.llm_cache = None
+        context.action_cache = None
+
+        if initial_system_message and not context.chat_history.last_system_message:
+            context.chat_history.append_system_message(text=initial_system_message)
+        return context
+
+    def append_block(
+        self,
+        file_id: str,
+        text: Optional[str] = None,
+        tags: Optional[List[Tag]] = None,
+        url: Optional[str] = None,
+        mime_type: Optional[MimeTypes] = None,
+    ) -> Block:
+        block_id = str(uuid.uuid4())
+        tags = [
+            Tag(
+                kind=tag.kind,
+                name=tag.name,
+                value=tag.value,
+                file_id=file_id,
+                block_id=block_id,
+                id=str(uuid.uuid4()),
+            )
+            for tag in tags or []
+        ]
+        with self._lock:
+            index_in_file = self._execute(
+                "SELECT COUNT(*) FROM blocks WHERE file_id = ?", (file_id,)
+            )[0][0]
+            self._execute(
+                "INSERT INTO blocks (id, file_id, index_in_file, text, mime_type, url, tags) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (
+                    block_id,
+                    file_id,
+                    index_in_file,
+                    text,
+                    mime_type,
+                    url,
+                    json.dumps([tag.dict() for tag in tags]),
+                ),
+            )
+        return Block(
+            id=block_id,
+            file_id=file_id,
+            index=index_in_file,
+            text=text,
+            mime_type=mime_type,
+            url=url,
+            tags=tags,
+        )
+
+    def get_block(self, block_id: str) -> Optional[Block]:
+        """The local equivalent of `Block.get`."""
+        rows = self._execute(
+            "SELECT id, file_id, index_in_file, text, mime_type, url, tags FROM blocks WHERE id = ?",
+            (block_id,),
+        )
+        return _block_from_row(rows[0]) if rows else None
+
+    def get_blocks(self, file_id: str) -> List[Block]:
+        rows = self._execute(
+            "SELECT id, file_id, index_in_file, text, mime_type, url, tags FROM blocks "
+            "WHERE file_id = ? ORDER BY index_in_file",
+            (file_id,),
+        )
+        return [_block_from_row(row) for row in rows]
+
+    def create_tag(
+        self,
+        block: Block,
+        kind: str,
+        name: Optional[str] = None,
+        value: Optional[Dict[str, Any]] = None,
+    ) -> Tag:
+        """The local equivalent of `Tag.create` on a Block."""
+        tag = Tag(
+            id=str(uuid.uuid4()),
+            file_id=block.file_id,
+            block_id=block.id,
+            kind=kind,
+            name=name,
+            value=value,
+        )
+        with self._lock:
+            rows = self._execute("SELECT tags FROM blocks WHERE id = ?", (block.id,))
+            if rows:
+                tags = [*json.loads(rows[0][0]), tag.dict()]
+                self._execute(
+                    "UPDATE blocks SET tags = ? WHERE id = ?",
+                    (json.dumps(tags), block.id),
+                )
+        return tag
+
+
+def _block_from_row(row: Tuple) -> Block:
+    block_id, file_id, index_in_file, text, mime_type, url, tags = row
+    return Block(
+        id=block_id,
+        file_id=file_id,
+        index=index_in_file,
+        text=text,
+        mime_type=mime_type,
+        url=url,
+        tags=[Tag.parse_obj(tag) for tag in json.loads(tags)],
+    )
+
+
+class LocalKeyValueStore:
+    """A KeyValueStore whose values live in a LocalBackend."""
+
+    def __init__(self, backend: LocalBackend, store_identifier: str = "KeyValueStore"):
+        self.backend = backend
+        self.store_identifier = store_identifier
+
+    def get(self, key: str) -> Optional[Dict]:
+        rows = self.backend._execute(
+            "SELECT value FROM kv WHERE store = ? AND key = ?",
+            (self.store_identifier, key),
+        )
+        return json.loads(rows[0][0]) if rows else None
+
+    def delete(self, key: str) -> bool:
+        with self.backend._lock:
+            existed = self.get(key) is not None
+            self.backend._execute(
+                "DELETE FROM kv WHERE store = ? AND key = ?",
+                (self.store_identifier, key),
+            )
+        return existed
+
+    def set(self, key: str, value: Dict[str, Any]):
+        self.backend._execute(
+            "INSERT OR REPLACE INTO kv (store, key, value) VALUES (?, ?, ?)",
+            (self.store_identifier, key, json.dumps(value)),
+        )
+
+    def items(
+        self, filter_keys: Optional[List[str]] = None
+    ) -> List[Tuple[str, Dict[str, Any]]]:
+        rows = self.backend._execute(
+            "SELECT key, value FROM kv WHERE store = ?", (self.store_identifier,)
+        )
+        return [
+            (key, json.loads(value))
+            for key, value in rows
+            if filter_keys is None or key in filter_keys
+        ]
+
+    def reset(self):
+        self.backend._execute(
+            "DELETE FROM kv WHERE store = ?", (self.store_identifier,)
+        )
+
+
+class LocalFile:
+    """A File whose Blocks live in a LocalBackend.
+
+    Implements what `ChatHistory` uses of a File, so that a `ChatHistory` can be built on top of it.
+    """
+
+    client: Optional[Steamship] = None
+    id: str
+    tags: List[Tag]
+    blocks: List[Block]
+
+    def __init__(self, backend: LocalBackend, file_id: str):
+        self.backend = backend
+        self.id = file_id
+        self.tags = []
+        self.blocks = []
+
+    def refresh(self) -> "LocalFile":
+        rows = self.backend._execute("SELECT tags FROM files WHERE id = ?", (self.id,))
+        self.tags = (
+            [Tag.parse_obj(tag) for tag in json.loads(rows[0][0])] if rows else []
+        )
+        self.blocks = self.backend.get_blocks(self.id)
+        return self
+
+    def append_block(
+        self,
+        text: str = None,
+        tags: List[Tag] = None,
+        content: Any = None,
+        url: Optional[str] = None,
+        mime_type: Optional[MimeTypes] = None,
+        public_data: bool = False,
+    ) -> Block:
+        block = self.backend.append_block(
+            self.id, text=text, tags=tags, url=url, mime_type=mime_type
+        )
+        self.blocks.append(block)
+        return block
@@ -0,0 +1,45 @@
+"""What the story models can take, for sizing their prompts.
+
+USAGE:
+
+    budget = prompt_budget(
+        "gpt-4-1106-preview",
+        max_output_tokens=server_settings.default_story_max_tokens,
+        target_prompt_tokens=server_settings.story_prompt_target_tokens,
+    )
+"""
+from typing import Dict, Optional
+
+DEFAULT_CONTEXT_WINDOW = 4096
+"""The context window assumed for models that aren't in the table (and for every model, before there was a table)."""
+
+_context_windows: Dict[str, int] = {
+    "gpt-3.5-turbo": 4096,
+    "gpt-4": 8192,
+    "gpt-4-1106-preview": 128000,
+    "llama_v2": 4096,
+    "dolly_v2": 2048,
+}
+
+
+def register_context_window(model_name: str, context_window: int):
+    """Record that `model_name` accepts `context_window` tokens of prompt and output combined."""
+    _context_windows[model_name] = context_window
+
+
+def context_window_for_model(model_name: Optional[str]) -> int:
+    return _context_windows.get(model_name, DEFAULT_CONTEXT_WINDOW)
+
+
+def prompt_budget(
+    model_name: Optional[str], max_output_tokens: int, target_prompt_tokens: int = 0
+) -> int:
+    """Return how many tokens a prompt may have, so that `model_name` can complete it.
+
+    That is the model's context window, less room for the output. A `target_prompt_tokens` caps the budget below that:
+    shorter prompts have a shorter time to first token, at the cost of some context.
+    """
+    budget = context_window_for_model(model_name) - max_output_tokens
+    if target_prompt_tokens:
+        budget = min(budget, target_prompt_tokens)
+    return budget
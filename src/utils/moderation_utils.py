@@ -1,6 +1,7 @@
 from typing import Final
 
-from steamship import Block
+from steamship import Block, Tag
+from steamship.data.tags.tag_constants import TagValueKey
 from steamship.data.tags.tag_utils import get_tag
 
 _ADMIN_TAG_KIND: Final[str] = "admin"
@@ -17,6 +18,15 @@ def mark_block_as_excluded(block: Block):
     )
 
 
+def excluded_tag() -> Tag:
+    """A tag that excludes the block it's created with, like `mark_block_as_excluded`."""
+    return Tag(
+        kind=_ADMIN_TAG_KIND,
+        name=_EXCLUDED_TAG_NAME,
+        value={TagValueKey.STRING_VALUE: "flagged"},
+    )
+
+
 def is_block_excluded(block: Block) -> bool:
     if not block:
         return True
@@ -0,0 +1,161 @@
+"""Waiting for streamed Blocks to finish.
+
+A streamed Block is returned as soon as its generation starts, and filled in as it goes. There's no completion callback
+in Steamship, so `StreamWaiter` polls it: tightly at first, since most streams finish within a second or two, then
+backing off towards `max_interval`. That is kept short, since however long the stream ran, its end is only noticed on
+the next poll. Where a push-based notification exists, register a `StreamNotifier` and the waiter blocks on it instead
+of sleeping.
+
+A stream still unfinished at the waiter's deadline raises `StreamTimeoutError`, rather than passing on a partial text
+that callers would persist as if it were complete.
+
+Every wait is recorded in `StreamWaitStats`, to see how long the game actually waits for streams.
+
+USAGE:
+
+    block = StreamWaiter().wait(block)
+
+    set_stream_notifier(MyNotifier())
+"""
+import logging
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import deque
+from typing import Callable, Deque, Dict, Optional
+
+from steamship import Block, SteamshipError
+from steamship.data.block import StreamState
+
+FINISHED_STREAM_STATES = [StreamState.COMPLETE, StreamState.ABORTED]
+
+
+class StreamNotifier(ABC):
+    """A push-based source of stream updates, for the waiter to block on instead of sleeping."""
+
+    @abstractmethod
+    def wait_for_update(self, block: Block, timeout: float) -> bool:
+        """Wait until `block` may have changed, for at most `timeout` seconds. Return whether it may have."""
+
+
+_notifier: Optional[StreamNotifier] = None
+
+
+def set_stream_notifier(notifier: Optional[StreamNotifier]):
+    """Have every `StreamWaiter` block on `notifier` for updates, or poll again if it is None."""
+    global _notifier
+    _notifier = notifier
+
+
+class StreamWaitStats:
+    """How long recent waits for streamed Blocks took."""
+
+    _MAX_WAITS = 256
+
+    _waits: Deque[float] = deque(maxlen=_MAX_WAITS)
+    _lock = threading.Lock()
+
+    @classmethod
+    def record(cls, seconds: float):
+        with cls._lock:
+            cls._waits.append(seconds)
+
+    @classmethod
+    def summary(cls) -> Dict[str, float]:
+        with cls._lock:
+            waits = sorted(cls._waits)
+        if not waits:
+            return {
+                "waits": 0,
+                "mean_seconds": 0.0,
+                "p50_seconds": 0.0,
+                "max_seconds": 0.0,
+            }
+        return {
+            "waits": len(waits),
+            "mean_seconds": sum(waits) / len(waits),
+            "p50_seconds": waits[len(waits) // 2],
+            "max_seconds": waits[-1],
+        }
+
+    @classmethod
+    def reset(cls):
+        with cls._lock:
+            cls._waits.clear()
+
+
+class StreamTimeoutError(SteamshipError):
+    """A streamed Block didn't finish before the waiter's deadline. `block` is the Block as it was then."""
+
+    def __init__(self, block: Block, waited: float):
+        super().__init__(
+            message=f"Block {block.id} was still streaming after {waited:.1f}s"
+        )
+        self.block = block
+
+
+def _get_block(block: Block) -> Block:
+    return Block.get(block.client, _id=block.id)
+
+
+class StreamWaiter:
+    """Waits for a streamed Block to finish, polling with a growing interval up to a deadline."""
+
+    initial_interval: float
+    """Seconds to wait before the first poll."""
+
+    max_interval: float
+    """The longest the interval between polls grows to."""
+
+    backoff: float
+    """How much the interval grows after each poll that finds the stream unfinished."""
+
+    deadline: Optional[float]
+    """Seconds after which to stop waiting, raising `StreamTimeoutError`. None waits until the stream finishes."""
+
+    def __init__(
+        self,
+        initial_interval: float = 0.05,
+        max_interval: float = 0.4,
+        backoff: float = 1.5,
+        deadline: Optional[float] = 120,
+        fetch: Callable[[Block], Block] = _get_block,
+    ):
+        self.initial_interval = initial_interval
+        self.max_interval = max_interval
+        self.backoff = backoff
+        self.deadline = deadline
+        self.fetch = fetch
+
+    def wait(self, block: Block) -> Block:
+        """Return `block` once its stream has finished, re-fetched as it was then.
+
+        Raises StreamTimeoutError if it hasn't finished by the deadline.
+        """
+        if block.stream_state in FINISHED_STREAM_STATES:
+            return block
+
+        start_time = time.perf_counter()
+        interval = self.initial_interval
+        polls = 0
+        while block.stream_state not in FINISHED_STREAM_STATES:
+            elapsed = time.perf_counter() - start_time
+            if self.deadline is not None and elapsed >= self.deadline:
+                StreamWaitStats.record(elapsed)
+                raise StreamTimeoutError(block, elapsed)
+            # A notifier wakes the waiter as soon as there's news, so there's no need to poll tightly.
+            timeout = self.max_interval if _notifier is not None else interval
+            if self.deadline is not None:
+                timeout = min(timeout, self.deadline - elapsed)
+            if _notifier is not None:
+                _notifier.wait_for_update(block, timeout)
+            else:
+                time.sleep(timeout)
+            block = self.fetch(block)
+            polls += 1
+            interval = min(interval * self.backoff, self.max_interval)
+
+        waited = time.perf_counter() - start_time
+        StreamWaitStats.record(waited)
+        logging.debug(f"Waited {waited:.2f}s ({polls} polls) for block {block.id}")
+        return block
@@ -0,0 +1,60 @@
+"""Tolerant parsing of the JSON that generations are asked to respond with.
+
+Models asked for "ONLY JSON" still wrap it in prose or code fences, curl its quotes and leave trailing commas. Rather than
+failing (and generating again), these functions find the first JSON object or array in the text, repair those defects,
+and check that the result has the expected shape. They return None when that fails, so that the caller can decide
+whether to ask the model to fix its output (see `generation_utils.parse_or_fix_up`).
+
+USAGE:
+
+    item = parse_json_object(block.text, required_keys=["name", "description"])
+    choices = parse_json_list(block.text)
+"""
+import json
+import re
+from typing import Any, List, Optional
+
+_SMART_QUOTES = str.maketrans({"“": '"', "”": '"', "„": '"', "‘": "'", "’": "'"})
+_CODE_FENCE = re.compile(r"```[a-zA-Z]*")
+_TRAILING_COMMA = re.compile(r",\s*([}\]])")
+_DECODER = json.JSONDecoder()
+
+
+def extract_json(text: Optional[str], opener: str) -> Optional[Any]:
+    """Parse the first JSON value starting with `opener` ("{" or "[") in `text`, repairing common defects."""
+    if not text:
+        return None
+    text = _CODE_FENCE.sub("", text)
+    # Smart quotes are only straightened if the text doesn't parse as it is: inside strings, they are fine as they are.
+    for variant in (text, text.translate(_SMART_QUOTES)):
+        start = variant.find(opener)
+        if start < 0:
+            return None
+        for attempt in (variant[start:], _TRAILING_COMMA.sub(r"\1", variant[start:])):
+            try:
+                # Ignores whatever follows the value
+                return _DECODER.raw_decode(attempt)[0]
+            except json.JSONDecodeError:
+                continue
+    return None
+
+
+def parse_json_object(text: Optional[str], required_keys: List[str]) -> Optional[dict]:
+    """Return the first JSON object in `text`, if it has a non-empty string for each of `required_keys`."""
+    value = extract_json(text, "{")
+    if not isinstance(value, dict):
+        return None
+    for key in required_keys:
+        if not isinstance(value.get(key), str) or not value[key].strip():
+            return None
+    return value
+
+
+def parse_json_list(text: Optional[str]) -> Optional[List[str]]:
+    """Return the first JSON array in `text`, if it is a non-empty list of strings."""
+    value = extract_json(text, "[")
+    if not isinstance(value, list) or not value:
+        return None
+    if not all(isinstance(item, str) for item in value):
+        return None
+    return value
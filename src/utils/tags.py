@@ -97,6 +97,11 @@ class QuestTag(str, Enum):
     LIKELIHOOD_EVALUATION = "likelihood_evaluation"
     DICE_ROLL = "dice_roll"
     IS_SOLUTION_ATTEMPT = "is_solution_attempt"
+    ACTION_JUDGMENT = "action_judgment"
+    FIX_UP_PROMPT = "fix_up_prompt"
+    # A summary of the turns of a quest that no longer fit in the context; its value is the index of the last block it
+    # covers.
+    ROLLING_SUMMARY = "rolling_summary"
 
 
 class ItemTag(str, Enum):
@@ -131,6 +136,7 @@ class QuestIdTag(Tag):
 
 class QuestArcTag(str, Enum):
     PROMPT = "prompt"
+    TOP_UP_PROMPT = "top_up_prompt"
     RESULT = "result"
 
 
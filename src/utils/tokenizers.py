@@ -0,0 +1,158 @@
+"""Token counting matched to the story model.
+
+Prompts are trimmed to fit the story model's context window, so they should be measured with that model's tokenizer.
+Each `Tokenizer` can count tokens exactly, or estimate them from the length of the text: counting is expensive,
+estimating is nearly free. `TokenCountCache.count_for_selection` uses the estimate wherever it settles the question
+(a block clearly fits in, or clearly overflows, the remaining budget) and only counts exactly near the budget edge.
+
+USAGE:
+
+    tokenizer = tokenizer_for_model(server_settings.default_story_model)
+    tokenizer.count("Once upon a time")
+
+    register_tokenizer("my-model", Tokenizer("my-model", encoding_name="cl100k_base"))
+
+Run this module to benchmark the estimates against exact counts on the example content:
+
+    PYTHONPATH=src python -m utils.tokenizers
+"""
+import math
+import pathlib
+import sys
+import time
+from typing import Dict, List, Optional, Tuple
+
+import tiktoken
+
+
+class Tokenizer:
+    """Counts the tokens of a text for one family of models."""
+
+    name: str
+    """Identifies the counts of this tokenizer, e.g. in the token count tags stored on blocks."""
+
+    encoding_name: Optional[str]
+    """The tiktoken encoding of the model, if it has one. Without one, counts are (conservative) estimates."""
+
+    chars_per_token: float
+    """The average number of characters per token in English prose, used for estimates."""
+
+    estimate_error: float
+    """The relative error of an estimate that `estimate_range` allows for."""
+
+    def __init__(
+        self,
+        name: str,
+        encoding_name: Optional[str] = None,
+        chars_per_token: float = 4.0,
+        estimate_error: float = 0.3,
+    ):
+        self.name = name
+        self.encoding_name = encoding_name
+        self.chars_per_token = chars_per_token
+        self.estimate_error = estimate_error
+        self._encoding = None
+
+    @property
+    def is_exact(self) -> bool:
+        return self.encoding_name is not None
+
+    def count(self, text: Optional[str]) -> int:
+        """Count the tokens in `text`."""
+        if not text:
+            return 0
+        if not self.is_exact:
+            return self.estimate_range(text)[1]
+        if self._encoding is None:
+            self._encoding = tiktoken.get_encoding(self.encoding_name)
+        return len(self._encoding.encode(text))
+
+    def estimate(self, text: Optional[str]) -> int:
+        """Estimate the tokens in `text` from its length."""
+        if not text:
+            return 0
+        return math.ceil(len(text) / self.chars_per_token)
+
+    def estimate_range(self, text: Optional[str]) -> Tuple[int, int]:
+        """Return bounds that the token count of `text` almost certainly falls within."""
+        estimate = self.estimate(text)
+        return (
+            math.floor(estimate * (1 - self.estimate_error)),
+            math.ceil(estimate * (1 + self.estimate_error)),
+        )
+
+
+# The tokenizer of steamship's `message_selectors.tokens`, which the game used for every model before. Token count tags
+# stored by it carry no name.
+P50K = Tokenizer("p50k_base", encoding_name="p50k_base")
+CL100K = Tokenizer("cl100k_base", encoding_name="cl100k_base")
+# There is no local tokenizer for Llama 2 (a SentencePiece model), which splits text into more tokens than OpenAI's.
+LLAMA = Tokenizer("llama", chars_per_token=3.5)
+
+DEFAULT_TOKENIZER = P50K
+
+_tokenizers: Dict[str, Tokenizer] = {
+    "gpt-3.5-turbo": CL100K,
+    "gpt-4": CL100K,
+    "gpt-4-1106-preview": CL100K,
+    "llama_v2": LLAMA,
+    "dolly_v2": P50K,  # Dolly's GPT-NeoX tokenizer is close to GPT-2's
+}
+
+
+def register_tokenizer(model_name: str, tokenizer: Tokenizer):
+    """Use `tokenizer` to measure prompts for `model_name`."""
+    _tokenizers[model_name] = tokenizer
+
+
+def tokenizer_for_model(model_name: Optional[str]) -> Tokenizer:
+    """Return the tokenizer registered for `model_name`, or the default one."""
+    return _tokenizers.get(model_name, DEFAULT_TOKENIZER)
+
+
+def benchmark(tokenizer: Tokenizer, texts: List[str]) -> Dict[str, float]:
+    """Compare the speed and accuracy of `tokenizer`'s estimates against its exact counts over `texts`."""
+    start = time.perf_counter()
+    counts = [tokenizer.count(text) for text in texts]
+    count_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    estimates = [tokenizer.estimate(text) for text in texts]
+    estimate_seconds = time.perf_counter() - start
+
+    errors = [
+        abs(estimate - count) / count
+        for estimate, count in zip(estimates, counts)
+        if count
+    ]
+    in_range = [
+        low <= count <= high
+        for (low, high), count in zip(map(tokenizer.estimate_range, texts), counts)
+    ]
+    return {
+        "texts": len(texts),
+        "count_ms": count_seconds * 1000,
+        "estimate_ms": estimate_seconds * 1000,
+        "mean_error": sum(errors) / len(errors) if errors else 0.0,
+        "max_error": max(errors, default=0.0),
+        "in_range": sum(in_range) / len(in_range) if in_range else 1.0,
+    }
+
+
+if __name__ == "__main__":
+    content_dir = pathlib.Path(sys.argv[1] if len(sys.argv) > 1 else "example_content")
+    texts = [
+        paragraph
+        for path in sorted(content_dir.glob("*.yaml"))
+        for paragraph in path.read_text(encoding="utf-8").split("\n\n")
+        if paragraph.strip()
+    ]
+    print(
+        "| Tokenizer     | Texts | Count (ms) | Estimate (ms) | Mean error | Max error | In range |"
+    )
+    for tokenizer in [P50K, CL100K]:
+        result = benchmark(tokenizer, texts)
+        print(
+            f"| {tokenizer.name:13} | {result['texts']:5} | {result['count_ms']:10.2f} | {result['estimate_ms']:13.2f} "
+            f"| {result['mean_error']:10.1%} | {result['max_error']:9.1%} | {result['in_range']:8.1%} |"
+        )
@@ -0,0 +1,82 @@
+import pytest
+from steamship import Block
+
+from agents import quest_agent
+from agents.quest_agent import QuestAgent, describe_paragraphs, parse_action_judgment
+from schema.characters import HumanCharacter
+from schema.game_state import GameState
+from schema.quest import Quest
+
+
+@pytest.mark.parametrize(
+    "text, expected",
+    [
+        (
+            '{"solution_attempt": "YES", "likelihood": "VERY LIKELY"}',
+            (True, "VERY LIKELY"),
+        ),
+        ('Sure! {"solution_attempt": "no"}', (False, None)),
+        ('{"solution_attempt": "YES", "likelihood": ""}', (True, None)),
+        (
+            '```json\n{\n  "solution_attempt": "YES",\n  "likelihood": "UNLIKELY"\n}\n```',
+            (True, "UNLIKELY"),
+        ),
+        ("YES", None),
+        ('{"solution_attempt": "MAYBE", "likelihood": "LIKELY"}', None),
+        ('{"solution_attempt": "YES", "likelihood": }', None),
+        (None, None),
+    ],
+)
+def test_parse_action_judgment(text, expected):
+    assert parse_action_judgment(text) == expected
+
+
+@pytest.mark.parametrize(
+    "is_solution_attempt, expected", [("YES", (True, "LIKELY")), ("NO", (False, None))]
+)
+def test_judge_action_concurrently_starts_both_generations(
+    monkeypatch, is_solution_attempt, expected
+):
+    started, finished, discarded = [], [], []
+
+    def start(name):
+        def start_generation(prompt, quest_name, context):
+            started.append(name)
+            return name
+
+        return start_generation
+
+    def finish_generation(task, context):
+        finished.append(task)
+        return Block(
+            text={"attempt": is_solution_attempt, "likelihood": "LIKELY"}[task]
+        )
+
+    monkeypatch.setattr(quest_agent, "start_is_solution_attempt", start("attempt"))
+    monkeypatch.setattr(quest_agent, "start_likelihood_estimation", start("likelihood"))
+    monkeypatch.setattr(quest_agent, "finish_generation", finish_generation)
+    monkeypatch.setattr(quest_agent, "discard_generation", discarded.append)
+
+    game_state = GameState(player=HumanCharacter(name="Ada"))
+    quest = Quest(
+        name="quest",
+        current_problem="A locked door",
+        user_problem_solutions=["pick the lock"],
+    )
+    judgment = QuestAgent(tools=[], llm=None).judge_action_concurrently(
+        game_state, None, quest
+    )
+
+    assert judgment == expected
+    assert started == ["attempt", "likelihood"]
+    # The likelihood of an action that isn't an attempt isn't waited for
+    assert finished == (["attempt", "likelihood"] if expected[0] else ["attempt"])
+    assert discarded == ([] if expected[0] else ["likelihood"])
+
+
+def test_describe_paragraphs():
+    assert describe_paragraphs(1) == "one paragraph"
+    assert (
+        describe_paragraphs(2, "short")
+        == "two short paragraphs, separated by a blank line"
+    )
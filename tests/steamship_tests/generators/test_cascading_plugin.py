@@ -1,7 +1,16 @@
+from collections import OrderedDict
+
 import pytest
-from steamship import PluginInstance, Block
+from steamship import Block, PluginInstance, Task, TaskState
 
-from generators.cascading_plugin import CascadingPlugin, ExhaustedPluginsException
+import generators.cascading_plugin as cascading_plugin
+from generators.cascading_plugin import (
+    CascadingPlugin,
+    CircuitState,
+    ExhaustedPluginsException,
+    ProviderHealth,
+    report_finished,
+)
 
 
 class DummyInstance(PluginInstance):
@@ -18,10 +27,7 @@ class DummyInstance(PluginInstance):
 def test_cascade_with_failures():
     instance_1 = DummyInstance(plugin_id="Instance1")
     instance_2 = DummyInstance(plugin_id="Instance2")
-    providers = [
-        lambda: instance_1,
-        lambda: instance_2
-    ]
+    providers = [lambda: instance_1, lambda: instance_2]
 
     pi: PluginInstance = CascadingPlugin(instance_providers=providers)
     assert pi.generate(text="First Call") == Block(text="Instance1_1")
@@ -36,3 +42,163 @@ def test_cascade_with_failures():
     # Test that we can still generate after that
     instance_1.throw = False
     assert pi.generate(text="Sixth Call") == Block(text="Instance1_3")
+
+
+class CountingInstance(DummyInstance):
+    calls: int = 0
+
+    def generate(self, *args, **kwargs):
+        self.calls += 1
+        return super().generate(*args, **kwargs)
+
+
+def test_open_circuit_skips_failing_provider():
+    instance_1 = CountingInstance(plugin_id="Instance1", throw=True)
+    instance_2 = CountingInstance(plugin_id="Instance2")
+    pi = CascadingPlugin(
+        instance_providers=[lambda: instance_1, lambda: instance_2],
+        failure_threshold=2,
+        open_seconds=60,
+    )
+    assert pi.generate() == Block(text="Instance2_1")
+    assert pi.generate() == Block(text="Instance2_2")
+    assert pi.health(0).state == CircuitState.OPEN
+    assert pi.next_provider() == 1
+    # Straight to the healthy provider while the primary recovers
+    assert pi.generate() == Block(text="Instance2_3")
+    assert instance_1.calls == 2
+
+
+def test_half_open_circuit_probes_provider():
+    instance_1 = CountingInstance(plugin_id="Instance1", throw=True)
+    instance_2 = CountingInstance(plugin_id="Instance2")
+    pi = CascadingPlugin(
+        instance_providers=[lambda: instance_1, lambda: instance_2],
+        failure_threshold=1,
+        open_seconds=0,
+    )
+    assert pi.generate() == Block(text="Instance2_1")
+    assert pi.health(0).state == CircuitState.HALF_OPEN
+    assert pi.generate() == Block(text="Instance2_2")
+    assert pi.health(0).failures == 2
+    instance_1.throw = False
+    assert pi.generate() == Block(text="Instance1_1")
+    assert pi.health(0).state == CircuitState.CLOSED
+    assert instance_1.calls == 3
+
+
+def test_failed_probe_backs_off():
+    health = ProviderHealth(failure_threshold=1, open_seconds=2, max_open_seconds=5)
+    assert health.record_failure()
+    assert health.state == CircuitState.OPEN
+    health._opened_at -= 2
+    assert health.state == CircuitState.HALF_OPEN
+    assert health.record_failure()
+    assert health.state == CircuitState.OPEN
+    assert health.current_open_seconds == 4
+    health._opened_at -= 4
+    assert health.record_failure()
+    assert health.current_open_seconds == 5
+    health.record_success(0.5)
+    assert health.state == CircuitState.CLOSED
+    assert health.current_open_seconds == 2
+
+
+def test_named_provider_health_is_shared():
+    instance_1 = CountingInstance(plugin_id="Instance1", throw=True)
+    instance_2 = CountingInstance(plugin_id="Instance2")
+    names = ["shared-primary", "shared-backup"]
+
+    def cascade():
+        return CascadingPlugin(
+            instance_providers=[lambda: instance_1, lambda: instance_2],
+            provider_names=names,
+            failure_threshold=1,
+            open_seconds=60,
+        )
+
+    assert cascade().generate() == Block(text="Instance2_1")
+    assert cascade().generate() == Block(text="Instance2_2")
+    assert instance_1.calls == 1
+
+
+def test_slow_provider_is_tried_last():
+    instance_1 = CountingInstance(plugin_id="Instance1")
+    instance_2 = CountingInstance(plugin_id="Instance2")
+    pi = CascadingPlugin(
+        instance_providers=[lambda: instance_1, lambda: instance_2],
+        slow_call_seconds=1,
+    )
+    pi.health(0).record_success(5)
+    assert pi.generate() == Block(text="Instance2_1")
+
+
+class TaskInstance(PluginInstance):
+    def generate(self, *args, **kwargs):
+        return Task(task_id="generation", state=TaskState.running)
+
+
+def test_tasks_count_once_they_finish(monkeypatch):
+    pi = CascadingPlugin(instance_providers=[lambda: TaskInstance(plugin_id="Tasks")])
+    task = pi.generate()
+    assert pi.health(0).successes == pi.health(0).failures == 0
+
+    # The task fails after it was submitted
+    monkeypatch.setattr(
+        Task,
+        "refresh",
+        lambda self: self.update(Task(task_id=self.task_id, state=TaskState.failed)),
+    )
+    task.wait(retry_delay_s=0)
+    task.wait(retry_delay_s=0)
+    assert pi.health(0).failures == 1
+
+    monkeypatch.setattr(
+        Task,
+        "refresh",
+        lambda self: self.update(Task(task_id=self.task_id, state=TaskState.succeeded)),
+    )
+    task = pi.generate()
+    task.ignore_latency()
+    task.wait(retry_delay_s=0)
+    assert pi.health(0).successes == 1
+    assert pi.health(0).latency_ewma is None
+
+    pi.generate().wait(retry_delay_s=0)
+    assert pi.health(0).successes == 2
+    assert pi.health(0).latency_ewma is not None
+
+
+def test_tasks_report_from_their_id_with_server_timestamps(monkeypatch):
+    monkeypatch.setattr(cascading_plugin, "_pending_tasks", OrderedDict())
+    pi = CascadingPlugin(instance_providers=[lambda: TaskInstance(plugin_id="Tasks")])
+    pi.generate()
+
+    # Seen to finish through another Task object, e.g. in a later invocation
+    task = Task(
+        task_id="generation",
+        state=TaskState.succeeded,
+        task_created_on="2023-08-01T12:00:00.000Z",
+        task_last_modified_on="2023-08-01T12:00:03.500Z",
+    )
+    report_finished(task)
+    report_finished(task)
+    assert pi.health(0).successes == 1
+    assert pi.health(0).latency_ewma == 3.5
+
+
+def test_half_open_circuit_allows_one_probe_at_a_time():
+    health = ProviderHealth(failure_threshold=1, open_seconds=2)
+    assert health.should_call()
+    health.record_failure()
+    assert not health.should_call()
+    health._opened_at -= 2
+    assert health.should_call()
+    # Another caller doesn't probe while the probe is in flight ...
+    assert not health.should_call()
+    # ... unless it has been in flight for as long as the circuit was open
+    health._probe_started_at -= 2
+    assert health.should_call()
+    health.record_success(0.5)
+    assert health.should_call()
+    assert health.should_call()
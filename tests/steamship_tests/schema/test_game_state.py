@@ -1,4 +1,5 @@
 from schema.game_state import GameState
+from schema.quest import Quest
 
 
 def test_game_state_dict():
@@ -6,3 +7,102 @@ def test_game_state_dict():
     d = gs.dict()
     assert d
     assert "active_mode" in d
+
+
+def test_game_state_subtrees_round_trip():
+    gs = GameState()
+    gs.quests = [Quest(name="q1"), Quest(name="q2")]
+    gs.current_quest = "q2"
+    subtrees = gs.persisted_subtrees()
+    assert "quests/0" in subtrees
+    assert "quests/1" in subtrees
+    assert "quests" not in subtrees[""]
+
+    gs2 = GameState.from_persisted_subtrees(subtrees)
+    assert [q.name for q in gs2.quests] == ["q1", "q2"]
+    assert gs2.current_quest == "q2"
+    assert gs2.player == gs.player
+
+
+def test_game_state_legacy_document():
+    gs = GameState()
+    gs.quests = [Quest(name="q1")]
+    gs2 = GameState.from_persisted_subtrees({"": gs.dict()})
+    assert [q.name for q in gs2.quests] == ["q1"]
+
+
+def test_game_state_changed_subtrees():
+    gs = GameState()
+    gs.quests = [Quest(name="q1"), Quest(name="q2")]
+    gs.mark_clean()
+
+    _, changed, removed = gs.changed_subtrees()
+    assert changed == {}
+    assert removed == []
+
+    gs.await_ask_key = "key"
+    gs.quests[1].user_problem_solutions.append("run away")
+    _, changed, removed = gs.changed_subtrees()
+    assert set(changed.keys()) == {"", "quests/1"}
+
+    gs.quests.pop()
+    _, changed, removed = gs.changed_subtrees()
+    assert removed == ["quests/1"]
+
+
+def test_game_state_rebase_merges_concurrent_edits():
+    gs = GameState()
+    gs.quests = [Quest(name="q1")]
+    gs.mark_clean(version=1)
+    current_quest = gs.quests[0]
+
+    # Another invocation saved a new player name and a new quest in the meantime
+    theirs = GameState.from_persisted_subtrees(gs.persisted_subtrees())
+    theirs.player.name = "Ada"
+    theirs.quests.append(Quest(name="q2"))
+
+    gs.quests[0].user_problem_solutions.append("run away")
+    gs.rebase(theirs.persisted_subtrees(), 2)
+
+    assert gs.persisted_version == 2
+    assert gs.player.name == "Ada"
+    assert [q.name for q in gs.quests] == ["q1", "q2"]
+    assert gs.quests[0] is current_quest
+    assert current_quest.user_problem_solutions == ["run away"]
+    _, changed, _ = gs.changed_subtrees()
+    assert set(changed.keys()) == {"quests/0"}
+
+
+def test_game_state_archive_quests():
+    gs = GameState()
+    gs.quests = [Quest(name="q1", completed_timestamp="t", text_summary="s")]
+    gs.quests.append(Quest(name="q2"))
+    gs.current_quest = "q2"
+
+    archived = gs.archive_quests()
+    assert [q.name for q in archived] == ["q1"]
+    assert [q.name for q in gs.quests] == ["q2"]
+    assert gs.archived_quests[0].text_summary == "s"
+    assert gs.quest_count() == 2
+    assert gs.completed_quest_count() == 1
+    assert gs.archive_quests() == []
+
+
+def test_game_state_trusted_load():
+    gs = GameState()
+    gs.player.name = "Ada"
+    gs.quests = [Quest(name="q1", user_problem_solutions=["run away"])]
+    gs.current_quest = "q1"
+    subtrees = gs.persisted_subtrees()
+
+    trusted = GameState.from_persisted_subtrees(subtrees, trusted=True)
+    assert trusted == GameState.from_persisted_subtrees(subtrees)
+    assert isinstance(trusted.quests[0], Quest)
+    assert trusted.active_mode == gs.active_mode
+    assert trusted.persisted_subtrees() == subtrees
+
+
+def test_quest_action_choices_are_discarded_when_the_player_acts():
+    quest = Quest(name="q1", action_choices_task_id="task")
+    quest.add_user_solution("look around")
+    assert quest.action_choices_task_id is None
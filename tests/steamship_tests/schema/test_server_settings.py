@@ -14,3 +14,12 @@ def test_server_settings_nested_obj():
     assert ss.image_themes
     assert len(ss.image_themes) == 1
     assert isinstance(ss.image_themes[0], ImageTheme)
+
+
+def test_server_settings_trusted_load():
+    ss = ServerSettings.parse_obj({"image_themes": [{"name": "test"}]})
+    subtrees = ss.persisted_subtrees()
+
+    trusted = ServerSettings.from_persisted_subtrees(subtrees, trusted=True)
+    assert trusted == ss
+    assert isinstance(trusted.image_themes[0], ImageTheme)
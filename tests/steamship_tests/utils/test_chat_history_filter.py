@@ -0,0 +1,289 @@
+from collections import OrderedDict
+
+import pytest
+from steamship import Tag
+from steamship.data import TagKind
+from steamship.data.tags.tag_constants import ChatTag, RoleTag, TagValueKey
+
+import utils.ChatHistoryFilter as ChatHistoryFilter
+from schema.game_state import GameState
+from utils.ChatHistoryFilter import (
+    ChatHistoryIndex,
+    LastInventoryFilter,
+    QuestNameFilter,
+    TagFilter,
+    TokenCountCache,
+    TrimmingStoryContextFilter,
+    UnionFilter,
+)
+from utils.local_backend import LocalBackend
+from utils.tags import (
+    CharacterTag,
+    InstructionsTag,
+    QuestIdTag,
+    QuestTag,
+    TagKindExtensions,
+)
+from utils.tokenizers import DEFAULT_TOKENIZER, Tokenizer
+
+counted = []
+
+
+@pytest.fixture(autouse=True)
+def offline_token_counts(monkeypatch):
+    """Count words instead of tokens (tiktoken downloads its encodings), starting from an empty cache."""
+
+    def fake_count(text):
+        counted.append(text)
+        return len(text.split())
+
+    counted.clear()
+    monkeypatch.setattr(DEFAULT_TOKENIZER, "count", fake_count)
+    monkeypatch.setattr(TokenCountCache, "_counts", OrderedDict())
+    monkeypatch.setattr(TokenCountCache, "_pending", OrderedDict())
+
+
+def _inventory_tag() -> Tag:
+    return Tag(kind=TagKindExtensions.CHARACTER, name=CharacterTag.INVENTORY)
+
+
+def test_filters_use_index_and_follow_appends():
+    file = LocalBackend().get_or_create_file({"id": "default"})
+    file.append_block(
+        text="onboarding",
+        tags=[
+            Tag(kind=TagKindExtensions.INSTRUCTIONS, name=InstructionsTag.ONBOARDING)
+        ],
+    )
+    file.append_block(text="inventory 1", tags=[_inventory_tag()])
+    file.append_block(text="quest 1", tags=[QuestIdTag("Quest-1")])
+
+    union = UnionFilter(
+        [
+            TagFilter([(TagKindExtensions.INSTRUCTIONS, InstructionsTag.ONBOARDING)]),
+            QuestNameFilter(quest_name="quest-1"),
+            LastInventoryFilter(),
+        ]
+    )
+    assert [b.text for b, _ in union.filter_blocks(file)] == [
+        "onboarding",
+        "inventory 1",
+        "quest 1",
+    ]
+
+    # Newly appended blocks are picked up, including after a refresh
+    file.append_block(text="inventory 2", tags=[_inventory_tag()])
+    file.append_block(text="quest 2", tags=[QuestIdTag("quest-1")])
+    assert [b.text for b, _ in LastInventoryFilter().filter_blocks(file)] == [
+        "inventory 2"
+    ]
+    file.refresh()
+    assert [
+        b.text for b, _ in QuestNameFilter(quest_name="QUEST-1").filter_blocks(file)
+    ] == ["quest 1", "quest 2"]
+
+
+def test_trimming_filter_selects_within_budget():
+    file = LocalBackend().get_or_create_file({"id": "default"})
+
+    def append(text, *tags, role=RoleTag.ASSISTANT):
+        tags = [
+            *tags,
+            Tag(
+                kind=TagKindExtensions.TOKEN_COUNT, value={TagValueKey.NUMBER_VALUE: 10}
+            ),
+            Tag(
+                kind=TagKind.CHAT,
+                name=ChatTag.ROLE,
+                value={TagValueKey.STRING_VALUE: role},
+            ),
+        ]
+        file.append_block(text=text, tags=tags)
+
+    append(
+        "onboarding",
+        Tag(kind=TagKindExtensions.INSTRUCTIONS, name=InstructionsTag.ONBOARDING),
+        role=RoleTag.SYSTEM,
+    )
+    append(
+        "old summary", Tag(kind=TagKindExtensions.QUEST, name=QuestTag.QUEST_SUMMARY)
+    )
+    append(
+        "quest prompt",
+        Tag(kind=TagKindExtensions.INSTRUCTIONS, name=InstructionsTag.QUEST),
+        QuestIdTag("q"),
+        role=RoleTag.SYSTEM,
+    )
+    for i in range(5):
+        append(f"message {i}", QuestIdTag("q"))
+
+    base_filter = UnionFilter(
+        [
+            TagFilter(
+                [
+                    (TagKindExtensions.INSTRUCTIONS, InstructionsTag.ONBOARDING),
+                    (TagKindExtensions.QUEST, QuestTag.QUEST_SUMMARY),
+                ]
+            ),
+            QuestNameFilter(quest_name="q"),
+        ]
+    )
+    # Each block costs 10 tokens + 10 for its role: room for 4 blocks
+    trimming_filter = TrimmingStoryContextFilter(
+        base_filter, current_quest_id="q", game_state=GameState(), max_tokens=81
+    )
+    assert [b.text for b, _ in trimming_filter.filter_blocks(file)] == [
+        "onboarding",
+        "quest prompt",
+        "message 3",
+        "message 4",
+    ]
+    assert [b.text for b in trimming_filter.uncompacted_blocks] == [
+        "message 0",
+        "message 1",
+        "message 2",
+    ]
+
+    trimming_filter._max_tokens = 1000
+    assert [b.text for b, _ in trimming_filter.filter_blocks(file)] == [
+        "onboarding",
+        "old summary",
+        "quest prompt",
+        "message 0",
+        "message 1",
+        "message 2",
+        "message 3",
+        "message 4",
+    ]
+    assert trimming_filter.uncompacted_blocks == []
+
+    # A rolling summary stands in for the messages it covers (up to "message 2")
+    append(
+        "rolling summary",
+        Tag(
+            kind=TagKindExtensions.QUEST,
+            name=QuestTag.ROLLING_SUMMARY,
+            value={TagValueKey.NUMBER_VALUE: 5},
+        ),
+        QuestIdTag("q"),
+        role=RoleTag.SYSTEM,
+    )
+    trimming_filter._max_tokens = 81
+    assert [b.text for b, _ in trimming_filter.filter_blocks(file)] == [
+        "onboarding",
+        "quest prompt",
+        "message 4",
+        "rolling summary",
+    ]
+    assert trimming_filter.rolling_summary.text == "rolling summary"
+    assert [b.text for b in trimming_filter.uncompacted_blocks] == ["message 3"]
+
+
+def test_trimming_filter_leaves_only_unbroken_runs_for_the_rolling_summary():
+    file = LocalBackend().get_or_create_file({"id": "default"})
+
+    def append(text, *tags, tokens=10, role=RoleTag.ASSISTANT):
+        tags = [
+            *tags,
+            Tag(
+                kind=TagKindExtensions.TOKEN_COUNT,
+                value={TagValueKey.NUMBER_VALUE: tokens},
+            ),
+            Tag(
+                kind=TagKind.CHAT,
+                name=ChatTag.ROLE,
+                value={TagValueKey.STRING_VALUE: role},
+            ),
+        ]
+        file.append_block(text=text, tags=tags)
+
+    append(
+        "quest prompt",
+        Tag(kind=TagKindExtensions.INSTRUCTIONS, name=InstructionsTag.QUEST),
+        QuestIdTag("q"),
+        role=RoleTag.SYSTEM,
+    )
+    append("message 0", QuestIdTag("q"))
+    append("message 1", QuestIdTag("q"))
+    append("message 2", QuestIdTag("q"), tokens=50)
+    append("message 3", QuestIdTag("q"))
+
+    trimming_filter = TrimmingStoryContextFilter(
+        QuestNameFilter(quest_name="q"),
+        current_quest_id="q",
+        game_state=GameState(),
+        max_tokens=61,
+    )
+    # "message 2" doesn't fit, but the older "message 1" does
+    assert [b.text for b, _ in trimming_filter.filter_blocks(file)] == [
+        "quest prompt",
+        "message 1",
+        "message 3",
+    ]
+    assert [b.text for b in trimming_filter.uncompacted_blocks] == ["message 0"]
+
+
+def test_token_counts_are_cached_and_flushed(monkeypatch):
+    created = []
+    monkeypatch.setattr(
+        ChatHistoryFilter.Tag, "create", lambda *args, **kwargs: created.append(kwargs)
+    )
+
+    file = LocalBackend().get_or_create_file({"id": "default"})
+    file.append_block(text="onboarding")
+    ChatHistoryIndex.for_file(file)
+    assert counted == []  # Existing blocks are counted on demand
+
+    block = file.append_block(text="one two three")
+    ChatHistoryIndex.for_file(file)
+    assert counted == ["one two three"]  # Appended blocks are counted right away
+    assert TokenCountCache.count(block) == 3
+
+    # A block without a stored tag (e.g. re-fetched) is served from the cache
+    refetched = file.backend.get_block(block.id)
+    assert TokenCountCache.count(refetched) == 3
+    assert counted == ["one two three"]
+
+    # ... unless its text changed
+    refetched.text = "one two three four"
+    refetched.tags = []
+    assert TokenCountCache.count(refetched) == 4
+
+    # Counts are persisted by flush, once per block
+    refetched.client = object()
+    refetched.tags = []
+    refetched.text = "one two"
+    TokenCountCache.count(refetched)
+    TokenCountCache.flush()
+    TokenCountCache.flush()
+    assert [kwargs["block_id"] for kwargs in created] == [block.id]
+    assert created[0]["value"] == {TagValueKey.NUMBER_VALUE: 2}
+
+    # ... in the local backend, if they are kept in one
+    TokenCountCache.count(file.append_block(text="four"))
+    TokenCountCache.flush(file.backend)
+    assert len(created) == 1
+    stored = file.backend.get_block(file.blocks[-1].id)
+    assert [tag.value for tag in stored.tags if tag.kind == "token_count"] == [
+        {TagValueKey.NUMBER_VALUE: 1}
+    ]
+
+
+def test_count_for_selection_only_counts_near_the_edge():
+    tokenizer = Tokenizer("words", chars_per_token=5.0, estimate_error=0.5)
+    counts = []
+    tokenizer.count = lambda text: counts.append(text) or len(text.split())
+
+    block = (
+        LocalBackend()
+        .get_or_create_file({"id": "default"})
+        .append_block(text="x" * 100)
+    )
+    # The estimate is 20 tokens, so 10 to 30
+    assert TokenCountCache.count_for_selection(block, tokenizer, 100) == 30
+    assert TokenCountCache.count_for_selection(block, tokenizer, 5) == 10
+    assert counts == []
+
+    assert TokenCountCache.count_for_selection(block, tokenizer, 20) == 1
+    assert TokenCountCache.count_for_selection(block, tokenizer, 100) == 1
+    assert counts == ["x" * 100]
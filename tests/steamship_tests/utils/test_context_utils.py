@@ -0,0 +1,370 @@
+from collections import OrderedDict
+from types import SimpleNamespace
+
+from steamship import Tag
+from steamship.agents.schema import AgentContext
+from steamship.data.tags.tag_constants import RoleTag
+from steamship.utils.kv_store import KeyValueStore
+
+import utils.context_utils as context_utils
+from schema.game_state import GameState
+from schema.quest import Quest
+from utils.context_utils import (
+    _GAME_STATE_KEY,
+    _STORY_GENERATOR_KEY,
+    _write_entries,
+    cache_generation,
+    chat_histories_since,
+    chat_history_blocks_after,
+    deferred_saves,
+    end_quest_chat_history,
+    flush_saves,
+    generation_cache_key,
+    get_cached_generation,
+    get_game_state,
+    get_quest_chat_history,
+    get_server_settings,
+    merge_into_chat_history,
+    save_game_state,
+    save_server_settings,
+    start_quest_chat_history,
+    streamed_turn,
+    switch_history_to_current_quest,
+    with_local_backend,
+)
+from utils.local_backend import LocalBackend
+from utils.moderation_utils import is_block_excluded
+from utils.tags import (
+    CharacterTag,
+    InstructionsTag,
+    QuestIdTag,
+    QuestTag,
+    TagKindExtensions,
+)
+
+
+def _offline_context() -> AgentContext:
+    context = AgentContext()
+    context.client = SimpleNamespace(config=SimpleNamespace(workspace_handle="test"))
+    return context
+
+
+def _local_context(backend: LocalBackend) -> AgentContext:
+    client = SimpleNamespace(config=SimpleNamespace(workspace_handle="test"))
+    context = backend.get_or_create_context(client, context_keys={"id": "default"})
+    return with_local_backend(backend, context)
+
+
+def test_deferred_saves_write_once(monkeypatch):
+    writes = []
+    monkeypatch.setattr(
+        context_utils,
+        "_write_game_state",
+        lambda game_state, context: writes.append(game_state.await_ask_key),
+    )
+    context = _offline_context()
+    game_state = GameState()
+
+    with deferred_saves(context):
+        for i in range(3):
+            game_state.await_ask_key = f"key-{i}"
+            save_game_state(game_state, context)
+            assert context.metadata[_GAME_STATE_KEY] is game_state
+        assert writes == []
+
+    assert writes == ["key-2"]
+
+
+def test_flush_saves_writes_early(monkeypatch):
+    writes = []
+    monkeypatch.setattr(
+        context_utils,
+        "_write_game_state",
+        lambda game_state, context: writes.append(game_state.await_ask_key),
+    )
+    context = _offline_context()
+    game_state = GameState()
+
+    with deferred_saves(context):
+        game_state.await_ask_key = "first"
+        save_game_state(game_state, context)
+        flush_saves(context)
+        assert writes == ["first"]
+
+        with deferred_saves(context):  # Nested blocks join the outer one
+            game_state.await_ask_key = "second"
+            save_game_state(game_state, context)
+        assert writes == ["first"]
+
+    assert writes == ["first", "second"]
+
+
+class _InMemoryKeyValueStore:
+    stores = {}
+
+    def __init__(self, client, store_identifier):
+        self.values = self.stores.setdefault(store_identifier, {})
+
+    def get(self, key):
+        return self.values.get(key)
+
+    def set(self, key, value):
+        self.values[key] = value
+
+    def delete(self, key):
+        return self.values.pop(key, None) is not None
+
+    def items(self):
+        return list(self.values.items())
+
+
+def test_server_settings_cache(monkeypatch):
+    monkeypatch.setattr(_InMemoryKeyValueStore, "stores", {})
+    monkeypatch.setattr(context_utils, "KeyValueStore", _InMemoryKeyValueStore)
+    monkeypatch.setattr(context_utils, "_server_settings_cache", {})
+
+    server_settings = get_server_settings(_offline_context())
+    server_settings.name = "first"
+    save_server_settings(server_settings, _offline_context())
+
+    parses = []
+    parse = context_utils.ServerSettings.from_persisted_subtrees
+    monkeypatch.setattr(
+        context_utils.ServerSettings,
+        "from_persisted_subtrees",
+        lambda subtrees, **kwargs: parses.append(subtrees) or parse(subtrees, **kwargs),
+    )
+    loads = []
+    items = _InMemoryKeyValueStore.items
+    monkeypatch.setattr(
+        _InMemoryKeyValueStore, "items", lambda self: loads.append(self) or items(self)
+    )
+    cached = get_server_settings(_offline_context())
+    assert cached.name == "first"
+    assert cached is not server_settings
+    assert parses == []
+    assert loads == []  # Only the version stamp was read
+
+    # A save made by another process bumps the version, so the cached copy is not used.
+    _InMemoryKeyValueStore.stores["server-settings-version"]["server-settings"] = {
+        "version": 2
+    }
+    get_server_settings(_offline_context())
+    assert len(parses) == 1
+
+
+def test_untrusted_load_merges_concurrent_edits(monkeypatch):
+    monkeypatch.setattr(_InMemoryKeyValueStore, "stores", {})
+    monkeypatch.setattr(context_utils, "KeyValueStore", _InMemoryKeyValueStore)
+
+    game_state = get_game_state(_offline_context())
+    game_state.player.name = "Ada"
+    save_game_state(game_state, _offline_context())
+    # As if it had been written by an older version of the schema.
+    _InMemoryKeyValueStore.stores[f"{_GAME_STATE_KEY}-version"][_GAME_STATE_KEY][
+        "schema"
+    ] = "older"
+
+    mine = get_game_state(_offline_context())
+    theirs = get_game_state(_offline_context())
+    theirs.player.gold = 99
+    save_game_state(theirs, _offline_context())
+
+    mine.player.description = "A wanderer"
+    save_game_state(mine, _offline_context())
+
+    reloaded = get_game_state(_offline_context())
+    assert reloaded.player.gold == 99
+    assert reloaded.player.description == "A wanderer"
+    assert reloaded.player.name == "Ada"
+
+
+def test_write_entries_fetches_the_steamship_store_once():
+    posts = []
+    client = SimpleNamespace(
+        post=lambda path, payload, **kwargs: posts.append((path, payload.name))
+    )
+    kv = KeyValueStore(client, "test")
+    stored = [
+        SimpleNamespace(
+            kind=kv.store_identifier,
+            name=name,
+            delete=lambda name=name: posts.append(("tag/delete", name)),
+        )
+        for name in ["a", "b", "c"]
+    ]
+    fetches = []
+    kv._get_file = lambda or_create=False: fetches.append(or_create) or SimpleNamespace(
+        id="file", tags=stored
+    )
+
+    _write_entries(kv, {"a": None, "b": {"value": 2}, "d": {"value": 4}})
+
+    assert fetches == [True]
+    assert posts == [
+        ("tag/delete", "a"),
+        ("tag/delete", "b"),
+        ("tag/create", "b"),
+        ("tag/create", "d"),
+    ]
+
+
+def test_save_keeps_versions_increasing_when_it_gives_up_merging(monkeypatch):
+    backend = LocalBackend()
+    context = _local_context(backend)
+    game_state = get_game_state(context)
+    game_state.player.name = "Ada"
+    save_game_state(game_state, context)
+
+    # The stored version seems to change on every check, until the save overwrites it
+    monkeypatch.setattr(context_utils, "_stored_version", lambda context, key: 0)
+    game_state.player.name = "Grace"
+    save_game_state(game_state, context)
+    assert game_state.persisted_version == 2
+
+
+def test_merge_into_chat_history():
+    backend = LocalBackend()
+    context = _local_context(backend)
+    file = context.chat_history.file
+    context.chat_history.append_system_message(text="Welcome")
+
+    # Blocks appended server-side (e.g. by a streaming plugin) are merged without a refresh
+    streamed = backend.append_block(file.id, text="Once upon a time")
+    merge_into_chat_history([streamed], context)
+    assert [b.text for b in file.blocks] == ["Welcome", "Once upon a time"]
+    assert chat_history_blocks_after(0, context) == [streamed]
+    assert chat_history_blocks_after(1, context) == []
+
+    # A known block is replaced in place
+    merge_into_chat_history([backend.get_block(streamed.id)], context)
+    assert len(file.blocks) == 2
+
+    # A gap falls back to a full refresh
+    backend.append_block(file.id, text="skipped")
+    last = backend.append_block(file.id, text="The end")
+    merge_into_chat_history([last], context)
+    assert [b.text for b in chat_history_blocks_after(1, context)] == [
+        "skipped",
+        "The end",
+    ]
+
+
+def test_quest_chat_history():
+    backend = LocalBackend()
+    context = _local_context(backend)
+    main_history = context.chat_history
+    main_history.append_system_message(
+        text="onboarding",
+        tags=[
+            Tag(kind=TagKindExtensions.INSTRUCTIONS, name=InstructionsTag.ONBOARDING)
+        ],
+    )
+    for text in ["inventory 1", "inventory 2"]:
+        main_history.append_system_message(
+            text=text,
+            tags=[Tag(kind=TagKindExtensions.CHARACTER, name=CharacterTag.INVENTORY)],
+        )
+    main_history.append_assistant_message(
+        text="summary 0",
+        tags=[
+            Tag(kind=TagKindExtensions.QUEST, name=QuestTag.QUEST_SUMMARY),
+            QuestIdTag("quest-0"),
+        ],
+    )
+
+    # A turn that starts a quest goes on in the quest's chat history
+    main_count = len(main_history.file.blocks)
+    with streamed_turn(context):
+        game_state = get_game_state(context)
+        quest = Quest(name="quest-1")
+        game_state.quests.append(quest)
+        game_state.current_quest = quest.name
+        start_quest_chat_history(quest, context)
+        save_game_state(game_state, context)
+        switch_history_to_current_quest(context)
+        context.chat_history.append_user_message(
+            text="go", tags=[QuestIdTag("quest-1")]
+        )
+        context.chat_history.append_system_message(text="status")
+
+    # The quest gets its own file, seeded with the shared context
+    quest_history = context.chat_history
+    assert chat_histories_since(main_history, context) == [
+        main_history,
+        quest_history,
+    ]
+    assert chat_histories_since(quest_history, context) == [quest_history]
+    assert quest_history.file.id == quest.chat_file_id != main_history.file.id
+    assert [b.text for b in quest_history.file.blocks] == [
+        "onboarding",
+        "inventory 2",
+        "summary 0",
+        "go",
+        "status",
+    ]
+    assert quest_history.file.blocks[2].chat_role == RoleTag.ASSISTANT
+    assert any(
+        QuestIdTag.matches(tag, "quest-0") for tag in quest_history.file.blocks[2].tags
+    )
+    assert get_quest_chat_history("quest-1", context) is quest_history
+    assert get_quest_chat_history("quest-0", context) is main_history
+
+    # The turn's story (but not the shared context) is copied to the streamed history, out of the way of generations
+    assert [
+        b.text for b in chat_history_blocks_after(main_count - 1, context, main_history)
+    ] == ["go", "status"]
+    assert is_block_excluded(main_history.file.blocks[-1])
+
+    # Ending the quest copies its summary back to the main history, and the rest of the turn to the streamed one
+    main_count = len(main_history.file.blocks)
+    with streamed_turn(context):
+        summary = quest_history.append_assistant_message(
+            text="summary 1",
+            tags=[
+                Tag(kind=TagKindExtensions.QUEST, name=QuestTag.QUEST_SUMMARY),
+                QuestIdTag("quest-1"),
+            ],
+        )
+        game_state.current_quest = None
+        save_game_state(game_state, context)
+        end_quest_chat_history([None, summary], context)
+        context.chat_history.append_system_message(text="back at camp")
+    assert context.chat_history is main_history
+    assert [
+        b.text for b in chat_history_blocks_after(main_count - 1, context, main_history)
+    ] == ["summary 1", "back at camp"]
+    assert [b.text for b in quest_history.file.blocks[-2:]] == [
+        "summary 1",
+        "back at camp",
+    ]
+    assert is_block_excluded(quest_history.file.blocks[-1])
+
+
+def test_generation_cache(monkeypatch):
+    backend = LocalBackend()
+    context = _local_context(backend)
+    context.metadata[_STORY_GENERATOR_KEY] = SimpleNamespace()  # Not used
+    blocks = [context.chat_history.append_system_message(text="Welcome")]
+
+    key = generation_cache_key(context, "Is this an attempt?", blocks)
+    assert get_cached_generation(context, key) is None
+    cache_generation(context, key, "YES")
+    assert get_cached_generation(context, key) == "YES"
+
+    # A different context is a different generation
+    blocks.append(context.chat_history.append_system_message(text="Hello"))
+    assert (
+        get_cached_generation(
+            context, generation_cache_key(context, "Is this an attempt?", blocks)
+        )
+        is None
+    )
+
+    # Expired generations are pruned as others are cached
+    monkeypatch.setattr(context_utils, "_generation_cache", OrderedDict())
+    cache_generation(context, key, "YES")
+    monkeypatch.setattr(context_utils.time, "time", lambda: float("inf"))
+    cache_generation(context, "another key", "NO")
+    assert len(context_utils._generation_cache) == 1
+    assert get_cached_generation(context, key) is None
@@ -1,8 +1,11 @@
+from collections import OrderedDict
+
 import toml
-from steamship import Block, File, Steamship, Tag
+from steamship import Block, File, Steamship, Tag, Task
 from steamship.agents.schema import AgentContext
 from steamship.data.tags.tag_constants import ChatTag, RoleTag, TagKind, TagValueKey
 
+import utils.generation_utils as generation_utils
 from agents.onboarding_agent import OnboardingAgent
 from endpoints.npc_endpoints import NpcMixin
 from endpoints.quest_endpoints import QuestMixin
@@ -10,6 +13,7 @@ from schema.camp import Camp
 from schema.characters import HumanCharacter, NpcCharacter
 from schema.game_state import GameState
 from schema.objects import Item
+from schema.quest import Quest
 from schema.server_settings import ServerSettings
 from utils.context_utils import (
     _GAME_STATE_KEY,
@@ -21,6 +25,8 @@ from utils.generation_utils import (
     generate_merchant_inventory,
     generate_quest_arc,
     generate_story_intro,
+    get_action_choices,
+    parse_action_choices,
     send_story_generation,
 )
 
@@ -119,6 +125,39 @@ def test_quest_arc():
             assert quest_description.location is not None
 
 
+def test_quest_arc_tops_up_missing_quests(monkeypatch):
+    responses = iter(
+        [
+            "QUEST GOAL: find a treat QUEST LOCATION: Dog Park\nQUEST GOAL: oops",
+            "QUEST GOAL: make a friend QUEST LOCATION: Main Street\n"
+            "QUEST GOAL: fetch the newspaper QUEST LOCATION: Owner's House\n"
+            "QUEST GOAL: win an award QUEST LOCATION: Westminister Dog Show",
+        ]
+    )
+    prompts = []
+
+    def do_generation(context, prompt, **kwargs):
+        prompts.append(prompt)
+        return Block(text=next(responses))
+
+    server_settings = ServerSettings(quests_per_arc=3, quest_arc_attempts=3)
+    monkeypatch.setattr(generation_utils, "do_generation", do_generation)
+    monkeypatch.setattr(
+        generation_utils, "get_server_settings", lambda context: server_settings
+    )
+
+    quest_arc = generate_quest_arc(player=HumanCharacter(name="Rex"), context=None)
+
+    assert [quest.location for quest in quest_arc] == [
+        "Dog Park",
+        "Main Street",
+        "Owner's House",
+    ]
+    assert len(prompts) == 2
+    assert "Please list 2 more quests" in prompts[1]
+    assert "QUEST GOAL: find a treat QUEST LOCATION: Dog Park" in prompts[1]
+
+
 def test_story_intro():
     with Steamship.temporary_workspace() as client:
         context, game_state = prepare_state(client)
@@ -167,3 +206,74 @@ def run_onboarding(context: AgentContext):
         agent.run(context)
     except RunNextAgentException:
         pass
+
+
+def test_parse_or_fix_up_only_asks_for_a_fix_when_parsing_fails(monkeypatch):
+    prompts = []
+
+    def do_generation(context, prompt, **kwargs):
+        prompts.append(prompt)
+        return Block(text='["pet the dog", "dance"]')
+
+    monkeypatch.setattr(generation_utils, "do_generation", do_generation)
+
+    assert parse_action_choices('["pet the dog",]', context=None) == ["pet the dog"]
+    assert not prompts
+    assert parse_action_choices("pet the dog, dance", context=None) == [
+        "pet the dog",
+        "dance",
+    ]
+    assert len(prompts) == 1
+    assert "pet the dog, dance" in prompts[0]
+
+
+def test_get_action_choices_generates_again_when_the_prefetch_is_slow(monkeypatch):
+    refreshes = []
+    monkeypatch.setattr(Task, "refresh", lambda self: refreshes.append(self.task_id))
+    monkeypatch.setattr(
+        generation_utils,
+        "get_current_quest",
+        lambda context: Quest(name="q", action_choices_task_id="prefetch"),
+    )
+    monkeypatch.setattr(
+        generation_utils,
+        "generate_action_choices",
+        lambda context: Block(text='["pet the dog", "dance"]'),
+    )
+    monkeypatch.setattr(
+        generation_utils, "_PREFETCHED_ACTION_CHOICES_WAIT_SECONDS", 0.01
+    )
+
+    context = AgentContext()
+    context.client = None
+    choices = get_action_choices(context)
+
+    assert choices == ["pet the dog", "dance"]
+    assert refreshes and set(refreshes) == {"prefetch"}
+
+
+def test_pending_cache_keys_are_bounded_and_expire(monkeypatch):
+    now = 1000
+    monkeypatch.setattr(generation_utils.time, "time", lambda: now)
+    monkeypatch.setattr(generation_utils, "_pending_cache_keys", OrderedDict())
+    monkeypatch.setattr(generation_utils, "_MAX_PENDING_CACHE_KEYS", 2)
+    for task_id in ["a", "b", "c"]:
+        generation_utils._remember_cache_key(task_id, f"key-{task_id}")
+
+    assert list(generation_utils._pending_cache_keys) == ["b", "c"]
+    assert generation_utils._take_cache_key("a") is None
+    assert generation_utils._take_cache_key("b") == "key-b"
+    assert generation_utils._take_cache_key("b") is None
+
+    now += generation_utils._PENDING_CACHE_KEY_SECONDS + 1
+    assert generation_utils._take_cache_key("c") is None
+    generation_utils._remember_cache_key("d", "key-d")
+    now += 1
+    generation_utils._remember_cache_key("e", "key-e")
+    assert generation_utils._take_cache_key("d") == "key-d"
+
+    # Expired keys are dropped as new ones come in
+    generation_utils._remember_cache_key("f", "key-f")
+    now += generation_utils._PENDING_CACHE_KEY_SECONDS + 1
+    generation_utils._remember_cache_key("g", "key-g")
+    assert list(generation_utils._pending_cache_keys) == ["g"]
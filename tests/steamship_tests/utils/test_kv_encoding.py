@@ -0,0 +1,30 @@
+from schema.game_state import GameState
+from schema.quest import Quest
+from schema.server_settings import ServerSettings
+from utils.kv_encoding import (
+    COMPRESSED,
+    ENCODING_FIELD,
+    INTERNED,
+    decode_value,
+    encode_value,
+)
+
+
+def test_encode_round_trip():
+    value = ServerSettings().dict()
+    encoded = encode_value(value)
+    assert encoded[ENCODING_FIELD] == COMPRESSED
+    assert decode_value(encoded) == value
+
+    gs = GameState()
+    gs.quests = [Quest(name=f"q{i}") for i in range(3)]
+    value = gs.dict()
+    encoded = encode_value(value, compress=False)
+    assert encoded[ENCODING_FIELD] == INTERNED
+    assert decode_value(encoded) == value
+
+
+def test_plain_values_pass_through():
+    assert encode_value({"version": 1}) == {"version": 1}
+    legacy = ServerSettings().dict()
+    assert decode_value(legacy) == legacy
@@ -0,0 +1,57 @@
+from types import SimpleNamespace
+
+from steamship import Tag
+from steamship.data.tags.tag_constants import RoleTag
+
+from schema.game_state import GameState
+from utils.context_utils import (
+    get_game_state,
+    get_server_settings,
+    save_game_state,
+    with_local_backend,
+)
+from utils.local_backend import LocalBackend
+from utils.tags import QuestIdTag
+
+
+def _local_context(backend: LocalBackend):
+    client = SimpleNamespace(config=SimpleNamespace(workspace_handle="test"))
+    context = backend.get_or_create_context(client, context_keys={"id": "default"})
+    return with_local_backend(backend, context)
+
+
+def test_local_chat_history():
+    backend = LocalBackend()
+    context = _local_context(backend)
+    context.chat_history.append_system_message(text="Welcome")
+    block = context.chat_history.append_user_message(
+        text="Hello", tags=[QuestIdTag("quest-1")]
+    )
+    assert block.index_in_file == 1
+    assert context.chat_history.last_user_message.text == "Hello"
+
+    backend.create_tag(block, kind="token_count", value={"number-value": 1})
+
+    # A new context sees the same file, blocks and tags
+    history = _local_context(backend).chat_history
+    assert [b.text for b in history.messages] == ["Welcome", "Hello"]
+    assert history.messages[1].chat_role == RoleTag.USER
+    assert any(QuestIdTag.matches(tag, "quest-1") for tag in history.messages[1].tags)
+    assert any(tag.kind == "token_count" for tag in history.messages[1].tags)
+    assert backend.get_block(block.id).text == "Hello"
+    assert isinstance(history.messages[1].tags[0], Tag)
+
+
+def test_local_game_state():
+    backend = LocalBackend()
+    context = _local_context(backend)
+    assert get_server_settings(context)
+
+    game_state = get_game_state(context)
+    game_state.player.name = "Ada"
+    save_game_state(game_state, context)
+
+    reloaded = get_game_state(_local_context(backend))
+    assert isinstance(reloaded, GameState)
+    assert reloaded.player.name == "Ada"
+    assert reloaded.persisted_version == 1
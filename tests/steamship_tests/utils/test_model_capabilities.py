@@ -0,0 +1,27 @@
+from utils.model_capabilities import (
+    DEFAULT_CONTEXT_WINDOW,
+    context_window_for_model,
+    prompt_budget,
+)
+
+
+def test_context_window_for_unknown_model_is_the_default():
+    assert context_window_for_model("gpt-4") == 8192
+    assert context_window_for_model("not-a-model") == DEFAULT_CONTEXT_WINDOW
+    assert context_window_for_model(None) == DEFAULT_CONTEXT_WINDOW
+
+
+def test_prompt_budget_fits_the_model_and_the_target():
+    assert prompt_budget("gpt-4", max_output_tokens=500) == 8192 - 500
+    assert prompt_budget("gpt-4-1106-preview", max_output_tokens=500) == 128000 - 500
+    assert (
+        prompt_budget(
+            "gpt-4-1106-preview", max_output_tokens=500, target_prompt_tokens=2048
+        )
+        == 2048
+    )
+    # The target never pushes the budget past what the model can take
+    assert (
+        prompt_budget("dolly_v2", max_output_tokens=500, target_prompt_tokens=2048)
+        == 2048 - 500
+    )
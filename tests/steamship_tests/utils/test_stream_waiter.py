@@ -0,0 +1,78 @@
+from typing import List
+
+import pytest
+from steamship import Block
+from steamship.data.block import StreamState
+
+from utils.stream_waiter import (
+    StreamNotifier,
+    StreamTimeoutError,
+    StreamWaiter,
+    StreamWaitStats,
+    set_stream_notifier,
+)
+
+
+def fetch_states(states: List[StreamState]):
+    fetched = []
+
+    def fetch(block: Block) -> Block:
+        fetched.append(block.id)
+        return Block(id=block.id, text="text", stream_state=states[len(fetched) - 1])
+
+    return fetch, fetched
+
+
+def test_wait_polls_until_the_stream_finishes():
+    StreamWaitStats.reset()
+    fetch, fetched = fetch_states(
+        [StreamState.STARTED, StreamState.STARTED, StreamState.COMPLETE]
+    )
+    waiter = StreamWaiter(initial_interval=0.001, max_interval=0.002, fetch=fetch)
+
+    block = waiter.wait(Block(id="block", stream_state=StreamState.STARTED))
+
+    assert block.stream_state == StreamState.COMPLETE
+    assert block.text == "text"
+    assert len(fetched) == 3
+    assert StreamWaitStats.summary()["waits"] == 1
+
+
+def test_wait_returns_finished_blocks_without_fetching():
+    fetch, fetched = fetch_states([])
+    block = Block(id="block", stream_state=StreamState.ABORTED)
+    assert StreamWaiter(fetch=fetch).wait(block) is block
+    assert not fetched
+
+
+def test_wait_gives_up_at_the_deadline():
+    fetch, fetched = fetch_states([StreamState.STARTED] * 1000)
+    waiter = StreamWaiter(initial_interval=0.001, deadline=0.01, fetch=fetch)
+
+    with pytest.raises(StreamTimeoutError) as e:
+        waiter.wait(Block(id="block", stream_state=StreamState.STARTED))
+
+    assert e.value.block.stream_state == StreamState.STARTED
+    assert 0 < len(fetched) < 1000
+
+
+def test_wait_blocks_on_a_registered_notifier():
+    class Notifier(StreamNotifier):
+        updates = 0
+
+        def wait_for_update(self, block: Block, timeout: float) -> bool:
+            self.updates += 1
+            return True
+
+    notifier = Notifier()
+    fetch, fetched = fetch_states([StreamState.STARTED, StreamState.COMPLETE])
+    set_stream_notifier(notifier)
+    try:
+        # Sleeping between polls would take minutes; the notifier returns at once
+        waiter = StreamWaiter(initial_interval=60, max_interval=60, fetch=fetch)
+        block = waiter.wait(Block(id="block", stream_state=StreamState.STARTED))
+    finally:
+        set_stream_notifier(None)
+
+    assert block.stream_state == StreamState.COMPLETE
+    assert notifier.updates == 2
@@ -0,0 +1,39 @@
+import pytest
+
+from utils.structured_output import extract_json, parse_json_list, parse_json_object
+
+
+@pytest.mark.parametrize(
+    "text, expected",
+    [
+        ('["a", "b"]', ["a", "b"]),
+        ('Here you go:\n```json\n["a", "b"]\n```', ["a", "b"]),
+        ('["a", "b",]', ["a", "b"]),
+        ("[“a”, “b”]", ["a", "b"]),
+        ('["a", "b"] and then ["c"]', ["a", "b"]),
+        ('["a", ', None),
+        ("no JSON here", None),
+        (None, None),
+    ],
+)
+def test_extract_json(text, expected):
+    assert extract_json(text, "[") == expected
+
+
+def test_extract_json_keeps_smart_quotes_inside_strings():
+    text = '{"description": "A sign reads “Keep out”.",}'
+    assert extract_json(text, "{") == {"description": "A sign reads “Keep out”."}
+
+
+def test_parse_json_object_checks_required_keys():
+    text = '{"name": "Bread", "description": "A loaf", "visualDescription": "A loaf"}'
+    keys = ["name", "description", "visualDescription"]
+    assert parse_json_object(text, keys)["name"] == "Bread"
+    assert parse_json_object('{"name": "Bread", "description": ""}', keys) is None
+    assert parse_json_object('["Bread"]', keys) is None
+
+
+def test_parse_json_list_checks_items():
+    assert parse_json_list('["pet the dog", "dance"]') == ["pet the dog", "dance"]
+    assert parse_json_list("[]") is None
+    assert parse_json_list('[{"action": "dance"}]') is None
@@ -0,0 +1,35 @@
+import utils.tokenizers as tokenizers
+from utils.tokenizers import (
+    CL100K,
+    DEFAULT_TOKENIZER,
+    LLAMA,
+    Tokenizer,
+    benchmark,
+    register_tokenizer,
+    tokenizer_for_model,
+)
+
+
+def test_tokenizer_for_model(monkeypatch):
+    monkeypatch.setattr(tokenizers, "_tokenizers", dict(tokenizers._tokenizers))
+    assert tokenizer_for_model("gpt-4-1106-preview") is CL100K
+    assert tokenizer_for_model("llama_v2") is LLAMA
+    assert tokenizer_for_model("unknown") is DEFAULT_TOKENIZER
+
+    custom = Tokenizer("custom")
+    register_tokenizer("custom-model", custom)
+    assert tokenizer_for_model("custom-model") is custom
+
+
+def test_estimates():
+    tokenizer = Tokenizer("estimate", chars_per_token=4.0, estimate_error=0.25)
+    assert not tokenizer.is_exact
+    assert tokenizer.estimate("") == 0
+    assert tokenizer.estimate("x" * 40) == 10
+    assert tokenizer.estimate_range("x" * 40) == (7, 13)
+    # Without an encoding, counts err on the high side
+    assert tokenizer.count("x" * 40) == 13
+
+    result = benchmark(tokenizer, ["x" * 40, "y" * 80])
+    assert result["texts"] == 2
+    assert result["in_range"] == 1.0